@@ -0,0 +1,265 @@
+import argparse
+import gzip
+import hashlib
+import json
+import threading
+import time
+from functools import lru_cache
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from flask import Flask, Response, abort, request
+from flask_cors import CORS
+
+from cohort_index import CATEGORICAL_FIELDS, CONDITIONS, NUMERIC_FIELDS, SOURCE_COLUMNS, CohortIndex, bitmap_rows, load_cohort
+from patient_store import EXPLANATION_STORE, PatientStore
+
+# Display columns served with each patient, as in build_dashboard_data.make_global_patients
+PATIENT_FIELDS = ["patient_id", "age", "sex", "risk_level", "risk_score", "systolic_bp", "hba1c", "egfr", "bmi", "bnp",
+                  "ejection_fraction", "diabetes_type", "ace_inhibitor_adherence", "statin_adherence", "missed_appointments_6mo"]
+PREDICTION_FIELDS = ["patient_id", "risk_level", "risk_score"]
+MAX_PAGE_SIZE = 1000
+# Responses smaller than this are sent uncompressed; gzip framing would outweigh the saving
+GZIP_MIN_BYTES = 1024
+# How often artifact mtimes are re-checked; a changed file bumps the version and invalidates ETags and cached bodies
+RELOAD_INTERVAL = 2.0
+
+
+class Snapshot:
+    """One consistent set of loaded artifacts. Never modified after construction: a reload builds a new Snapshot and
+    swaps the single ArtifactStore.snapshot reference, so a request that took one sees no mix of old and new."""
+    __slots__ = ("version", "frame", "index", "row_of", "patient_store", "shap_store", "columns", "explanations", "evaluation", "performance")
+
+    def __init__(self, version: str, frame: pd.DataFrame, index: CohortIndex, patient_store, shap_store, explanations: dict,
+                 evaluation, performance):
+        self.version, self.frame, self.index, self.row_of = version, frame, index, index.row_of
+        self.patient_store, self.shap_store = patient_store, shap_store
+        self.explanations, self.evaluation, self.performance = explanations, evaluation, performance
+        self.columns = [c for c in PATIENT_FIELDS if c in frame.columns]
+
+    def explanation(self, patient_id: str) -> dict | None:
+        # Keyed store first (one seek); the JSON sample and the SHAP store cover artifacts written before it existed
+        if self.patient_store is not None:
+            stored = self.patient_store.get(patient_id)
+            if stored is not None and "explanation" in stored:
+                return stored["explanation"]
+        record = self.explanations.get("patients", {}).get(patient_id)
+        if record is None and self.shap_store is not None:
+            record = self.shap_store.get(patient_id)
+        return record
+
+
+class ArtifactStore:
+    def __init__(self, data_dir: Path, dataset: Path):
+        self.data_dir = Path(data_dir)
+        self.dataset = Path(dataset)
+        self.lock = threading.Lock()
+        self.snapshot = None
+        self.checked = 0.0
+        # Called after every swap, e.g. to drop response-cache entries that pin the previous snapshot
+        self.on_reload = None
+        self.refresh(force=True)
+
+    def sources(self) -> list[Path]:
+        names = ["predictions.json", "patients.store", "explanations.json", "evaluation_trained.json", "evaluation.json", "performance_trained.json",
+                 f"shap/{EXPLANATION_STORE}"]
+        return [self.dataset] + [self.data_dir/n for n in names]
+
+    def fingerprint(self) -> str:
+        h = hashlib.sha1()
+        for p in self.sources():
+            if p.exists():
+                st = p.stat()
+                h.update(f"{p.name}:{st.st_mtime_ns}:{st.st_size};".encode())
+        return h.hexdigest()[:16]
+
+    def refresh(self, force: bool = False):
+        if not force and time.monotonic() - self.checked < RELOAD_INTERVAL:
+            return
+        with self.lock:
+            self.checked = time.monotonic()
+            version = self.fingerprint()
+            if self.snapshot is not None and version == self.snapshot.version:
+                return
+            self.snapshot = self.load(version)
+            if self.on_reload is not None:
+                self.on_reload()
+
+    def load(self, version: str) -> Snapshot:
+        # Everything is read into a new Snapshot; requests keep using the previous one until the reference is swapped
+        frame = load_cohort(self.dataset, self.data_dir/"predictions.json", extra=PATIENT_FIELDS)
+        index = self.load_index(frame)
+        # Old mappings stay valid for in-flight readers after the files are replaced, and are released once unreferenced
+        patient_store = self.open_store(self.data_dir/"patients.store")
+        shap_store = self.open_store(self.data_dir/"shap"/EXPLANATION_STORE)
+        return Snapshot(version, frame, index, patient_store, shap_store, self.read_json("explanations.json") or {},
+                        self.read_json("evaluation_trained.json") or self.read_json("evaluation.json"), self.read_json("performance_trained.json"))
+
+    def load_index(self, frame: pd.DataFrame) -> CohortIndex:
+        # A prebuilt cohort_index.npz is reused only if it is newer than its sources and covers the same patients in order
+        path = self.data_dir/"cohort_index.npz"
+        newest = max((p.stat().st_mtime for p in (self.dataset, self.data_dir/"predictions.json") if p.exists()), default=0)
+        if path.exists() and path.stat().st_mtime >= newest:
+            index = CohortIndex.load(path)
+            if index.n == len(frame) and np.array_equal(index.patient_ids, frame["patient_id"].astype(str).to_numpy()):
+                return index
+        return CohortIndex.build(frame[["patient_id"] + SOURCE_COLUMNS])
+
+    @staticmethod
+    def open_store(path: Path) -> PatientStore | None:
+        return PatientStore(path) if path.exists() else None
+
+    def read_json(self, name: str):
+        path = self.data_dir/name
+        return json.loads(path.read_text()) if path.exists() else None
+
+
+def records(frame: pd.DataFrame) -> list[dict]:
+    return frame.astype(object).where(frame.notna(), None).to_dict(orient="records")
+
+
+def parse_filters(args) -> dict:
+    # ?risk_level=high,critical&conditions=CKD&hba1c=7:9; ranges are always min:max, either bound may be empty (hba1c=7:)
+    filters = {}
+    for field in CATEGORICAL_FIELDS + ["conditions"]:
+        if args.get(field):
+            filters[field] = sorted(args[field].split(","))
+    unknown = sorted(set(filters.get("conditions", [])) - set(CONDITIONS))
+    if unknown:
+        abort(400, f"Unknown condition {', '.join(unknown)} (known: {', '.join(CONDITIONS)})")
+    for field in NUMERIC_FIELDS:
+        if args.get(field):
+            lo, sep, hi = args[field].partition(":")
+            if not sep:
+                abort(400, f"Range for {field} must be min:max (either side may be empty), got {args[field]}")
+            try:
+                filters[field] = (float(lo) if lo else None, float(hi) if hi else None)
+            except ValueError:
+                abort(400, f"Bad range for {field}: {args[field]}")
+    return filters
+
+
+def query_rows(store: Snapshot, filters: dict, sort: str | None, page: int, page_size: int) -> tuple[int, np.ndarray]:
+    if not sort:
+        # Unsorted pages come straight off the bitmap without materialising the other matches
+        res = store.index.query(filters, page=page, page_size=page_size)
+        return res["total"], res["rows"]
+    column = sort.lstrip("-")
+    if column not in store.frame.columns:
+        abort(400, f"Cannot sort by {column}")
+    rows = bitmap_rows(store.index.match(filters))
+    # Stable, so ties keep patient order; missing values go last in both directions
+    values = pd.Series(store.frame[column].to_numpy()[rows])
+    order = values.sort_values(ascending=not sort.startswith("-"), na_position="last", kind="stable").index.to_numpy()
+    return len(rows), rows[order[page * page_size:(page + 1) * page_size]]
+
+
+def list_payload(store: Snapshot, fields: list[str], args: dict) -> dict:
+    filters = parse_filters(args)
+    try:
+        page = max(0, int(args.get("page", 0)))
+        page_size = min(MAX_PAGE_SIZE, max(1, int(args.get("page_size", 50))))
+    except ValueError:
+        abort(400, "page and page_size must be integers")
+    total, rows = query_rows(store, filters, args.get("sort"), page, page_size)
+    return {"total": int(total), "page": page, "page_size": page_size, "items": records(store.frame.iloc[rows][fields])}
+
+
+def render(store: Snapshot, route: str, args: dict) -> tuple[bytes, bytes | None, str]:
+    version = store.version
+    if route == "patients":
+        payload = list_payload(store, store.columns, args)
+    elif route == "predictions":
+        payload = list_payload(store, [c for c in PREDICTION_FIELDS if c in store.frame.columns], args)
+    elif route == "summary":
+        filters = parse_filters(args)
+        # Per-level counts stay inside a risk_level filter, so they always add up to total
+        levels = filters.get("risk_level", ["low", "moderate", "high", "critical"])
+        payload = {"total": store.index.count(filters),
+                   "risk_level": {lvl: store.index.count({**filters, "risk_level": [lvl]}) if lvl in levels else 0
+                                  for lvl in ("low", "moderate", "high", "critical")}}
+    elif route == "patient":
+        pid = args["patient_id"]
+        if pid not in store.row_of:
+            abort(404)
+        payload = {**records(store.frame.iloc[[store.row_of[pid]]][store.columns])[0], "explanation": store.explanation(pid)}
+    elif route == "explanation":
+        payload = store.explanation(args["patient_id"])
+        if payload is None:
+            abort(404)
+    elif route == "global_importance":
+        payload = {"global_importance": store.explanations.get("global_importance", [])}
+    elif route == "evaluation":
+        if store.evaluation is None:
+            abort(404)
+        payload = store.evaluation
+    elif route == "performance":
+        if store.performance is None:
+            abort(404)
+        payload = store.performance
+    else:
+        payload = {"version": version, "patients": store.index.n}
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    gz = gzip.compress(body, compresslevel=5) if len(body) >= GZIP_MIN_BYTES else None
+    etag = hashlib.sha1(version.encode() + route.encode() + json.dumps(sorted(args.items())).encode()).hexdigest()
+    return body, gz, etag
+
+
+def create_app(data_dir: Path = Path("public/data"), dataset: Path = Path("public/processed_medical_dataset.csv"), cache_size: int = 1024) -> Flask:
+    app = Flask(__name__)
+    CORS(app)
+    store = ArtifactStore(data_dir, dataset)
+
+    @lru_cache(maxsize=cache_size)
+    def cached(route: str, args_key: tuple, snapshot: Snapshot):
+        # Keyed by the snapshot itself (identity), so a reloaded artifact never serves a stale body
+        return render(snapshot, route, dict(args_key))
+
+    # Entries keyed by an old snapshot can never hit again; clearing them releases its frame and index
+    store.on_reload = cached.cache_clear
+
+    def respond(route: str, **path_args):
+        store.refresh()
+        args = {k: v for k, v in request.args.items()}
+        args.update(path_args)
+        # One read of the reference: everything below works on the same snapshot even if a reload swaps it meanwhile
+        body, gz, etag = cached(route, tuple(sorted(args.items())), store.snapshot)
+        # Compressed bytes are a different representation, so they get their own strong validator
+        use_gz = gz is not None and "gzip" in request.headers.get("Accept-Encoding", "")
+        tag = f'"{etag}-gz"' if use_gz else f'"{etag}"'
+        headers = {"ETag": tag, "Cache-Control": "no-cache", "Vary": "Accept-Encoding"}
+        if tag in [t.strip() for t in request.headers.get("If-None-Match", "").split(",")]:
+            return Response(status=304, headers=headers)
+        if use_gz:
+            headers["Content-Encoding"] = "gzip"
+        return Response(gz if use_gz else body, mimetype="application/json", headers=headers)
+
+    app.add_url_rule("/api/version", "version", lambda: respond("version"))
+    app.add_url_rule("/api/patients", "patients", lambda: respond("patients"))
+    app.add_url_rule("/api/patients/<patient_id>", "patient", lambda patient_id: respond("patient", patient_id=patient_id))
+    app.add_url_rule("/api/predictions", "predictions", lambda: respond("predictions"))
+    app.add_url_rule("/api/summary", "summary", lambda: respond("summary"))
+    app.add_url_rule("/api/explanations", "global_importance", lambda: respond("global_importance"))
+    app.add_url_rule("/api/explanations/<patient_id>", "explanation", lambda patient_id: respond("explanation", patient_id=patient_id))
+    app.add_url_rule("/api/evaluation", "evaluation", lambda: respond("evaluation"))
+    app.add_url_rule("/api/performance", "performance", lambda: respond("performance"))
+    app.extensions["artifact_store"] = store
+    app.extensions["response_cache"] = cached
+    return app
+
+
+def main():
+    ap = argparse.ArgumentParser(description="JSON API over the dashboard artifacts with filtering, pagination, ETags and gzip")
+    ap.add_argument("--data_dir", default="public/data")
+    ap.add_argument("--dataset", default="public/processed_medical_dataset.csv")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=5000)
+    ap.add_argument("--cache_size", type=int, default=1024, help="Rendered responses kept in the in-process LRU")
+    args = ap.parse_args()
+    app = create_app(Path(args.data_dir), Path(args.dataset), cache_size=args.cache_size)
+    app.run(host=args.host, port=args.port, threaded=True)
+
+
+if __name__ == "__main__":
+    main()
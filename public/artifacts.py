@@ -0,0 +1,90 @@
+import json
+import os
+import shutil
+import tempfile
+from contextlib import contextmanager
+from pathlib import Path
+
+# Every artifact under public/data is written to a temporary sibling and renamed into place.
+# os.replace is atomic within one filesystem, so the web tier sees either the old file or the new one, never a partial write.
+
+
+def _read_umask() -> int:
+    umask = os.umask(0)
+    os.umask(umask)
+    return umask
+
+
+# Read once at import: os.umask can only be queried by setting it, which is racy once writer threads are running
+_UMASK = _read_umask()
+
+
+def _default_mode(base: int) -> int:
+    return base & ~_UMASK
+
+
+@contextmanager
+def atomic_path(path: Path):
+    """Yield a temporary path next to `path`; it replaces `path` when the block exits cleanly and is removed otherwise."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        yield Path(tmp)
+        # mkstemp creates 0600; published artifacts get the mode a plain open() would have given them
+        os.chmod(tmp, _default_mode(0o666))
+        os.replace(tmp, path)
+    except BaseException:
+        Path(tmp).unlink(missing_ok=True)
+        raise
+
+
+@contextmanager
+def atomic_open(path: Path, mode: str = "w"):
+    with atomic_path(path) as tmp, open(tmp, mode) as fh:
+        yield fh
+
+
+def write_text(path: Path, text: str) -> Path:
+    with atomic_open(path) as fh:
+        fh.write(text)
+    return Path(path)
+
+
+def write_json(path: Path, obj, **kwargs) -> Path:
+    with atomic_open(path) as fh:
+        json.dump(obj, fh, **kwargs)
+    return Path(path)
+
+
+@contextmanager
+def atomic_dir(path: Path):
+    """Yield an empty temporary directory that replaces the directory at `path` as a whole when the block exits cleanly.
+    Readers see the old set of files or the new one, never a mix; the path is briefly absent between the two renames."""
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(tempfile.mkdtemp(dir=path.parent, prefix=f".{path.name}.", suffix=".tmp"))
+    try:
+        yield tmp
+        os.chmod(tmp, _default_mode(0o777))
+        old = None
+        if path.exists():
+            old = path.with_name(f".{path.name}.{os.getpid()}.old")
+            os.replace(path, old)
+        os.replace(tmp, path)
+        if old is not None:
+            shutil.rmtree(old, ignore_errors=True)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def remove_dir(path: Path) -> None:
+    """Remove the directory at `path` as a whole: it is renamed aside first, so readers never see it half deleted."""
+    path = Path(path)
+    if not path.exists():
+        return
+    old = path.with_name(f".{path.name}.{os.getpid()}.old")
+    os.replace(path, old)
+    shutil.rmtree(old, ignore_errors=True)
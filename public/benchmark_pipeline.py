@@ -0,0 +1,373 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from artifacts import atomic_path, write_text
+
+SIZES = [15_000, 100_000, 1_000_000]
+SCRIPTS = ["process", "dashboard", "train"]
+# MedicalDatasetGenerator builds patients one at a time (~0.8 ms each); larger cohorts tile this many generated rows
+BASE_SIZE = 100_000
+# Share of each lab value blanked out, so imputation sees missing rows as it does on real extracts
+MISSING_RATE = 0.02
+SAMPLE_INTERVAL = 0.01
+# The running stage's peak so far is written out this often, so a stage killed by the OOM killer still shows its memory
+FLUSH_EVERY = 100
+# Stages under this at a size are timer noise: left out of exponent fits and baseline ratios
+MIN_SECONDS = 0.25
+MIN_MB = 5.0
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        # ru_maxrss is KiB on Linux; only a high-water mark, but good enough off Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageRecorder:
+    """Context manager factory passed as `stage=` to the pipeline functions: wall and CPU time plus peak RSS per stage.
+    A background thread samples RSS every SAMPLE_INTERVAL; results are flushed after every stage, so a run that is
+    killed for exceeding its timeout still reports the stages it finished and the one it was in."""
+
+    def __init__(self, result_path: Path | None = None):
+        self.result_path = result_path
+        self.stages = {}
+        self.running = None
+        self.open_peaks = {}
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.sampler = threading.Thread(target=self._sample, daemon=True)
+        self.sampler.start()
+
+    def _sample(self):
+        ticks = 0
+        while not self.done.wait(SAMPLE_INTERVAL):
+            self._update_peaks()
+            ticks += 1
+            if ticks % FLUSH_EVERY == 0 and self.running is not None:
+                self.flush()
+
+    def _update_peaks(self):
+        rss = rss_mb()
+        with self.lock:
+            for name, peak in self.open_peaks.items():
+                self.open_peaks[name] = max(peak, rss)
+
+    @contextlib.contextmanager
+    def __call__(self, name: str):
+        start_rss = rss_mb()
+        with self.lock:
+            self.open_peaks[name] = start_rss
+            self.running = name
+        self.flush()
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            seconds, cpu_seconds = time.perf_counter() - wall, time.process_time() - cpu
+            self._update_peaks()
+            with self.lock:
+                peak = self.open_peaks.pop(name)
+                self.stages[name] = {"seconds": seconds, "cpu_seconds": cpu_seconds, "start_rss_mb": start_rss, "peak_rss_mb": peak,
+                                     "peak_delta_mb": peak - start_rss}
+                self.running = None
+            self.flush()
+
+    def flush(self, **extra):
+        if self.result_path is None:
+            return
+        with self.lock:
+            state = {"stages": dict(self.stages), "running": self.running, "running_peak_rss_mb": self.open_peaks.get(self.running)}
+            write_text(self.result_path, json.dumps({**state, **extra}))
+
+    def close(self):
+        self.done.set()
+        self.sampler.join()
+
+
+def generate_cohort(size: int, cache_dir: Path, base_size: int = BASE_SIZE, missing_rate: float = MISSING_RATE, seed: int = 42) -> Path:
+    """Raw extract of `size` patients, cached under cache_dir. Up to base_size it is a prefix of one MedicalDatasetGenerator run;
+    beyond that the base is tiled with fresh ids and 1% jitter on float columns, streamed to disk one tile at a time."""
+    from datagenerator import MedicalDatasetGenerator
+    from process_medical_csv import LAB_COLS
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir/f"raw_{size}_b{base_size}_m{missing_rate:g}.csv"
+    if path.exists():
+        return path
+    base_path = cache_dir/f"base_{base_size}.csv"
+    if not base_path.exists():
+        print(f"Generating {base_size} base patients with MedicalDatasetGenerator (cached in {base_path})", flush=True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            base = MedicalDatasetGenerator(n_patients=base_size).generate_complete_dataset()
+        with atomic_path(base_path) as tmp:
+            base.to_csv(tmp, index=False)
+    base = pd.read_csv(base_path)
+
+    rng = np.random.default_rng(seed)
+    floats = [c for c in base.columns if base[c].dtype == np.float64]
+    labs = [c for c in LAB_COLS if c in base.columns]
+    with atomic_path(path) as tmp:
+        for offset in range(0, size, len(base)):
+            tile = base.iloc[:min(len(base), size - offset)].copy()
+            if offset:
+                tile["patient_id"] = [f"PAT_{i:08d}" for i in range(offset + 1, offset + len(tile) + 1)]
+                tile[floats] = tile[floats] * (1 + rng.normal(0, 0.01, (len(tile), len(floats))))
+            if missing_rate:
+                tile[labs] = tile[labs].mask(rng.random((len(tile), len(labs))) < missing_rate)
+            tile.to_csv(tmp, index=False, mode="a", header=offset == 0)
+    return path
+
+
+def run_script(script: str, workdir: Path, result_path: Path, params_path: str | None = None):
+    """One pipeline script at one size, in this (fresh) process; the stage results land in result_path."""
+    rec = StageRecorder(result_path)
+    started = time.perf_counter()
+    detail = {}
+    try:
+        if script == "process":
+            from process_medical_csv import process_dataset
+
+            with rec("read_csv"):
+                df = pd.read_csv(workdir/"raw.csv")
+            df = process_dataset(df, stage=rec)
+            with rec("write_csv"), atomic_path(workdir/"processed.csv") as tmp:
+                df.to_csv(tmp, index=False)
+        elif script == "dashboard":
+            from build_dashboard_data import build_dashboard, load_df
+
+            with rec("read_csv"):
+                df = load_df(str(workdir/"processed.csv"))
+            build_dashboard(df, workdir/"data", stage=rec)
+        else:
+            from train_models import load_tuned_params, prepare_data, train_and_write
+
+            params = load_tuned_params(Path(params_path)) if params_path else None
+            with rec("read_csv"):
+                df = pd.read_csv(workdir/"processed.csv")
+            with rec("prepare_data"):
+                X, y, pre, numeric_cols, categorical_cols = prepare_data(df)
+            with contextlib.redirect_stdout(io.StringIO()):
+                perf = train_and_write(df, X, y, pre, numeric_cols, categorical_cols, workdir/"data", params=params,
+                                       perf_history=workdir/"perf_history.jsonl", stage=rec, latency=False)
+            # fit_models' own split: preprocess, resample and per-member fit seconds
+            detail = {"fit_models": perf["timings"]}
+    finally:
+        rec.close()
+    rec.flush(total={"seconds": time.perf_counter() - started, "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024},
+              detail=detail)
+
+
+def bench_size(size: int, scripts: list[str], cache_dir: Path, timeout: float, base_size: int, missing_rate: float,
+               params_path: str | None) -> dict:
+    raw = generate_cohort(size, cache_dir, base_size, missing_rate)
+    workdir = cache_dir/f"n{size}"
+    workdir.mkdir(parents=True, exist_ok=True)
+    (workdir/"raw.csv").unlink(missing_ok=True)
+    (workdir/"raw.csv").symlink_to(raw.resolve())
+    (workdir/"processed.csv").unlink(missing_ok=True)
+
+    results = {}
+    for script in SCRIPTS:
+        if script not in scripts:
+            continue
+        if script != "process" and not (workdir/"processed.csv").exists():
+            if "process" in scripts:
+                results[script] = {"status": "skipped", "reason": "process did not finish", "stages": {}, "running": None}
+                print(f"n={size:>9} {script:<10} skipped", flush=True)
+                continue
+            # Dashboard/train without the process stage: fall back to processing outside the measurement
+            run_worker("process", workdir, None, timeout)
+        result_path = workdir/f"{script}.json"
+        result_path.unlink(missing_ok=True)
+        status = run_worker(script, workdir, result_path, timeout, params_path)
+        result = json.loads(result_path.read_text()) if result_path.exists() else {"stages": {}, "running": None}
+        result["status"] = status
+        results[script] = result
+        t = result.get("total", {}).get("seconds")
+        stopped = f"(stopped in {result.get('running')}" + (f" at {result['running_peak_rss_mb']:.0f} MiB)" if result.get("running_peak_rss_mb") else ")")
+        print(f"n={size:>9} {script:<10} {status:<9} " + (f"{t:8.2f}s" if t is not None else stopped), flush=True)
+    return results
+
+
+def run_worker(script: str, workdir: Path, result_path: Path | None, timeout: float, params_path: str | None = None) -> str:
+    # A fresh interpreter per script and size: RSS starts clean and a stage that blows its window can be killed
+    cmd = [sys.executable, str(Path(__file__).resolve()), "--worker", script, "--workdir", str(workdir),
+           "--result", str(result_path or workdir/"unmeasured.json")]
+    if params_path:
+        cmd += ["--params", params_path]
+    with (workdir/f"{script}.log").open("w") as log:
+        try:
+            proc = subprocess.run(cmd, stdout=log, stderr=subprocess.STDOUT, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            return "timeout"
+    # A negative return code is a signal, usually SIGKILL from the OOM killer
+    return "ok" if proc.returncode == 0 else "killed" if proc.returncode < 0 else "failed"
+
+
+def _fit_exponent(points: list[tuple[int, float]]) -> float | None:
+    if len(points) < 2:
+        return None
+    n, v = np.log([p[0] for p in points]), np.log([p[1] for p in points])
+    return float(np.polyfit(n, v, 1)[0])
+
+
+def scaling_exponents(runs: dict) -> dict:
+    """Log-log slope of seconds (and of the stage's own RSS growth) against cohort size, per script and stage.
+    `tail` uses only the two largest sizes, where a quadratic step shows up first."""
+    series = {}
+    for size, scripts in sorted(runs.items(), key=lambda kv: int(kv[0])):
+        for script, result in scripts.items():
+            for stage, m in result.get("stages", {}).items():
+                s = series.setdefault(script, {}).setdefault(stage, {"seconds": [], "memory": []})
+                if m["seconds"] >= MIN_SECONDS:
+                    s["seconds"].append((int(size), m["seconds"]))
+                if m["peak_delta_mb"] >= MIN_MB:
+                    s["memory"].append((int(size), m["peak_delta_mb"]))
+    out = {}
+    for script, stages in series.items():
+        for stage, s in stages.items():
+            out.setdefault(script, {})[stage] = {
+                "time": _fit_exponent(s["seconds"]),
+                "time_tail": _fit_exponent(s["seconds"][-2:]),
+                "memory": _fit_exponent(s["memory"]),
+                "sizes": [n for n, _ in s["seconds"]],
+            }
+    return out
+
+
+def environment() -> dict:
+    import sklearn
+
+    return {"python": platform.python_version(), "machine": platform.machine(), "cpus": os.cpu_count(), "node": platform.node(),
+            "numpy": np.__version__, "pandas": pd.__version__, "sklearn": sklearn.__version__}
+
+
+def compare_baseline(report: dict, baseline: dict, time_factor: float = 1.5, memory_factor: float = 1.5,
+                     exponent_slack: float = 0.25) -> list[dict]:
+    flagged = []
+    for size, scripts in report["runs"].items():
+        for script, result in scripts.items():
+            before = baseline.get("runs", {}).get(size, {}).get(script)
+            if before is None:
+                continue
+            if result.get("status") != "ok" and before.get("status") == "ok":
+                flagged.append({"size": int(size), "script": script, "stage": result.get("running") or "-", "metric": "status",
+                                "baseline": "ok", "current": result.get("status")})
+            for stage, m in result.get("stages", {}).items():
+                b = before.get("stages", {}).get(stage)
+                if b is None:
+                    continue
+                if b["seconds"] >= MIN_SECONDS and m["seconds"] / b["seconds"] >= time_factor:
+                    flagged.append({"size": int(size), "script": script, "stage": stage, "metric": "seconds",
+                                    "baseline": b["seconds"], "current": m["seconds"], "ratio": m["seconds"] / b["seconds"]})
+                if b["peak_delta_mb"] >= MIN_MB and m["peak_delta_mb"] / b["peak_delta_mb"] >= memory_factor:
+                    flagged.append({"size": int(size), "script": script, "stage": stage, "metric": "peak_delta_mb",
+                                    "baseline": b["peak_delta_mb"], "current": m["peak_delta_mb"], "ratio": m["peak_delta_mb"] / b["peak_delta_mb"]})
+    for script, stages in report["scaling"].items():
+        for stage, e in stages.items():
+            b = baseline.get("scaling", {}).get(script, {}).get(stage)
+            # Exponents are only comparable when fitted over the same sizes
+            if b is None or e["time"] is None or b["time"] is None or e["sizes"] != b["sizes"]:
+                continue
+            if e["time"] - b["time"] > exponent_slack:
+                flagged.append({"script": script, "stage": stage, "metric": "time_exponent", "baseline": b["time"], "current": e["time"]})
+    return flagged
+
+
+def print_table(report: dict):
+    sizes = sorted(report["runs"], key=int)
+    print(f"\n{'stage':<34}" + "".join(f"{int(n):>12,}" for n in sizes) + "   exponent (tail)   peak MiB @max")
+    for script in SCRIPTS:
+        names = []
+        for n in sizes:
+            for stage in report["runs"][n].get(script, {}).get("stages", {}):
+                if stage not in names:
+                    names.append(stage)
+        for stage in names:
+            cells = []
+            for n in sizes:
+                m = report["runs"][n].get(script, {}).get("stages", {}).get(stage)
+                cells.append(f"{m['seconds']:>11.2f}s" if m else f"{'-':>12}")
+            e = report["scaling"].get(script, {}).get(stage, {})
+            exp = f"{e['time']:.2f} ({e['time_tail']:.2f})" if e.get("time") is not None else "-"
+            last = next((report["runs"][n][script]["stages"][stage] for n in reversed(sizes)
+                         if stage in report["runs"][n].get(script, {}).get("stages", {})), None)
+            print(f"{script + '.' + stage:<34}" + "".join(cells) + f"   {exp:<16}  {last['peak_rss_mb']:>8.0f}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Scaling benchmark: time and memory of every pipeline stage on synthetic cohorts of fixed sizes")
+    ap.add_argument("--sizes", type=int, nargs="+", default=SIZES, help="Cohort sizes; add 10000000 for the optional 10M run")
+    ap.add_argument("--scripts", nargs="+", choices=SCRIPTS, default=SCRIPTS)
+    ap.add_argument("--cache_dir", default="public/.cache/bench", help="Generated cohorts and per-size working directories")
+    ap.add_argument("--base_size", type=int, default=BASE_SIZE, help="Patients generated by MedicalDatasetGenerator; larger cohorts tile them")
+    ap.add_argument("--missing_rate", type=float, default=MISSING_RATE)
+    ap.add_argument("--params", default=None, help="Tuned hyperparameters JSON for train (default: train_models' usual lookup)")
+    ap.add_argument("--timeout", type=float, default=3600, help="Seconds allowed per script and size before it is killed")
+    ap.add_argument("--output", default="public/data/benchmark_report.json")
+    ap.add_argument("--baseline", default="public/data/benchmark_baseline.json")
+    ap.add_argument("--save_baseline", action="store_true", help="Store this run as the baseline instead of comparing against it")
+    ap.add_argument("--time_factor", type=float, default=1.5, help="Flag a stage whose seconds grow by this factor over the baseline")
+    ap.add_argument("--memory_factor", type=float, default=1.5, help="Flag a stage whose own RSS growth rises by this factor over the baseline")
+    ap.add_argument("--exponent_slack", type=float, default=0.25, help="Flag a stage whose time-scaling exponent rises by more than this")
+    ap.add_argument("--fail_on_regression", action="store_true")
+    ap.add_argument("--worker", choices=SCRIPTS, help=argparse.SUPPRESS)
+    ap.add_argument("--workdir", help=argparse.SUPPRESS)
+    ap.add_argument("--result", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.worker:
+        run_script(args.worker, Path(args.workdir), Path(args.result), args.params)
+        return
+
+    cache_dir = Path(args.cache_dir)
+    runs = {}
+    for size in sorted(args.sizes):
+        runs[str(size)] = bench_size(size, args.scripts, cache_dir, args.timeout, args.base_size, args.missing_rate, args.params)
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "settings": {"sizes": sorted(args.sizes), "scripts": args.scripts, "base_size": args.base_size, "missing_rate": args.missing_rate,
+                     "timeout": args.timeout},
+        "runs": runs,
+        "scaling": scaling_exponents(runs),
+    }
+    baseline_path = Path(args.baseline)
+    if not args.save_baseline and baseline_path.exists():
+        baseline = json.loads(baseline_path.read_text())
+        report["baseline"] = {"timestamp": baseline.get("timestamp"), "environment": baseline.get("environment")}
+        if baseline.get("environment") != report["environment"]:
+            print("Note: baseline was recorded on a different machine or library set; ratios are indicative only")
+        report["regressions"] = compare_baseline(report, baseline, args.time_factor, args.memory_factor, args.exponent_slack)
+    write_text(Path(args.output), json.dumps(report, indent=2))
+    if args.save_baseline:
+        write_text(baseline_path, json.dumps(report, indent=2))
+
+    print_table(report)
+    for r in report.get("regressions", []):
+        where = f"n={r['size']} " if "size" in r else ""
+        change = f"{r['baseline']:.4g} -> {r['current']:.4g}" if isinstance(r["current"], float) else f"{r['baseline']} -> {r['current']}"
+        print(f"REGRESSION {where}{r['script']}.{r['stage']} {r['metric']}: {change}")
+    print(f"Wrote {args.output}" + (f" and baseline {baseline_path}" if args.save_baseline else ""))
+    if args.fail_on_regression and report.get("regressions"):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,12 @@
 import argparse
-import json
+from contextlib import nullcontext
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
 
+from artifacts import write_json
+
 
 def load_df(path: str) -> pd.DataFrame:
     return pd.read_csv(path)
@@ -118,26 +120,24 @@ def make_eval_curves(df: pd.DataFrame) -> dict:
     return {"roc": roc(), "pr": pr(), "calibration": calibration(), "confusion": confusion()}
 
 
+def build_dashboard(df: pd.DataFrame, outdir: Path, stage=nullcontext) -> list[Path]:
+    outdir = Path(outdir)
+    with stage("make_global_patients"):
+        patients = make_global_patients(df)
+    with stage("make_eval_curves"):
+        eval_data = make_eval_curves(df)
+    with stage("write_json"):
+        return [write_json(outdir/"global_patients.json", patients), write_json(outdir/"evaluation.json", eval_data)]
+
+
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", default="public/processed_medical_dataset.csv")
     ap.add_argument("--outdir", default="public/data")
     args = ap.parse_args()
 
-    inp = Path(args.input)
-    outdir = Path(args.outdir)
-    outdir.mkdir(parents=True, exist_ok=True)
-
-    df = load_df(str(inp))
-    patients = make_global_patients(df)
-    with (outdir/"global_patients.json").open("w") as f:
-        json.dump(patients, f)
-
-    eval_data = make_eval_curves(df)
-    with (outdir/"evaluation.json").open("w") as f:
-        json.dump(eval_data, f)
-
-    print(f"Wrote: {outdir/'global_patients.json'} and {outdir/'evaluation.json'}")
+    written = build_dashboard(load_df(args.input), Path(args.outdir))
+    print(f"Wrote: {written[0]} and {written[1]}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,381 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from artifacts import atomic_open
+
+# Field layout mirrors the global dashboard filters in js/global-bridge.js
+CATEGORICAL_FIELDS = ["risk_level", "diabetes_type", "age_band", "sex", "race", "smoking_status", "obesity_class"]
+NUMERIC_FIELDS = ["hba1c", "egfr", "systolic_bp", "bmi", "age", "bnp", "ejection_fraction", "ldl_cholesterol", "risk_score"]
+AGE_BANDS = ["18-34", "35-49", "50-64", "65+"]
+# Condition flags as the dashboard heatmap defines them
+CONDITIONS = {
+    "HF": lambda c: (c["systolic_bp"] >= 130) | (c["bnp"] >= 400),
+    "T1D": lambda c: c["diabetes_type"] == "type1",
+    "T2D": lambda c: c["diabetes_type"] == "type2",
+    "Obesity": lambda c: c["bmi"] >= 30,
+    "CKD": lambda c: c["egfr"] < 60,
+}
+# Dataset columns the index is built from (age_band is derived from age)
+SOURCE_COLUMNS = [c for c in CATEGORICAL_FIELDS + NUMERIC_FIELDS if c != "age_band"]
+RANGE_BINS = 64
+# Rescored rows are answered from the overlay until they exceed this share of the cohort, then the ranges are rebuilt
+COMPACT_FRACTION = 0.05
+
+_M1, _M2, _M4, _H01 = (np.uint64(m) for m in (0x5555555555555555, 0x3333333333333333, 0x0F0F0F0F0F0F0F0F, 0x0101010101010101))
+
+
+def word_counts(words: np.ndarray) -> np.ndarray:
+    # SWAR popcount over whole uint64 words; ~3x faster than a 16-bit lookup table with NumPy < 2 (no np.bitwise_count)
+    x = words - ((words >> np.uint64(1)) & _M1)
+    x = (x & _M2) + ((x >> np.uint64(2)) & _M2)
+    x = (x + (x >> np.uint64(4))) & _M4
+    return (x * _H01) >> np.uint64(56)
+
+
+def popcount(words: np.ndarray) -> int:
+    return int(word_counts(words).sum())
+
+
+def pack(mask: np.ndarray, n_words: int) -> np.ndarray:
+    # Bit i of the bitmap is row i: little-endian bytes inside little-endian uint64 words
+    out = np.zeros(n_words * 8, dtype=np.uint8)
+    packed = np.packbits(np.asarray(mask, dtype=bool), bitorder="little")
+    out[:len(packed)] = packed
+    return out.view(np.uint64)
+
+
+def rows_to_bitmap(rows: np.ndarray, n_words: int) -> np.ndarray:
+    out = np.zeros(n_words, dtype=np.uint64)
+    rows = np.asarray(rows, dtype=np.int64)
+    np.bitwise_or.at(out, rows >> 6, np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64)))
+    return out
+
+
+def bitmap_rows(words: np.ndarray, start: int = 0, limit: int | None = None) -> np.ndarray:
+    # Row ids of set bits start..start+limit, unpacking only the words that hold them
+    counts = np.cumsum(word_counts(words), dtype=np.int64)
+    total = int(counts[-1]) if len(counts) else 0
+    end = total if limit is None else min(total, start + limit)
+    if start >= end:
+        return np.zeros(0, dtype=np.int64)
+    w0 = int(np.searchsorted(counts, start, side="right"))
+    w1 = int(np.searchsorted(counts, end, side="left")) + 1
+    bits = np.flatnonzero(np.unpackbits(words[w0:w1].view(np.uint8), bitorder="little")) + w0 * 64
+    skip = start - (int(counts[w0 - 1]) if w0 else 0)
+    return bits[skip:skip + end - start]
+
+
+def derive_columns(frame: pd.DataFrame) -> dict:
+    cols = {c: frame[c].to_numpy() for c in frame.columns}
+    age = cols["age"].astype(np.float64)
+    cols["age_band"] = np.where(age < 35, AGE_BANDS[0], np.where(age < 50, AGE_BANDS[1], np.where(age < 65, AGE_BANDS[2], AGE_BANDS[3])))
+    for name, rule in CONDITIONS.items():
+        cols[f"cond_{name}"] = np.asarray(rule(cols), dtype=bool)
+    return cols
+
+
+def load_cohort(dataset: Path, predictions: Path | None = None, extra: list[str] | None = None) -> pd.DataFrame:
+    # extra: display-only columns carried along for callers such as the API; they are not indexed
+    sources = ["patient_id"] + SOURCE_COLUMNS
+    sources += [c for c in extra or [] if c not in sources]
+    header = pd.read_csv(dataset, nrows=0).columns
+    df = pd.read_csv(dataset, usecols=[c for c in sources if c in header])
+    if predictions is not None and Path(predictions).exists():
+        # Model output wins over the extract's own risk columns; risk_score there is 0-100
+        pred = pd.read_json(predictions)[["patient_id", "risk_level", "risk_score"]]
+        df = df.drop(columns=[c for c in ("risk_level", "risk_score") if c in df.columns]).merge(pred, on="patient_id", how="left")
+    for c in SOURCE_COLUMNS:
+        if c not in df.columns:
+            df[c] = np.nan
+    return df[[c for c in sources if c in df.columns]]
+
+
+class CohortIndex:
+    def __init__(self, patient_ids: np.ndarray, raw: dict, bitmaps: dict, ranges: dict):
+        self.patient_ids = patient_ids
+        self.n = len(patient_ids)
+        self.n_words = (self.n + 63) // 64
+        self.raw = raw
+        self.bitmaps = bitmaps
+        self.ranges = ranges
+        self.row_of = {pid: i for i, pid in enumerate(patient_ids.tolist())}
+        self.dirty = np.zeros(self.n_words, dtype=np.uint64)
+        self.dirty_rows = np.zeros(0, dtype=np.int64)
+
+    @classmethod
+    def build(cls, df: pd.DataFrame, bins: int = RANGE_BINS) -> "CohortIndex":
+        cols = derive_columns(df.drop(columns=["patient_id"]))
+        n_words = (len(df) + 63) // 64
+        bitmaps = {}
+        for field in CATEGORICAL_FIELDS:
+            values = pd.Series(cols[field])
+            labels = values.astype(str).to_numpy()
+            for v in values.dropna().astype(str).unique():
+                bitmaps[f"{field}={v}"] = pack(labels == v, n_words)
+        for name in CONDITIONS:
+            bitmaps[f"cond_{name}"] = pack(cols[f"cond_{name}"], n_words)
+        raw = {c: cols[c] for c in df.columns if c != "patient_id"}
+        ranges = {f: build_range(np.asarray(cols[f], dtype=np.float64), n_words, bins) for f in NUMERIC_FIELDS}
+        return cls(df["patient_id"].astype(str).to_numpy(), raw, bitmaps, ranges)
+
+    def save(self, path: Path):
+        # Fixed-width strings so the file loads without pickle
+        arrays = {"patient_ids": self.patient_ids.astype(str)}
+        for k, v in self.bitmaps.items():
+            arrays[f"bitmap/{k}"] = v
+        for f, r in self.ranges.items():
+            for k, v in r.items():
+                arrays[f"range/{f}/{k}"] = v
+        for c, v in self.raw.items():
+            arrays[f"raw/{c}"] = v.astype(str) if v.dtype == object else v
+        with atomic_open(path, "wb") as f:
+            np.savez(f, **arrays)
+
+    @classmethod
+    def load(cls, path: Path) -> "CohortIndex":
+        data = np.load(path, allow_pickle=False)
+        bitmaps, ranges, raw = {}, {}, {}
+        for key in data.files:
+            kind, _, rest = key.partition("/")
+            if kind == "bitmap":
+                bitmaps[rest] = data[key]
+            elif kind == "range":
+                field, _, part = rest.partition("/")
+                ranges.setdefault(field, {})[part] = data[key]
+            elif kind == "raw":
+                raw[rest] = data[key]
+        return cls(data["patient_ids"], raw, bitmaps, ranges)
+
+    def _categorical(self, field: str, values) -> np.ndarray:
+        values = [values] if isinstance(values, str) else values
+        out = np.zeros(self.n_words, dtype=np.uint64)
+        for v in values:
+            bm = self.bitmaps.get(f"{field}={v}")
+            if bm is not None:
+                out |= bm
+        return out
+
+    def _range(self, field: str, lo, hi) -> np.ndarray:
+        lo = -np.inf if lo is None else float(lo)
+        hi = np.inf if hi is None else float(hi)
+        out = range_bitmap(self.ranges[field], lo, hi, self.n_words)
+        if len(self.dirty_rows):
+            # Rescored rows: drop their stale range bits and test their current values directly
+            out &= ~self.dirty
+            v = np.asarray(self.raw[field][self.dirty_rows], dtype=np.float64)
+            hit = self.dirty_rows[(v >= lo) & (v <= hi)]
+            if len(hit):
+                out |= rows_to_bitmap(hit, self.n_words)
+        return out
+
+    def match(self, filters: dict) -> np.ndarray:
+        """Bitmap of rows matching every filter. Categorical fields take a value or a list of values (OR),
+        "conditions" takes a list of condition names (AND), numeric fields take [lo, hi] with None for open ends (inclusive)."""
+        out = np.full(self.n_words, np.uint64(0xFFFFFFFFFFFFFFFF))
+        if self.n % 64:
+            out[-1] = np.uint64((1 << (self.n % 64)) - 1)
+        for field, cond in filters.items():
+            if cond is None:
+                continue
+            if field == "conditions":
+                for name in ([cond] if isinstance(cond, str) else cond):
+                    if name not in CONDITIONS:
+                        raise KeyError(f"Unknown condition: {name}")
+                    out &= self.bitmaps[f"cond_{name}"]
+            elif field in self.ranges:
+                lo, hi = cond
+                out &= self._range(field, lo, hi)
+            elif field in CATEGORICAL_FIELDS:
+                out &= self._categorical(field, cond)
+            else:
+                raise KeyError(f"Unknown filter field: {field}")
+        return out
+
+    def count(self, filters: dict) -> int:
+        return popcount(self.match(filters))
+
+    def query(self, filters: dict, page: int = 0, page_size: int = 50) -> dict:
+        bm = self.match(filters)
+        rows = bitmap_rows(bm, page * page_size, page_size)
+        return {"total": popcount(bm), "page": page, "page_size": page_size, "rows": rows, "patient_ids": self.patient_ids[rows].tolist()}
+
+    def update(self, frame: pd.DataFrame):
+        """Apply rescored or edited values for existing patients. Categorical and condition bits are flipped in place;
+        numeric ranges go through the overlay and are rebuilt once enough rows are dirty."""
+        rows = np.array([self.row_of[str(pid)] for pid in frame["patient_id"]], dtype=np.int64)
+        for c in frame.columns:
+            if c in self.raw:
+                col = self.raw[c]
+                if col.dtype.kind == "U" and frame[c].astype(str).str.len().max() > col.dtype.itemsize // 4:
+                    self.raw[c] = col = col.astype(object)
+                col[rows] = frame[c].to_numpy()
+        cur = derive_columns(pd.DataFrame({c: v[rows] for c, v in self.raw.items()}))
+        bit = np.left_shift(np.uint64(1), (rows & 63).astype(np.uint64))
+        word = rows >> 6
+        for field in CATEGORICAL_FIELDS:
+            for key in [k for k in self.bitmaps if k.startswith(field + "=")]:
+                # ufunc.at: several updated rows can share a word
+                np.bitwise_and.at(self.bitmaps[key], word, ~bit)
+            labels = pd.Series(cur[field]).astype(str).where(pd.Series(cur[field]).notna()).to_numpy()
+            for v in pd.unique(labels[pd.notna(labels)]):
+                sel = labels == v
+                key = f"{field}={v}"
+                if key not in self.bitmaps:
+                    self.bitmaps[key] = np.zeros(self.n_words, dtype=np.uint64)
+                np.bitwise_or.at(self.bitmaps[key], word[sel], bit[sel])
+        for name in CONDITIONS:
+            bm = self.bitmaps[f"cond_{name}"]
+            np.bitwise_and.at(bm, word, ~bit)
+            sel = cur[f"cond_{name}"]
+            np.bitwise_or.at(bm, word[sel], bit[sel])
+        if any(c in NUMERIC_FIELDS for c in frame.columns):
+            self.dirty |= rows_to_bitmap(rows, self.n_words)
+            self.dirty_rows = bitmap_rows(self.dirty)
+            if len(self.dirty_rows) > COMPACT_FRACTION * self.n:
+                self.compact()
+
+    def compact(self):
+        bins = len(next(iter(self.ranges.values()))["cum"]) if self.ranges else RANGE_BINS
+        self.ranges = {f: build_range(np.asarray(self.raw[f], dtype=np.float64), self.n_words, bins) for f in NUMERIC_FIELDS}
+        self.dirty[:] = 0
+        self.dirty_rows = np.zeros(0, dtype=np.int64)
+
+
+def build_range(values: np.ndarray, n_words: int, bins: int = RANGE_BINS) -> dict:
+    # Rows sorted by value, cut into equal-count bins; cum[j] holds every row in bins 0..j
+    present = np.flatnonzero(~np.isnan(values))
+    order = present[np.argsort(values[present], kind="stable")]
+    bounds = np.linspace(0, len(order), bins + 1).astype(np.int64)
+    # Missing values sit past the last bin so no cumulative bitmap includes them
+    bin_of = np.full(len(values), bins, dtype=np.int64)
+    bin_of[order] = np.searchsorted(bounds, np.arange(len(order)), side="right") - 1
+    cum = np.stack([pack(bin_of <= j, n_words) for j in range(bins)])
+    return {"sorted": values[order], "order": order.astype(np.int32 if len(values) < 2**31 else np.int64), "bounds": bounds, "cum": cum}
+
+
+def range_bitmap(r: dict, lo: float, hi: float, n_words: int) -> np.ndarray:
+    # Whole bins come from two cumulative bitmaps; only the rows of the two edge bins are set individually
+    sv, order, bounds, cum = r["sorted"], r["order"], r["bounds"], r["cum"]
+    p_lo = int(np.searchsorted(sv, lo, side="left"))
+    p_hi = int(np.searchsorted(sv, hi, side="right"))
+    if p_hi <= p_lo:
+        return np.zeros(n_words, dtype=np.uint64)
+    i0 = int(np.searchsorted(bounds, p_lo, side="left"))
+    i1 = int(np.searchsorted(bounds, p_hi, side="right")) - 1
+    if i1 <= i0:
+        return rows_to_bitmap(order[p_lo:p_hi], n_words)
+    out = cum[i1 - 1].copy()
+    if i0 > 0:
+        out &= ~cum[i0 - 1]
+    # Each edge bin is either added row by row or taken whole minus its out-of-range rows, whichever touches fewer rows
+    add, drop = [], []
+    if i0 > 0 and p_lo < bounds[i0]:
+        if bounds[i0] - p_lo <= p_lo - bounds[i0 - 1]:
+            add.append(order[p_lo:bounds[i0]])
+        else:
+            out |= cum[i0 - 1] & ~cum[i0 - 2] if i0 > 1 else cum[0]
+            drop.append(order[bounds[i0 - 1]:p_lo])
+    if i1 < len(cum) and p_hi > bounds[i1]:
+        if p_hi - bounds[i1] <= bounds[i1 + 1] - p_hi:
+            add.append(order[bounds[i1]:p_hi])
+        else:
+            out |= cum[i1] & ~cum[i1 - 1]
+            drop.append(order[p_hi:bounds[i1 + 1]])
+    if drop:
+        out &= ~rows_to_bitmap(np.concatenate(drop), n_words)
+    if add:
+        out |= rows_to_bitmap(np.concatenate(add), n_words)
+    return out
+
+
+def parse_filter(spec: str) -> tuple[str, object]:
+    # CLI form: field=a,b for categories, conditions=CKD,HF, field=lo:hi for ranges (either side may be empty)
+    field, _, value = spec.partition("=")
+    if field in NUMERIC_FIELDS:
+        lo, sep, hi = value.partition(":")
+        if not sep:
+            raise ValueError(f"Range for {field} must be lo:hi (either side may be empty), got {value}")
+        return field, (float(lo) if lo else None, float(hi) if hi else None)
+    return field, value.split(",")
+
+
+def tile_cohort(df: pd.DataFrame, n: int, seed: int = 42) -> pd.DataFrame:
+    # Benchmark cohort: repeat the extract with fresh ids and a little jitter so range bins are not all ties
+    reps = int(np.ceil(n / len(df)))
+    big = pd.concat([df] * reps, ignore_index=True).iloc[:n].copy()
+    big["patient_id"] = [f"PAT_{i:08d}" for i in range(n)]
+    rng = np.random.default_rng(seed)
+    for c in NUMERIC_FIELDS:
+        if c in big.columns and c != "age":
+            big[c] = big[c] * (1 + rng.normal(0, 0.01, n))
+    return big
+
+
+def benchmark(index: CohortIndex, queries: list[dict], repeats: int = 50) -> list[dict]:
+    results = []
+    for q in queries:
+        index.count(q)
+        times = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            total = index.count(q)
+            times.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        index.query(q, page=3, page_size=50)
+        page_ms = (time.perf_counter() - start) * 1000
+        results.append({"filters": q, "count": total, "count_ms_p50": float(np.median(times) * 1000), "page_ms": page_ms})
+    return results
+
+
+BENCH_QUERIES = [
+    {"risk_level": ["high", "critical"]},
+    {"risk_level": ["high", "critical"], "diabetes_type": "type2", "age_band": ["50-64", "65+"]},
+    {"hba1c": (7.0, None)},
+    {"hba1c": (7.0, 9.0), "egfr": (None, 60), "systolic_bp": (130, None)},
+    {"risk_level": "critical", "conditions": ["CKD", "HF"], "hba1c": (6.5, None), "age_band": "65+"},
+]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Bitmap cohort index over the processed dataset and model predictions")
+    ap.add_argument("--input", default="public/processed_medical_dataset.csv")
+    ap.add_argument("--predictions", default="public/data/predictions.json")
+    ap.add_argument("--index", default="public/data/cohort_index.npz")
+    ap.add_argument("--bins", type=int, default=RANGE_BINS, help="Equal-count bins per numeric field")
+    ap.add_argument("--filter", action="append", default=[], help="Query the saved index, e.g. risk_level=high,critical hba1c=7: conditions=CKD")
+    ap.add_argument("--page", type=int, default=0)
+    ap.add_argument("--page_size", type=int, default=50)
+    ap.add_argument("--bench", type=int, default=None, help="Build an N-patient tiled cohort in memory and time the benchmark queries")
+    args = ap.parse_args()
+
+    if args.filter:
+        index = CohortIndex.load(args.index)
+        start = time.perf_counter()
+        res = index.query(dict(parse_filter(f) for f in args.filter), page=args.page, page_size=args.page_size)
+        res["ms"] = (time.perf_counter() - start) * 1000
+        res.pop("rows")
+        print(json.dumps(res, indent=2))
+        return
+
+    df = load_cohort(Path(args.input), Path(args.predictions))
+    if args.bench:
+        df = tile_cohort(df, args.bench)
+    start = time.perf_counter()
+    index = CohortIndex.build(df, bins=args.bins)
+    build_s = time.perf_counter() - start
+    if args.bench:
+        print(f"Built index over {index.n} patients in {build_s:.1f}s")
+        for r in benchmark(index, BENCH_QUERIES):
+            print(f"{r['count']:>9} rows  count {r['count_ms_p50']:.3f} ms  page {r['page_ms']:.3f} ms  {r['filters']}")
+        return
+    index.save(args.index)
+    print(f"Indexed {index.n} patients ({len(index.bitmaps)} bitmaps, {len(index.ranges)} range fields) in {build_s:.1f}s -> {args.index}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,335 @@
+import json
+from pathlib import Path
+
+import numpy as np
+
+# Scoring the exported ensemble needs only NumPy: no scikit-learn, LightGBM or XGBoost at load or predict time.
+# compile_ensemble() duck-types the fitted objects, so nothing here imports those libraries either.
+
+# LightGBM missing_type codes
+MISSING_NONE, MISSING_ZERO, MISSING_NAN = 0, 1, 2
+_LGB_MISSING = {"None": MISSING_NONE, "Zero": MISSING_ZERO, "NaN": MISSING_NAN}
+_ZERO_THRESHOLD = 1e-35
+
+
+def _finish_forest(feature, threshold, left, right, default_left, value, roots, base, missing=None) -> dict:
+    forest = {
+        "feature": np.asarray(feature, dtype=np.int64),
+        "threshold": threshold,
+        "children": np.stack([np.asarray(left, dtype=np.int64), np.asarray(right, dtype=np.int64)], axis=1),
+        "default_left": np.asarray(default_left, dtype=bool),
+        "value": value,
+        "roots": np.asarray(roots, dtype=np.int64),
+        "base": np.asarray(base, dtype=np.float64),
+    }
+    if missing is not None:
+        forest["missing"] = np.asarray(missing, dtype=np.int8)
+    return forest
+
+
+def _flatten_lgbm(booster) -> dict:
+    dump = booster.dump_model()
+    feature, threshold, left, right, default_left, missing, value, roots = [], [], [], [], [], [], [], []
+
+    def add(node):
+        i = len(feature)
+        feature.append(0); threshold.append(0.0); left.append(i); right.append(i)
+        default_left.append(False); missing.append(MISSING_NONE); value.append(0.0)
+        if "leaf_value" in node:
+            # Leaves point at themselves
+            value[i] = float(node["leaf_value"])
+            return i
+        if node.get("decision_type", "<=") != "<=":
+            raise ValueError("categorical LightGBM splits are not supported by the compiled scorer")
+        feature[i] = int(node["split_feature"])
+        threshold[i] = float(node["threshold"])
+        default_left[i] = bool(node["default_left"])
+        missing[i] = _LGB_MISSING[node.get("missing_type", "None")]
+        left[i] = add(node["left_child"])
+        right[i] = add(node["right_child"])
+        return i
+
+    for tree in dump["tree_info"]:
+        roots.append(add(tree["tree_structure"]))
+    return _finish_forest(feature, np.asarray(threshold, dtype=np.float64), left, right, default_left,
+                          np.asarray(value, dtype=np.float64), roots, 0.0, missing=missing)
+
+
+def _flatten_xgb(booster) -> dict:
+    model = json.loads(booster.save_raw("json"))
+    learner = model["learner"]
+    objective = learner["objective"]["name"]
+    if objective != "binary:logistic":
+        raise ValueError(f"unsupported XGBoost objective {objective!r}")
+    base_score = float(learner["learner_model_param"]["base_score"])
+    feature, threshold, left, right, default_left, value, roots = [], [], [], [], [], [], []
+    for tree in learner["gradient_booster"]["model"]["trees"]:
+        offset = len(feature)
+        lc = np.asarray(tree["left_children"], dtype=np.int64)
+        rc = np.asarray(tree["right_children"], dtype=np.int64)
+        leaf = lc == -1
+        own = np.arange(len(lc)) + offset
+        feature.extend(np.where(leaf, 0, tree["split_indices"]).tolist())
+        threshold.extend(np.where(leaf, 0.0, tree["split_conditions"]).tolist())
+        value.extend(np.where(leaf, tree["split_conditions"], 0.0).tolist())
+        left.extend(np.where(leaf, own, lc + offset).tolist())
+        right.extend(np.where(leaf, own, rc + offset).tolist())
+        default_left.extend(np.asarray(tree["default_left"], dtype=bool).tolist())
+        roots.append(offset)
+    # XGBoost compares and accumulates in float32
+    return _finish_forest(feature, np.asarray(threshold, dtype=np.float32), left, right, default_left,
+                          np.asarray(value, dtype=np.float32), roots, np.log(base_score / (1.0 - base_score)))
+
+
+def _compile_pre(pre) -> dict:
+    arrays = {"num_columns": np.asarray([], dtype=str), "num_mean": np.zeros(0), "num_scale": np.ones(0)}
+    cat_columns, cat_values, cat_slots, cat_offsets = [], [], [], [0]
+    width = 0
+    dtype = np.dtype(np.float64)
+    for name, trans, cols in pre.transformers_:
+        if trans == "drop" or len(cols) == 0:
+            continue
+        if trans == "passthrough":
+            raise ValueError("passthrough columns are not supported by the compiled scorer")
+        if name == "num":
+            scaler = trans.steps[-1][1] if hasattr(trans, "steps") else trans
+            n = len(cols)
+            mean = scaler.mean_ if getattr(scaler, "mean_", None) is not None and scaler.with_mean else np.zeros(n)
+            scale = scaler.scale_ if getattr(scaler, "scale_", None) is not None and scaler.with_std else np.ones(n)
+            arrays.update(num_columns=np.asarray(cols, dtype=str), num_mean=np.asarray(mean, dtype=np.float64),
+                          num_scale=np.asarray(scale, dtype=np.float64), num_offset=np.asarray(width))
+            width += n
+        else:
+            # The encoder dtype is the feature matrix dtype the models were trained on (see prepare_data)
+            dtype = np.dtype(getattr(trans, "dtype", np.float64))
+            for col, cats in zip(cols, trans.categories_):
+                names = np.asarray([str(c) for c in cats])
+                order = np.argsort(names)
+                cat_columns.append(col)
+                cat_values.extend(names[order].tolist())
+                cat_slots.extend((width + order).tolist())
+                cat_offsets.append(len(cat_values))
+                width += len(cats)
+    arrays.setdefault("num_offset", np.asarray(0))
+    arrays.update(
+        cat_columns=np.asarray(cat_columns, dtype=str),
+        cat_values=np.asarray(cat_values, dtype=str),
+        cat_slots=np.asarray(cat_slots, dtype=np.int32),
+        cat_offsets=np.asarray(cat_offsets, dtype=np.int32),
+        width=np.asarray(width),
+        dtype=np.asarray(dtype.name),
+    )
+    return arrays
+
+
+def compile_ensemble(models, pre) -> dict:
+    # Flat arrays for the preprocessor and every member, namespaced by prefix so they fit in one .npz
+    arrays = {f"pre/{k}": v for k, v in _compile_pre(pre).items()}
+    members = []
+    for m in models:
+        name = m.__class__.__name__
+        if hasattr(m, "booster_"):
+            flat, kind = _flatten_lgbm(m.booster_), "lgbm"
+        elif hasattr(m, "get_booster"):
+            flat, kind = _flatten_xgb(m.get_booster()), "xgb"
+        elif hasattr(m, "coef_"):
+            flat, kind = {"coef": np.asarray(m.coef_[0], dtype=np.float64), "intercept": np.asarray(float(m.intercept_[0]))}, "linear"
+        else:
+            raise ValueError(f"cannot compile {name}")
+        members.append(kind)
+        arrays.update({f"m{len(members)-1}/{k}": v for k, v in flat.items()})
+    arrays["members"] = np.asarray(members, dtype=str)
+    return arrays
+
+
+def save_compiled(arrays: dict, path: Path) -> Path:
+    # Imported here so loading and scoring still need nothing beyond this file and NumPy
+    from artifacts import atomic_open
+
+    path = Path(path)
+    with atomic_open(path, "wb") as fh:
+        np.savez_compressed(fh, **arrays)
+    return path
+
+
+def _sigmoid(z: np.ndarray) -> np.ndarray:
+    return 1.0 / (1.0 + np.exp(-z))
+
+
+# Lowest clear bit of every byte value (8 for 0xFF)
+_LOWEST_ZERO = np.array([next((k for k in range(8) if not b >> k & 1), 8) for b in range(256)], dtype=np.intp)
+
+# Per-node split tests, each True where a row goes right
+_GT, _NOT_LE, _GE, _NOT_LT, _GT_NONZERO, _GT_OR_ZERO = range(6)
+
+
+def _split_test(strict: bool, threshold, default_left: bool, missing: int) -> int:
+    # NaN fails every comparison, so the negated test sends it right and the plain one sends it left.
+    # strict: XGBoost goes left on x < threshold, LightGBM on x <= threshold
+    if strict:
+        return _GE if default_left else _NOT_LT
+    if missing == MISSING_ZERO:
+        # Zero type: NaN and exact zeros take the default branch
+        return _GT_NONZERO if default_left else _GT_OR_ZERO
+    if missing == MISSING_NAN:
+        return _GT if default_left else _NOT_LE
+    # None type: LightGBM scores NaN as 0.0
+    return _NOT_LE if 0.0 > threshold else _GT
+
+
+def _runtime_forest(forest: dict, strict: bool) -> dict:
+    # Each tree's leaves are numbered left to right in bytes of eight. A row that goes right at a node cannot end up in
+    # that node's left subtree, so every node marks those leaves for the rows it sends right; the exit leaf is the lowest
+    # leaf left unmarked. That turns traversal into one vectorised comparison per node over a block of rows.
+    feature, threshold, children = forest["feature"], forest["threshold"], forest["children"]
+    default_left, value, missing = forest["default_left"], forest["value"], forest.get("missing")
+    base = float(forest["base"])
+    trees, zero_features = [], set()
+    for root in forest["roots"]:
+        leaves, splits = [], []
+
+        def walk(i):
+            if children[i, 0] == i:
+                leaves.append(value[i])
+                return
+            lo = len(leaves)
+            walk(children[i, 0])
+            splits.append((i, lo, len(leaves)))
+            walk(children[i, 1])
+
+        walk(int(root))
+        if not splits:
+            # A single leaf is a constant
+            base += float(leaves[0])
+            continue
+        words = (len(leaves) + 7) // 8
+        nodes = []
+        for i, lo, hi in sorted(splits, key=lambda s: feature[s[0]]):
+            test = _split_test(strict, threshold[i], bool(default_left[i]), int(missing[i]) if missing is not None else MISSING_NONE)
+            if test in (_GT_NONZERO, _GT_OR_ZERO):
+                zero_features.add(int(feature[i]))
+            bits = np.zeros(8 * words, dtype=np.uint8)
+            bits[lo:hi] = 1
+            w0, w1 = lo // 8, (hi - 1) // 8 + 1
+            mask = np.packbits(bits, bitorder="little")[w0:w1]
+            nodes.append((int(feature[i]), threshold[i], test, w0, w1, int(mask[0]) if w1 - w0 == 1 else mask[:, None]))
+        # table[k * 256 + b]: the exit leaf's value when the first k words are fully marked and word k holds b
+        padded = np.zeros(8 * words + 1, dtype=value.dtype)
+        padded[:len(leaves)] = leaves
+        table = padded[np.minimum(8 * np.arange(words)[:, None] + _LOWEST_ZERO, 8 * words)].ravel()
+        trees.append((words, nodes, table))
+    return {"trees": trees, "base": base, "zero_features": sorted(zero_features)}
+
+
+def _score_forest(cols: np.ndarray, forest: dict) -> np.ndarray:
+    # cols: feature-major block, one contiguous row of values per feature
+    n = cols.shape[1]
+    out = np.full(n, forest["base"])
+    go = np.empty(n, dtype=bool)
+    go8, mark = go.view(np.uint8), np.empty(n, dtype=np.uint8)
+    has_nan = np.isnan(cols).any(axis=1)
+    nonzero = {f: np.abs(cols[f]) > _ZERO_THRESHOLD for f in forest["zero_features"]}
+    leading, full, prefix = np.empty(n, dtype=np.intp), np.empty(n, dtype=bool), np.empty(n, dtype=bool)
+    rows = np.arange(n)
+    for words, nodes, table in forest["trees"]:
+        marked = np.zeros((words, n), dtype=np.uint8)
+        for f, t, test, w0, w1, mask in nodes:
+            x = cols[f]
+            if test == _GT or (test == _NOT_LE and not has_nan[f]):
+                np.greater(x, t, out=go)
+            elif test == _GE or (test == _NOT_LT and not has_nan[f]):
+                np.greater_equal(x, t, out=go)
+            elif test == _NOT_LE:
+                np.less_equal(x, t, out=go)
+                np.logical_not(go, out=go)
+            elif test == _NOT_LT:
+                np.less(x, t, out=go)
+                np.logical_not(go, out=go)
+            elif test == _GT_NONZERO:
+                np.greater(x, t, out=go)
+                go &= nonzero[f]
+            else:
+                np.less_equal(x, t, out=go)
+                go &= nonzero[f]
+                np.logical_not(go, out=go)
+            if w1 - w0 == 1:
+                np.multiply(go8, mask, out=mark)
+                np.bitwise_or(marked[w0], mark, out=marked[w0])
+            else:
+                marked[w0:w1] |= mask * go8
+        if words == 1:
+            out += table.take(marked[0])
+            continue
+        # Count the fully marked leading words, then read the first word with an unmarked leaf
+        np.equal(marked[0], 255, out=prefix)
+        leading[:] = prefix
+        for w in range(1, words - 1):
+            np.equal(marked[w], 255, out=full)
+            prefix &= full
+            leading += prefix
+        byte = marked.ravel().take(leading * n + rows)
+        out += table.take(leading * 256 + byte)
+    return out
+
+
+class CompiledScorer:
+    def __init__(self, arrays: dict):
+        self.arrays = arrays
+        self.members = []
+        for i, kind in enumerate(arrays["members"]):
+            prefix = f"m{i}/"
+            member = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+            self.members.append((str(kind), member if kind == "linear" else _runtime_forest(member, strict=kind == "xgb")))
+        self.pre = {k[4:]: v for k, v in arrays.items() if k.startswith("pre/")}
+
+    @classmethod
+    def load(cls, path: Path) -> "CompiledScorer":
+        with np.load(path, allow_pickle=False) as data:
+            return cls({k: data[k] for k in data.files})
+
+    def transform(self, columns) -> np.ndarray:
+        # columns: any mapping of column name -> 1-D array (a pandas DataFrame works)
+        p = self.pre
+        n = len(columns[str(p["num_columns"][0])]) if len(p["num_columns"]) else len(columns[str(p["cat_columns"][0])])
+        # Same dtype and in-place arithmetic as StandardScaler, so float32 pipelines round identically
+        Xt = np.zeros((n, int(p["width"])), dtype=np.dtype(str(p["dtype"])) if "dtype" in p else np.float64)
+        off = int(p["num_offset"])
+        for j, col in enumerate(p["num_columns"]):
+            Xt[:, off + j] = np.asarray(columns[str(col)])
+        if len(p["num_columns"]):
+            block = Xt[:, off:off + len(p["num_columns"])]
+            block -= p["num_mean"]
+            block /= p["num_scale"]
+        rows = np.arange(n)
+        for j, col in enumerate(p["cat_columns"]):
+            lo, hi = p["cat_offsets"][j], p["cat_offsets"][j + 1]
+            cats = p["cat_values"][lo:hi]
+            vals = np.asarray(columns[str(col)]).astype(str)
+            pos = np.minimum(np.searchsorted(cats, vals), len(cats) - 1)
+            hit = cats[pos] == vals
+            # Unknown categories encode as all zeros, like OneHotEncoder(handle_unknown="ignore")
+            Xt[rows[hit], p["cat_slots"][lo + pos[hit]]] = 1.0
+        return Xt
+
+    def member_proba(self, Xt: np.ndarray, batch_size: int = 32768) -> np.ndarray:
+        out = np.empty((len(self.members), Xt.shape[0]))
+        Xt32 = None
+        for i, (kind, m) in enumerate(self.members):
+            if kind == "linear":
+                out[i] = _sigmoid(Xt @ m["coef"] + float(m["intercept"]))
+                continue
+            if kind == "xgb" and Xt32 is None:
+                Xt32 = Xt.astype(np.float32)
+            X = Xt32 if kind == "xgb" else Xt
+            # Every split costs a few NumPy calls per block, so blocks are large; one feature column stays in L2
+            for s in range(0, X.shape[0], batch_size):
+                out[i, s:s+batch_size] = _sigmoid(_score_forest(np.ascontiguousarray(X[s:s+batch_size].T), m))
+        return out
+
+    def score_matrix(self, Xt: np.ndarray) -> np.ndarray:
+        # float32 -> float64 is exact, so LightGBM's double thresholds see the same values as in training
+        return self.member_proba(np.asarray(Xt, dtype=np.float64)).mean(axis=0)
+
+    def predict_proba(self, columns) -> np.ndarray:
+        # Positive-class (high/critical) probability, averaged over members like train_models.write_outputs
+        return self.score_matrix(self.transform(columns))
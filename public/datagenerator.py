@@ -118,6 +118,9 @@ class MedicalDatasetGenerator:
         """Generate realistic biomarker values with medical correlations"""
         biomarkers = []
         
+        # Indexed once: a boolean scan of `conditions` per patient made these loops quadratic
+        conditions_by_id = conditions.set_index('patient_id')
+
         for _, patient in demographics.iterrows():
             patient_id = patient['patient_id']
             age = patient['age']
@@ -125,7 +128,7 @@ class MedicalDatasetGenerator:
             bmi = patient['bmi']
             
             # Get conditions
-            patient_conditions = conditions[conditions['patient_id'] == patient_id].iloc[0]
+            patient_conditions = conditions_by_id.loc[patient_id]
             
             # Blood Pressure (correlated with age, BMI, hypertension)
             base_sbp = 120 + (age - 30) * 0.5 + (bmi - 25) * 0.8
@@ -220,6 +223,9 @@ class MedicalDatasetGenerator:
         """Generate lifestyle and medication adherence data"""
         lifestyle = []
         
+        # Indexed once: a boolean scan of `conditions` per patient made these loops quadratic
+        conditions_by_id = conditions.set_index('patient_id')
+
         for _, patient in demographics.iterrows():
             patient_id = patient['patient_id']
             age = patient['age']
@@ -252,7 +258,7 @@ class MedicalDatasetGenerator:
             # Medication adherence (higher in older patients)
             base_adherence = min(0.9, 0.5 + (age - 18) * 0.008)
             
-            patient_conditions = conditions[conditions['patient_id'] == patient_id].iloc[0]
+            patient_conditions = conditions_by_id.loc[patient_id]
             
             ace_adherence = np.random.beta(base_adherence * 10, (1-base_adherence) * 10) if patient_conditions['has_hypertension'] or patient_conditions['has_heart_failure'] else 0
             beta_adherence = np.random.beta(base_adherence * 10, (1-base_adherence) * 10) if patient_conditions['has_heart_failure'] else 0
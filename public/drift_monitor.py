@@ -0,0 +1,222 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from artifacts import write_text
+
+# Interior quantile edges per numeric feature; PSI/KS are computed over the resulting bins
+REFERENCE_BINS = 20
+# Categorical levels kept by name; the rest (and anything unseen later) share one bucket
+MAX_CATEGORIES = 50
+OTHER = "__other__"
+SCORE_EDGES = np.linspace(0, 1, 21)[1:-1]
+QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+# Conventional PSI bands: < 0.1 stable, 0.1-0.25 moderate shift, > 0.25 major shift
+PSI_WARN, PSI_ALERT = 0.1, 0.25
+# Absolute change in missing rate that flags a feature regardless of PSI (PSI only sees present values)
+MISSING_WARN, MISSING_ALERT = 0.01, 0.05
+
+
+def numeric_reference(values: np.ndarray, bins: int = REFERENCE_BINS) -> dict:
+    values = np.asarray(values, dtype=np.float64)
+    present = values[~np.isnan(values)]
+    if len(present):
+        edges = np.unique(np.quantile(present, np.linspace(0, 1, bins + 1)[1:-1]))
+        quantiles = np.quantile(present, QUANTILES)
+    else:
+        edges, quantiles = np.array([]), np.full(len(QUANTILES), np.nan)
+    return {
+        "kind": "numeric",
+        "edges": edges.tolist(),
+        "counts": bin_counts(present, edges).tolist(),
+        "missing": int(len(values) - len(present)),
+        "n": int(len(values)),
+        "mean": float(present.mean()) if len(present) else None,
+        "std": float(present.std()) if len(present) else None,
+        "quantiles": dict(zip(map(str, QUANTILES), [None if np.isnan(q) else float(q) for q in quantiles])),
+    }
+
+
+def categorical_reference(values: pd.Series, max_categories: int = MAX_CATEGORIES) -> dict:
+    missing = values.isna()
+    counts = values[~missing].astype(str).value_counts()
+    top = counts.iloc[:max_categories]
+    return {
+        "kind": "categorical",
+        "categories": top.index.tolist() + [OTHER],
+        "counts": top.tolist() + [int(counts.iloc[max_categories:].sum())],
+        "missing": int(missing.sum()),
+        "n": int(len(values)),
+    }
+
+
+def reference_profile(X: pd.DataFrame, numeric_cols: list[str], categorical_cols: list[str], ps: np.ndarray | None = None,
+                      bins: int = REFERENCE_BINS) -> dict:
+    profile = {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "rows": int(len(X)),
+        "columns": list(X.columns),
+        "numeric_dtype": str(X[numeric_cols[0]].dtype) if numeric_cols else "float64",
+        "features": {},
+    }
+    for c in numeric_cols:
+        profile["features"][c] = numeric_reference(X[c].to_numpy(), bins)
+    for c in categorical_cols:
+        profile["features"][c] = categorical_reference(X[c])
+    if ps is not None:
+        profile["prediction"] = {**numeric_reference(ps), "edges": SCORE_EDGES.tolist(), "counts": bin_counts(ps, SCORE_EDGES).tolist()}
+    return profile
+
+
+def bin_counts(values: np.ndarray, edges) -> np.ndarray:
+    # Bin i holds edges[i-1] <= v < edges[i]; both tails are open so out-of-range values still land somewhere
+    edges = np.asarray(edges, dtype=np.float64)
+    return np.bincount(np.searchsorted(edges, values, side="right"), minlength=len(edges) + 1)
+
+
+def psi(expected, actual, eps: float = 1e-4) -> float:
+    e = np.maximum(np.asarray(expected, dtype=np.float64) / max(np.sum(expected), 1), eps)
+    a = np.maximum(np.asarray(actual, dtype=np.float64) / max(np.sum(actual), 1), eps)
+    return float(np.sum((a - e) * np.log(a / e)))
+
+
+def binned_ks(expected, actual) -> float:
+    # Evaluated at the reference bin edges only, so a lower bound on the exact two-sample statistic
+    e = np.cumsum(expected) / max(np.sum(expected), 1)
+    a = np.cumsum(actual) / max(np.sum(actual), 1)
+    return float(np.abs(e - a).max()) if len(e) else 0.0
+
+
+def new_accumulator(profile: dict) -> dict:
+    acc = {}
+    for name, ref in list(profile["features"].items()) + ([("__prediction__", profile["prediction"])] if "prediction" in profile else []):
+        acc[name] = {"counts": np.zeros(len(ref["counts"]), dtype=np.int64), "missing": 0, "n": 0, "sum": 0.0, "sumsq": 0.0, "unseen": 0}
+    return acc
+
+
+def update_numeric(state: dict, ref: dict, values: np.ndarray):
+    values = np.asarray(values, dtype=np.float64)
+    present = values[~np.isnan(values)]
+    state["counts"] += bin_counts(present, ref["edges"])
+    state["missing"] += len(values) - len(present)
+    state["n"] += len(values)
+    state["sum"] += float(present.sum())
+    state["sumsq"] += float(np.square(present).sum())
+
+
+def update_categorical(state: dict, ref: dict, values: pd.Series):
+    missing = values.isna()
+    counts = values[~missing].astype(str).value_counts()
+    index = {c: i for i, c in enumerate(ref["categories"])}
+    slots = np.array([index.get(c, index[OTHER]) for c in counts.index], dtype=np.int64)
+    np.add.at(state["counts"], slots, counts.to_numpy())
+    state["unseen"] += int(counts[[c not in index for c in counts.index]].sum())
+    state["missing"] += int(missing.sum())
+    state["n"] += len(values)
+
+
+def feature_drift(ref: dict, state: dict) -> dict:
+    out = {
+        "psi": psi(ref["counts"], state["counts"]),
+        "missing_rate_ref": ref["missing"] / max(ref["n"], 1),
+        "missing_rate_new": state["missing"] / max(state["n"], 1),
+    }
+    out["missing_rate_delta"] = out["missing_rate_new"] - out["missing_rate_ref"]
+    if ref["kind"] == "numeric":
+        present = state["n"] - state["missing"]
+        mean = state["sum"] / present if present else None
+        out["ks"] = binned_ks(ref["counts"], state["counts"])
+        out["mean_ref"], out["mean_new"] = ref["mean"], mean
+        out["std_ref"] = ref["std"]
+        out["std_new"] = float(np.sqrt(max(state["sumsq"] / present - mean**2, 0.0))) if present else None
+    else:
+        out["unseen_rate"] = state["unseen"] / max(state["n"] - state["missing"], 1)
+    delta = abs(out["missing_rate_delta"])
+    out["status"] = "alert" if out["psi"] > PSI_ALERT or delta > MISSING_ALERT else "warn" if out["psi"] > PSI_WARN or delta > MISSING_WARN else "ok"
+    return out
+
+
+def score_chunk(bundle: dict, X: pd.DataFrame) -> np.ndarray:
+    # The pipeline has no imputer, so incomplete rows are left unscored and counted as missing predictions
+    ps = np.full(len(X), np.nan)
+    complete = X.notna().all(axis=1).to_numpy()
+    if complete.any():
+        Xt = bundle["pre"].transform(X[complete])
+        ps[complete] = np.vstack([m.predict_proba(Xt)[:,1] for m in bundle["models"]]).mean(axis=0)
+    return ps
+
+
+def stream_drift(path: Path, profile: dict, bundle: dict | None = None, chunk_size: int = 100_000) -> dict:
+    # One pass over the file; only the current chunk and the per-feature bin counts are held in memory
+    header = pd.read_csv(path, nrows=0).columns
+    features = profile["features"]
+    present = [c for c in features if c in header]
+    predict = bundle is not None and "prediction" in profile and all(c in header for c in profile["columns"])
+    usecols = sorted(set(present) | (set(profile["columns"]) if predict else set()))
+    numeric_dtype = np.dtype(profile.get("numeric_dtype", "float64"))
+
+    acc = new_accumulator(profile)
+    rows, start = 0, time.perf_counter()
+    for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunk_size):
+        rows += len(chunk)
+        for c in present:
+            if features[c]["kind"] == "numeric":
+                # Same rounding as the training matrix, otherwise values sitting on a float32 edge change bins
+                update_numeric(acc[c], features[c], pd.to_numeric(chunk[c], errors="coerce").to_numpy().astype(numeric_dtype))
+            else:
+                update_categorical(acc[c], features[c], chunk[c])
+        if predict:
+            X = chunk[profile["columns"]].astype({c: numeric_dtype for c in profile["columns"] if features.get(c, {}).get("kind") == "numeric"})
+            update_numeric(acc["__prediction__"], profile["prediction"], score_chunk(bundle, X))
+
+    report = {
+        "input": str(path),
+        "rows": rows,
+        "seconds": time.perf_counter() - start,
+        "reference_rows": profile["rows"],
+        "reference_created": profile.get("created"),
+        "missing_columns": [c for c in features if c not in header],
+        "features": {c: feature_drift(features[c], acc[c]) for c in present},
+    }
+    if predict:
+        report["prediction"] = feature_drift(profile["prediction"], acc["__prediction__"])
+    ranked = sorted(report["features"].items(), key=lambda kv: -kv[1]["psi"])
+    report["summary"] = {
+        "alert": [c for c, d in ranked if d["status"] == "alert"],
+        "warn": [c for c, d in ranked if d["status"] == "warn"],
+        "top_psi": [{"feature": c, "psi": d["psi"]} for c, d in ranked[:10]],
+    }
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Stream a new patient extract and compare it with the training reference profile (PSI, KS, missing rates)")
+    ap.add_argument("input", help="CSV of new patients")
+    ap.add_argument("--reference", default="public/data/reference_profile.json")
+    ap.add_argument("--ensemble", default="public/data/ensemble.joblib", help="Scores each chunk to compare the predicted-risk distribution")
+    ap.add_argument("--no_predict", action="store_true", help="Skip the predicted-risk comparison")
+    ap.add_argument("--chunk_size", type=int, default=100_000)
+    ap.add_argument("--output", default="public/data/drift_report.json")
+    args = ap.parse_args()
+
+    profile = json.loads(Path(args.reference).read_text())
+    bundle = None if args.no_predict or not Path(args.ensemble).exists() else joblib.load(args.ensemble)
+    report = stream_drift(Path(args.input), profile, bundle, chunk_size=args.chunk_size)
+    write_text(Path(args.output), json.dumps(report, indent=2))
+
+    s = report["summary"]
+    print(f"{report['rows']} rows in {report['seconds']:.1f}s: {len(s['alert'])} features alert, {len(s['warn'])} warn")
+    if "prediction" in report:
+        print(f"predicted risk PSI {report['prediction']['psi']:.3f} ({report['prediction']['status']})")
+    if report["missing_columns"]:
+        print(f"missing columns: {', '.join(report['missing_columns'])}")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
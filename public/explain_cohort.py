@@ -0,0 +1,393 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from artifacts import atomic_dir
+from patient_store import EXPLANATION_STORE, PatientStore, id_width_for, write_patient_store
+from train_models import HAS_LIME, HAS_SHAP, LimeTabularExplainer, explainer_model, load_shared, prepare_data, shap
+
+# Per-process state set up once by the pool initializer so the explainer is not pickled per chunk
+_WORKER = {}
+
+def patient_ids(df: pd.DataFrame) -> np.ndarray:
+    if "patient_id" in df.columns:
+        return df["patient_id"].astype(str).to_numpy()
+    return np.array([f"row_{i}" for i in range(len(df))])
+
+
+def transform_to_disk(pre, X: pd.DataFrame, workdir: Path, chunk_size: int = 100_000, Xt=None) -> Path:
+    # Dense output is written chunk by chunk into a .npy memmap so the full float matrix never sits in this process.
+    # A caller that already holds the matrix (train_models) passes it as Xt and it is only spilled, not rebuilt
+    if Xt is not None:
+        if sp.issparse(Xt):
+            return share_sparse(Xt.tocsr(), workdir)
+        path = Path(workdir)/"Xt.npy"
+        np.save(path, Xt)
+        return path
+    first = pre.transform(X.iloc[:chunk_size])
+    if sp.issparse(first):
+        parts = [first] + [pre.transform(X.iloc[i:i+chunk_size]) for i in range(chunk_size, len(X), chunk_size)]
+        return share_sparse(sp.vstack(parts, format="csr"), workdir)
+    path = Path(workdir)/"Xt.npy"
+    out = np.lib.format.open_memmap(path, mode="w+", dtype=first.dtype, shape=(len(X), first.shape[1]))
+    out[:len(first)] = first
+    for i in range(chunk_size, len(X), chunk_size):
+        out[i:i+chunk_size] = pre.transform(X.iloc[i:i+chunk_size])
+    out.flush()
+    del out
+    return path
+
+
+def share_sparse(Xt, workdir: Path) -> Path:
+    path = Path(workdir)/"Xt.joblib"
+    joblib.dump(Xt, path)
+    return path
+
+
+def load_matrix(path: Path):
+    path = Path(path)
+    return np.load(path, mmap_mode="r") if path.suffix == ".npy" else load_shared(path)
+
+
+def make_shap_explainer(model, background):
+    name = model.__class__.__name__.lower()
+    if hasattr(model, "get_booster") or "xgb" in name or "lgbm" in name:
+        return shap.TreeExplainer(model)
+    return shap.LinearExplainer(model, background)
+
+
+def _init_shap_worker(model, matrix_path: Path):
+    Xt = load_matrix(matrix_path)
+    _WORKER["Xt"] = Xt
+    _WORKER["explainer"] = make_shap_explainer(model, Xt[:1000])
+
+
+def _shap_chunk(start: int, stop: int, top_k: int):
+    block = _WORKER["Xt"][start:stop]
+    sv = _WORKER["explainer"].shap_values(block)
+    if isinstance(sv, list):
+        sv = sv[1] if len(sv) > 1 else sv[0]
+    sv = np.asarray(sv)
+    values = block.toarray() if sp.issparse(block) else np.asarray(block)
+    k = min(top_k, sv.shape[1])
+    top = np.argpartition(-np.abs(sv), k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.abs(np.take_along_axis(sv, top, axis=1)), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return (
+        start,
+        top.astype(np.int32),
+        np.take_along_axis(sv, top, axis=1).astype(np.float32),
+        np.take_along_axis(values, top, axis=1).astype(np.float32),
+        np.abs(sv).sum(axis=0),
+    )
+
+
+def explain_cohort_shap(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: Path, chunk_size: int = 20_000,
+                        n_jobs: int = 1, top_k: int = 10, progress: bool = True, Xt=None) -> dict:
+    if not HAS_SHAP:
+        raise RuntimeError("shap is not installed")
+    # Built in a staging directory and swapped in whole, so readers never mix old and new stores
+    with atomic_dir(Path(outdir)/"shap") as store:
+        model = explainer_model(models)
+        feature_names = [str(f) for f in pre.get_feature_names_out()]
+        ids = patient_ids(df)
+        n = len(X)
+        with tempfile.TemporaryDirectory(prefix="welldoc_shap_") as tmp:
+            matrix_path = transform_to_disk(pre, X, Path(tmp), Xt=Xt)
+            base = make_shap_explainer(model, load_matrix(matrix_path)[:1000]).expected_value
+            base = float(base if np.isscalar(base) else np.mean(base))
+
+            abs_sum = np.zeros(len(feature_names))
+            started = time.perf_counter()
+            bounds = [(i, min(i + chunk_size, n)) for i in range(0, n, chunk_size)]
+
+            def records():
+                # Streamed straight into the keyed store as chunks finish, in whatever order they finish
+                nonlocal abs_sum
+                done_rows = 0
+                with ProcessPoolExecutor(max_workers=max(1, n_jobs), initializer=_init_shap_worker, initargs=(model, matrix_path)) as pool:
+                    # Keep at most two chunks per worker in flight so results never pile up in memory
+                    queue, pending = list(reversed(bounds)), set()
+                    while queue or pending:
+                        while queue and len(pending) < 2 * max(1, n_jobs):
+                            pending.add(pool.submit(_shap_chunk, *queue.pop(), top_k))
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for f in done:
+                            start, top, contrib, values, chunk_abs = f.result()
+                            abs_sum += chunk_abs
+                            for r in range(len(top)):
+                                yield ids[start + r], {
+                                    "base_value": base,
+                                    "contributions": [
+                                        {"feature": feature_names[j], "value": float(v), "contribution": float(c)}
+                                        for j, v, c in zip(top[r], values[r], contrib[r])
+                                    ],
+                                }
+                            done_rows += len(top)
+                            if progress:
+                                elapsed = time.perf_counter() - started
+                                rate = done_rows / elapsed if elapsed else 0.0
+                                eta = (n - done_rows) / rate if rate else 0.0
+                                print(f"SHAP {done_rows}/{n} patients ({100*done_rows/n:.1f}%), {rate:.0f} rows/s, ETA {eta:.0f}s", file=sys.stderr, flush=True)
+
+            write_patient_store(records(), store/EXPLANATION_STORE, count=n, id_width=id_width_for(ids))
+
+        mean_abs = abs_sum / max(n, 1)
+        order = np.argsort(-mean_abs)[:30]
+        global_importance = [{"feature": feature_names[i], "importance": float(mean_abs[i])} for i in order]
+        manifest = {
+            "n_patients": int(n),
+            "store": EXPLANATION_STORE,
+            "top_k": top_k,
+            "base_value": base,
+            "model": model.__class__.__name__,
+            "global_importance": global_importance,
+        }
+        (store/"index.json").write_text(json.dumps(manifest))
+    return manifest
+
+
+def ensemble_proba(models, Xt) -> np.ndarray:
+    return np.vstack([m.predict_proba(Xt)[:,1] for m in models]).mean(axis=0)
+
+
+def lime_scaler(Xt, chunk_size: int = 20_000):
+    # Same statistics as LimeTabularExplainer's StandardScaler(with_mean=False), accumulated in chunks
+    n = Xt.shape[0]
+    total = np.zeros(Xt.shape[1])
+    total_sq = np.zeros(Xt.shape[1])
+    for i in range(0, n, chunk_size):
+        block = Xt[i:i+chunk_size]
+        block = block.toarray() if sp.issparse(block) else np.asarray(block, dtype=np.float64)
+        total += block.sum(axis=0)
+        # einsum sums the squares without a squared copy of the block
+        total_sq += np.einsum("ij,ij->j", block, block)
+    mean = total / n
+    scale = np.sqrt(np.maximum(total_sq / n - mean**2, 0.0))
+    scale[scale == 0] = 1.0
+    return mean, scale
+
+
+def _weighted_ridge(Z: np.ndarray, y: np.ndarray, w: np.ndarray, alpha: float):
+    # Batched Ridge(fit_intercept=True) with sample weights: one small normal-equation solve per instance
+    sw = w / w.sum(axis=1, keepdims=True)
+    z_mean = np.matmul(sw[:, None, :], Z)[:, 0, :]
+    y_mean = (sw * y).sum(axis=1)
+    Zc = Z - z_mean[:, None, :]
+    Zw = (Zc * w[:, :, None]).transpose(0, 2, 1)
+    A = np.matmul(Zw, Zc) + alpha * np.eye(Z.shape[2])
+    b = np.matmul(Zw, (y - y_mean[:, None])[:, :, None])
+    coef = np.linalg.solve(A, b)[..., 0]
+    return coef, y_mean - (coef * z_mean).sum(axis=1)
+
+
+def _forward_selection(Z: np.ndarray, y: np.ndarray, w: np.ndarray, k: int) -> np.ndarray:
+    # LIME's forward_selection for a batch: greedily add the feature whose weighted least-squares fit (Ridge alpha=0 with
+    # intercept) scores the highest R^2. The total sum of squares is fixed per instance, so the best candidate is the one
+    # explaining the most weighted variance, c_S' G_SS^-1 c_S, read off the centred weighted Gram matrix
+    b, _, d = Z.shape
+    sw = w / w.sum(axis=1, keepdims=True)
+    Zc = Z - np.matmul(sw[:, None, :], Z)
+    Zw = (Zc * w[:, :, None]).transpose(0, 2, 1)
+    G = np.matmul(Zw, Zc)
+    c = np.matmul(Zw, (y - (sw * y).sum(axis=1, keepdims=True))[:, :, None])[..., 0]
+    selected = np.zeros((b, 0), dtype=np.int64)
+    used = np.zeros((b, d), dtype=bool)
+    bi = np.arange(b)[:, None, None]
+    for _ in range(k):
+        # Already-selected candidates would make G singular: they are evaluated on a stand-in column and masked out
+        stand_in = np.argmin(used, axis=1)[:, None]
+        cand = np.where(used, stand_in, np.arange(d)[None, :])
+        idx = np.concatenate([np.broadcast_to(selected[:, None, :], (b, d, selected.shape[1])), cand[:, :, None]], axis=2)
+        G_sub = G[bi[..., None], idx[..., :, None], idx[..., None, :]]
+        c_sub = c[bi, idx]
+        explained = (c_sub * np.linalg.solve(G_sub, c_sub[..., None])[..., 0]).sum(axis=2)
+        explained[used] = -np.inf
+        # First maximum wins, as in LIME's strict > scan over features in order
+        best = np.argmax(explained, axis=1)
+        selected = np.concatenate([selected, best[:, None]], axis=1)
+        used[np.arange(b), best] = True
+    return selected
+
+
+def lime_batch(models, rows: np.ndarray, mean: np.ndarray, scale: np.ndarray, num_samples: int = 5000,
+               num_features: int = 10, rng: np.random.Generator | None = None):
+    # Mirrors LimeTabularExplainer(discretize_continuous=False).explain_instance with feature_selection="auto"
+    # (forward_selection up to 6 features, highest_weights above), but for a batch of rows with a single stacked
+    # predict_proba per model
+    rng = rng or np.random.default_rng(42)
+    b, d = rows.shape
+    # Perturbations are drawn in the feature matrix dtype so the stacked predict_proba input needs no conversion
+    Z = (rng.normal(size=(b, num_samples, d)) * scale + mean).astype(rows.dtype, copy=False)
+    Z[:, 0, :] = rows
+    probs = ensemble_proba(models, Z.reshape(b * num_samples, d)).reshape(b, num_samples)
+
+    scaled = (Z - mean) / scale
+    dist = np.sqrt(((scaled - scaled[:, :1, :])**2).sum(axis=2))
+    width = np.sqrt(d) * 0.75
+    weights = np.sqrt(np.exp(-(dist**2) / width**2))
+
+    k = min(num_features, d)
+    if num_features <= 6:
+        selected = _forward_selection(scaled, probs, weights, k)
+    else:
+        coef, _ = _weighted_ridge(scaled, probs, weights, alpha=0.01)
+        selected = np.argsort(-np.abs(coef * scaled[:, 0, :]), axis=1)[:, :k]
+    coef, intercept = _weighted_ridge(np.take_along_axis(scaled, selected[:, None, :], axis=2), probs, weights, alpha=1.0)
+    order = np.argsort(-np.abs(coef), axis=1)
+    return np.take_along_axis(selected, order, axis=1), np.take_along_axis(coef, order, axis=1), intercept
+
+
+def _init_lime_worker(models, matrix_path: Path, mean: np.ndarray, scale: np.ndarray):
+    _WORKER.update(models=models, Xt=load_matrix(matrix_path), mean=mean, scale=scale)
+
+
+def _lime_chunk(rows: np.ndarray, num_samples: int, num_features: int, batch_size: int, seed: int):
+    rng = np.random.default_rng(seed)
+    Xt = _WORKER["Xt"]
+    out = []
+    for i in range(0, len(rows), batch_size):
+        idx = rows[i:i+batch_size]
+        block = Xt[idx]
+        block = block.toarray() if sp.issparse(block) else np.asarray(block)
+        out.append((idx, *lime_batch(_WORKER["models"], block, _WORKER["mean"], _WORKER["scale"], num_samples, num_features, rng)))
+    return out
+
+
+def explain_cohort_lime(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: Path, rows: np.ndarray | None = None,
+                        num_samples: int = 5000, num_features: int = 10, batch_size: int | None = None, chunk_size: int = 256,
+                        n_jobs: int = 1, progress: bool = True, Xt=None) -> dict:
+    # Built in a staging directory and swapped in whole, so readers never mix old and new stores
+    with atomic_dir(Path(outdir)/"lime") as store:
+        feature_names = [str(f) for f in pre.get_feature_names_out()]
+        ids = patient_ids(df)
+        rows = np.arange(len(X)) if rows is None else np.asarray(rows)
+        # ~200k perturbed rows per stacked predict_proba call
+        batch_size = batch_size or max(1, 200_000 // num_samples)
+        with tempfile.TemporaryDirectory(prefix="welldoc_lime_") as tmp:
+            matrix_path = transform_to_disk(pre, X, Path(tmp), Xt=Xt)
+            mean, scale = lime_scaler(load_matrix(matrix_path))
+            started = time.perf_counter()
+            chunks = [rows[i:i+chunk_size] for i in range(0, len(rows), chunk_size)]
+
+            def records():
+                done_rows = 0
+                with ProcessPoolExecutor(max_workers=max(1, n_jobs), initializer=_init_lime_worker,
+                                         initargs=(models, matrix_path, mean, scale)) as pool:
+                    queue, pending = list(enumerate(chunks))[::-1], set()
+                    while queue or pending:
+                        while queue and len(pending) < 2 * max(1, n_jobs):
+                            seed, chunk = queue.pop()
+                            pending.add(pool.submit(_lime_chunk, chunk, num_samples, num_features, batch_size, seed))
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for f in done:
+                            for idx, selected, coef, intercept in f.result():
+                                for r, sel, cf, b0 in zip(idx, selected, coef, intercept):
+                                    yield ids[r], {
+                                        "intercept": float(b0),
+                                        "weights": [{"feature": feature_names[j], "weight": float(w)} for j, w in zip(sel, cf)],
+                                    }
+                                done_rows += len(idx)
+                            if progress:
+                                elapsed = time.perf_counter() - started
+                                print(f"LIME {done_rows}/{len(rows)} patients, {done_rows/elapsed:.1f} patients/s", file=sys.stderr, flush=True)
+
+            write_patient_store(records(), store/EXPLANATION_STORE, count=len(rows), id_width=id_width_for(ids[rows]))
+
+        elapsed = time.perf_counter() - started
+        manifest = {
+            "n_patients": int(len(rows)),
+            "store": EXPLANATION_STORE,
+            "num_samples": num_samples,
+            "num_features": num_features,
+            "patients_per_second": len(rows) / elapsed if elapsed else None,
+        }
+        (store/"index.json").write_text(json.dumps(manifest))
+    return manifest
+
+
+def benchmark_lime(models, pre, X: pd.DataFrame, n_patients: int = 20, num_samples: int = 5000, num_features: int = 10) -> dict:
+    # Throughput of the batched path vs one LimeTabularExplainer.explain_instance call per patient, single process
+    Xt = pre.transform(X)
+    Xt = Xt.toarray() if sp.issparse(Xt) else np.asarray(Xt)
+    rows = Xt[np.random.RandomState(42).choice(len(Xt), size=min(n_patients, len(Xt)), replace=False)]
+    mean, scale = lime_scaler(Xt)
+
+    start = time.perf_counter()
+    batch_size = max(1, 200_000 // num_samples)
+    for i in range(0, len(rows), batch_size):
+        lime_batch(models, rows[i:i+batch_size], mean, scale, num_samples, num_features)
+    batched = len(rows) / (time.perf_counter() - start)
+
+    result = {"n_patients": int(len(rows)), "num_samples": num_samples, "batched_patients_per_second": batched}
+    if HAS_LIME:
+        def predict_fn(Z):
+            avg = ensemble_proba(models, Z)
+            return np.vstack([1-avg, avg]).T
+
+        expl = LimeTabularExplainer(Xt, feature_names=[str(f) for f in pre.get_feature_names_out()], class_names=["low","high"], discretize_continuous=False)
+        start = time.perf_counter()
+        for row in rows:
+            expl.explain_instance(row, predict_fn, num_features=num_features, num_samples=num_samples)
+        result["reference_patients_per_second"] = len(rows) / (time.perf_counter() - start)
+        result["speedup"] = batched / result["reference_patients_per_second"]
+    return result
+
+
+def load_patient_explanation(store: Path, patient_id: str) -> dict | None:
+    # One hashed slot probe and one seek; callers doing many lookups should keep a PatientStore open instead
+    path = Path(store)/EXPLANATION_STORE
+    if not path.exists():
+        return None
+    explanations = PatientStore(path)
+    try:
+        return explanations.get(patient_id)
+    finally:
+        explanations.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Full-cohort SHAP / batched LIME explanations written to keyed per-patient stores")
+    ap.add_argument("--input", default="public/processed_medical_dataset.csv")
+    ap.add_argument("--ensemble", default="public/data/ensemble.joblib")
+    ap.add_argument("--outdir", default="public/data")
+    ap.add_argument("--chunk_size", type=int, default=20_000)
+    ap.add_argument("--n_jobs", type=int, default=-1)
+    ap.add_argument("--top_k", type=int, default=10)
+    ap.add_argument("--method", choices=["shap", "lime", "both"], default="shap")
+    ap.add_argument("--lime_patients", type=int, default=None, help="Explain only the first N patients with LIME (default: all)")
+    ap.add_argument("--lime_samples", type=int, default=5000, help="Perturbations per patient")
+    ap.add_argument("--bench", type=int, default=None, help="Only report batched vs per-instance LIME patients/sec on N patients")
+    args = ap.parse_args()
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+
+    bundle = joblib.load(args.ensemble)
+    df = pd.read_csv(args.input)
+    X, _, _, _, _ = prepare_data(df)
+    models, pre = bundle["models"], bundle["pre"]
+    if args.bench:
+        print(json.dumps(benchmark_lime(models, pre, X, n_patients=args.bench, num_samples=args.lime_samples), indent=2))
+        return
+    if args.method in ("shap", "both"):
+        manifest = explain_cohort_shap(models, pre, df, X, Path(args.outdir), chunk_size=args.chunk_size,
+                                       n_jobs=n_jobs, top_k=args.top_k)
+        print(f"Explained {manifest['n_patients']} patients into {Path(args.outdir)/'shap'}")
+    if args.method in ("lime", "both"):
+        rows = np.arange(min(args.lime_patients, len(X))) if args.lime_patients else None
+        manifest = explain_cohort_lime(models, pre, df, X, Path(args.outdir), rows=rows, num_samples=args.lime_samples,
+                                       num_features=args.top_k, n_jobs=n_jobs)
+        print(f"LIME-explained {manifest['n_patients']} patients ({manifest['patients_per_second']:.1f} patients/s) into {Path(args.outdir)/'lime'}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,11 @@
 /* global WD, MRP, Chart */
 (function(){
   async function loadExplanations(){
+    // With the data API configured and a patient in the URL, fetch just that patient instead of the whole file
+    const pid = new URLSearchParams(window.location.search).get('patient_id');
+    if (window.WELLDOC_API && pid) {
+      try { const r = await fetch(`${window.WELLDOC_API}/api/explanations/${encodeURIComponent(pid)}`); if (r.ok) return { patients: { [pid]: await r.json() } }; } catch(e){}
+    }
     try { const r = await fetch('data/explanations.json', { cache:'no-cache' }); if (r.ok) return await r.json(); } catch(e){}
     return null;
   }
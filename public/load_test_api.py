@@ -0,0 +1,123 @@
+import argparse
+import json
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import numpy as np
+import requests
+
+# Query mix for the dashboard: a small pool of hot list queries (LRU hits after the first pass) plus random single-patient lookups
+LIST_QUERIES = [
+    "/api/patients?page_size=50",
+    "/api/patients?risk_level=high,critical&sort=-risk_score&page_size=50",
+    "/api/patients?diabetes_type=type2&age_band=65%2B&page_size=100",
+    "/api/patients?hba1c=7:&egfr=:60&sort=-hba1c&page_size=50",
+    "/api/patients?conditions=CKD,HF&risk_level=critical&page=2&page_size=25",
+    "/api/predictions?risk_level=critical&page_size=500",
+    "/api/summary",
+    "/api/summary?diabetes_type=type2",
+    "/api/evaluation",
+    "/api/explanations",
+]
+
+
+def wait_ready(url: str, timeout: float = 120) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(url + "/api/version", timeout=2).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+
+def run_worker(url: str, patient_ids: list[str], deadline: float, revalidate: float, seed: int, results: list, lock: threading.Lock):
+    rng = np.random.default_rng(seed)
+    session = requests.Session()
+    session.headers["Accept-Encoding"] = "gzip"
+    etags = {}
+    local = []
+    while time.monotonic() < deadline:
+        if patient_ids and rng.random() < 0.3:
+            path, kind = f"/api/patients/{patient_ids[rng.integers(len(patient_ids))]}", "patient"
+        else:
+            path, kind = LIST_QUERIES[rng.integers(len(LIST_QUERIES))], "list"
+        headers = {}
+        if path in etags and rng.random() < revalidate:
+            headers["If-None-Match"] = etags[path]
+            kind = "revalidate"
+        start = time.perf_counter()
+        r = session.get(url + path, headers=headers, timeout=30)
+        elapsed = time.perf_counter() - start
+        if "ETag" in r.headers:
+            etags[path] = r.headers["ETag"]
+        local.append((kind, r.status_code, elapsed, len(r.content)))
+    with lock:
+        results.extend(local)
+
+
+def summarize(results: list, seconds: float) -> dict:
+    def stats(rows):
+        ms = np.array([r[2] for r in rows]) * 1000
+        return {"requests": len(rows), "p50_ms": float(np.percentile(ms, 50)), "p95_ms": float(np.percentile(ms, 95)),
+                "p99_ms": float(np.percentile(ms, 99)), "mean_bytes": float(np.mean([r[3] for r in rows]))}
+
+    report = {"seconds": seconds, "requests": len(results), "requests_per_second": len(results) / seconds, "overall": stats(results), "by_kind": {}}
+    for kind in sorted({r[0] for r in results}):
+        report["by_kind"][kind] = stats([r for r in results if r[0] == kind])
+    statuses = {}
+    for r in results:
+        statuses[str(r[1])] = statuses.get(str(r[1]), 0) + 1
+    report["status"] = statuses
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Concurrent load test against a running api_server.py")
+    ap.add_argument("--url", default="http://127.0.0.1:5000")
+    ap.add_argument("--start", action="store_true", help="Launch api_server.py on --url's port for the duration of the test")
+    ap.add_argument("--threads", type=int, default=8)
+    ap.add_argument("--duration", type=float, default=20, help="Seconds of load after a warm-up pass")
+    ap.add_argument("--revalidate", type=float, default=0.3, help="Share of repeat requests sent with If-None-Match")
+    ap.add_argument("--output", default=None, help="Optional JSON report path")
+    args = ap.parse_args()
+
+    server = None
+    if args.start:
+        port = args.url.rsplit(":", 1)[-1].strip("/")
+        server = subprocess.Popen([sys.executable, str(Path(__file__).resolve().parent/"api_server.py"), "--port", port])
+    try:
+        if not wait_ready(args.url):
+            raise SystemExit(f"API at {args.url} did not come up")
+        patient_ids = [p["patient_id"] for p in requests.get(args.url + "/api/predictions?page_size=1000", timeout=30).json()["items"]]
+        for path in LIST_QUERIES:
+            requests.get(args.url + path, timeout=30)
+
+        results, lock = [], threading.Lock()
+        deadline = time.monotonic() + args.duration
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as pool:
+            for i in range(args.threads):
+                pool.submit(run_worker, args.url, patient_ids, deadline, args.revalidate, i, results, lock)
+        report = summarize(results, time.perf_counter() - start)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    print(f"{report['requests']} requests in {report['seconds']:.1f}s with {args.threads} threads: {report['requests_per_second']:.0f} req/s")
+    for kind, s in report["by_kind"].items():
+        print(f"  {kind:<10} n={s['requests']:<6} p50 {s['p50_ms']:.1f} ms  p95 {s['p95_ms']:.1f} ms  p99 {s['p99_ms']:.1f} ms  {s['mean_bytes']/1024:.1f} KiB")
+    print(f"  status {report['status']}")
+    if args.output:
+        Path(args.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+import argparse
+import hashlib
+import json
+import mmap
+import struct
+from array import array
+from pathlib import Path
+
+import numpy as np
+
+from artifacts import atomic_open
+
+# Single file, so index and data can never be swapped out of step:
+#   header | slot table (open addressing, power-of-two size) | JSON records back to back
+MAGIC = b"WDPSTOR1"
+HEADER = struct.Struct("<8sQQII")
+HEADER_SIZE = 64
+# Table kept at most half full, so a miss probes ~2 slots on average
+LOAD_FACTOR = 0.5
+# File name of the keyed store inside explain_cohort's shap/ and lime/ directories (next to their index.json manifest)
+EXPLANATION_STORE = "explanations.store"
+# PatientStore.items() drops mapped pages it has already read in steps of this size
+RELEASE_BYTES = 8 << 20
+# One shared encoder: json.dumps with non-default separators builds a new JSONEncoder per call
+_ENCODER = json.JSONEncoder(separators=(",", ":"))
+
+
+def slot_dtype(id_width: int) -> np.dtype:
+    # length == 0 marks an empty slot; every stored record is non-empty JSON
+    return np.dtype([("hash", "<u8"), ("offset", "<u8"), ("length", "<u4"), ("id", f"S{id_width}")])
+
+
+def key_hash(patient_id: str) -> int:
+    return int.from_bytes(hashlib.blake2b(str(patient_id).encode(), digest_size=8).digest(), "little")
+
+
+def id_width_for(keys) -> int:
+    # Key slots are fixed-width bytes, so the width is the longest UTF-8 encoding, not the longest string
+    return max([32] + [len(str(k).encode()) for k in keys])
+
+
+def write_patient_store(records, path: Path, count: int | None = None, id_width: int = 32) -> dict:
+    """Write {patient_id: record} (or an iterable of pairs) to a keyed store at path; replaces any existing file atomically.
+    With count given, an iterable is streamed straight to disk instead of being materialised."""
+    if isinstance(records, dict):
+        records, count = records.items(), len(records)
+    elif count is None:
+        records = list(records)
+        count = len(records)
+    n_slots = 1 << max(4, int(np.ceil(np.log2(max(1, count) / LOAD_FACTOR))))
+    slots = np.zeros(n_slots, dtype=slot_dtype(id_width))
+    mask = n_slots - 1
+    data_start = HEADER_SIZE + slots.nbytes
+
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with atomic_open(path, "wb") as fh:
+        fh.seek(data_start)
+        offset = data_start
+        # Typed arrays rather than lists of Python ints: 8 or 4 bytes per record instead of ~36
+        hashes, offsets, lengths, pids = array("Q"), array("Q"), array("I"), []
+        for key, record in records:
+            pid = str(key).encode()
+            if len(pid) > id_width:
+                raise ValueError(f"patient_id longer than {id_width} bytes: {key}")
+            if len(pids) == count:
+                raise ValueError(f"More than count={count} records")
+            blob = _ENCODER.encode(record).encode()
+            fh.write(blob)
+            hashes.append(key_hash(key))
+            offsets.append(offset)
+            lengths.append(len(blob))
+            pids.append(pid)
+            offset += len(blob)
+
+        # Linear probing on a plain list; per-element access into the structured array is ~10x slower
+        owner = [-1] * n_slots
+        for r, h in enumerate(hashes):
+            i = h & mask
+            while owner[i] >= 0:
+                if pids[owner[i]] == pids[r]:
+                    raise ValueError(f"Duplicate patient_id in store: {pids[r].decode()}")
+                i = (i + 1) & mask
+            owner[i] = r
+        owner = np.asarray(owner)
+        used = owner >= 0
+        written = int(used.sum())
+        slots["hash"][used] = np.asarray(hashes, dtype=np.uint64)[owner[used]]
+        slots["offset"][used] = np.asarray(offsets, dtype=np.uint64)[owner[used]]
+        slots["length"][used] = np.asarray(lengths, dtype=np.uint32)[owner[used]]
+        slots["id"][used] = np.asarray(pids, dtype=f"S{id_width}")[owner[used]]
+        fh.seek(0)
+        fh.write(HEADER.pack(MAGIC, n_slots, written, id_width, slots.dtype.itemsize).ljust(HEADER_SIZE, b"\0"))
+        fh.write(slots.tobytes())
+    return {"path": str(path), "records": written, "slots": n_slots, "bytes": offset}
+
+
+def attach_explanations(path: Path, explanations: dict, shap_dir: Path | None = None) -> dict:
+    """Rewrite the store at path with each patient's explanation folded into its record: the cohort-wide SHAP store when
+    present, else the sampled explanations.json entries. Streams record by record with one keyed lookup each."""
+    path = Path(path)
+    store = PatientStore(path)
+    shap_path = Path(shap_dir)/EXPLANATION_STORE if shap_dir is not None else None
+    shap = PatientStore(shap_path) if shap_path is not None and shap_path.exists() else None
+
+    def merged():
+        for pid, base in store.items():
+            explanation = shap.get(pid) if shap is not None else None
+            if explanation is None:
+                explanation = explanations.get(pid)
+            yield pid, ({**base, "explanation": explanation} if explanation is not None else base)
+
+    try:
+        return write_patient_store(merged(), path, count=len(store), id_width=store.slots.dtype["id"].itemsize)
+    finally:
+        store.close()
+        if shap is not None:
+            shap.close()
+
+
+class PatientStore:
+    """Read-only, memory-mapped view of a store written by write_patient_store; get() touches one slot run and one record."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        with self.path.open("rb") as fh:
+            self.mm = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, n_slots, self.n_records, id_width, _ = HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a patient store")
+        self.slots = np.frombuffer(self.mm, dtype=slot_dtype(id_width), count=n_slots, offset=HEADER_SIZE)
+        self.mask = n_slots - 1
+
+    def __len__(self) -> int:
+        return self.n_records
+
+    def __contains__(self, patient_id) -> bool:
+        return self._find(patient_id) is not None
+
+    def _find(self, patient_id):
+        key = str(patient_id).encode()
+        h = key_hash(patient_id)
+        i = h & self.mask
+        while True:
+            slot = self.slots[i]
+            if not slot["length"]:
+                return None
+            if slot["hash"] == h and slot["id"] == key:
+                return slot
+            i = (i + 1) & self.mask
+
+    def get(self, patient_id) -> dict | None:
+        slot = self._find(patient_id)
+        if slot is None:
+            return None
+        start = int(slot["offset"])
+        return json.loads(self.mm[start:start + int(slot["length"])])
+
+    def items(self):
+        # Data-file order, i.e. the order records were written
+        used = self.slots[self.slots["length"] > 0]
+        # Pages already read are handed back as the scan passes them, or a full pass (attach_explanations rewriting
+        # the store) would leave the whole file resident
+        release = hasattr(self.mm, "madvise") and hasattr(mmap, "MADV_DONTNEED")
+        released = 0
+        for slot in used[np.argsort(used["offset"])]:
+            start = int(slot["offset"])
+            yield slot["id"].decode(), json.loads(self.mm[start:start + int(slot["length"])])
+            if release and start - released >= RELEASE_BYTES:
+                upto = start - start % mmap.PAGESIZE
+                self.mm.madvise(mmap.MADV_DONTNEED, released, upto - released)
+                released = upto
+
+    def close(self):
+        self.slots = None
+        self.mm.close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Look up patients in a keyed per-patient store")
+    ap.add_argument("patient_ids", nargs="+")
+    ap.add_argument("--store", default="public/data/patients.store")
+    args = ap.parse_args()
+    store = PatientStore(Path(args.store))
+    for pid in args.patient_ids:
+        print(json.dumps({"patient_id": pid, "record": store.get(pid)}))
+
+
+if __name__ == "__main__":
+    main()
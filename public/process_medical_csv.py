@@ -1,5 +1,6 @@
 import argparse
 import warnings
+from contextlib import nullcontext
 from typing import List, Tuple
 
 import numpy as np
@@ -10,6 +11,27 @@ from sklearn.feature_selection import mutual_info_regression
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, RobustScaler
 
+from artifacts import atomic_path
+
+LAB_COLS = [
+    "hba1c",
+    "fasting_glucose",
+    "egfr",
+    "creatinine",
+    "bnp",
+    "total_cholesterol",
+    "ldl_cholesterol",
+    "hdl_cholesterol",
+    "triglycerides",
+]
+VITAL_COLS = ["systolic_bp", "diastolic_bp", "heart_rate"]
+ADHERENCE_COLS = [
+    "ace_inhibitor_adherence",
+    "beta_blocker_adherence",
+    "statin_adherence",
+    "diabetes_med_adherence",
+]
+
 
 def bucketize_age(age_series: pd.Series) -> pd.Series:
     bins = [0, 30, 40, 50, 60, 70, 80, 200]
@@ -140,76 +162,57 @@ def mutual_info_select(df: pd.DataFrame, target_col: str, keep_top_k: int = 50,
     return selected
 
 
-def main():
-    parser = argparse.ArgumentParser(description="Process medical CSV with feature engineering and validation")
-    parser.add_argument("--input", default="public/medical_dataset_realistic.csv", help="Path to input CSV")
-    parser.add_argument("--output", default="public/processed_medical_dataset.csv", help="Path to write processed CSV")
-    parser.add_argument("--top_k", type=int, default=50, help="Top K features by mutual information to keep")
-    args = parser.parse_args()
-
-    df = pd.read_csv(args.input)
-
+def process_dataset(df: pd.DataFrame, top_k: int = 50, stage=nullcontext) -> pd.DataFrame:
+    """Raw extract -> processed feature table. `stage(name)` wraps each step (benchmark_pipeline.py times them)."""
     # Basic group columns for imputation
     df["age_bucket"] = bucketize_age(df.get("age", pd.Series(dtype=float)))
     group_cols = [c for c in ["sex", "age_bucket", "has_diabetes"] if c in df.columns]
 
-    lab_cols = [
-        "hba1c",
-        "fasting_glucose",
-        "egfr",
-        "creatinine",
-        "bnp",
-        "total_cholesterol",
-        "ldl_cholesterol",
-        "hdl_cholesterol",
-        "triglycerides",
-    ]
-
-    vital_cols = ["systolic_bp", "diastolic_bp", "heart_rate"]
-
     # Missing flags then median impute by groups
-    df = add_missing_flags(df, lab_cols + vital_cols)
-    if group_cols:
-        df = median_impute_by_groups(df, lab_cols, group_cols)
-    else:
-        imputer = SimpleImputer(strategy="median")
-        present_labs = [c for c in lab_cols if c in df.columns]
-        if present_labs:
-            df[present_labs] = imputer.fit_transform(df[present_labs])
+    with stage("add_missing_flags"):
+        df = add_missing_flags(df, LAB_COLS + VITAL_COLS)
+    with stage("median_impute_by_groups"):
+        if group_cols:
+            df = median_impute_by_groups(df, LAB_COLS, group_cols)
+        else:
+            imputer = SimpleImputer(strategy="median")
+            present_labs = [c for c in LAB_COLS if c in df.columns]
+            if present_labs:
+                df[present_labs] = imputer.fit_transform(df[present_labs])
 
     # Feature engineering
-    adherence_cols = [
-        "ace_inhibitor_adherence",
-        "beta_blocker_adherence",
-        "statin_adherence",
-        "diabetes_med_adherence",
-    ]
-    df = compute_adherence_pdc(df, adherence_cols)
-    df = compute_bp_control(df)
+    with stage("derived_features"):
+        df = compute_adherence_pdc(df, ADHERENCE_COLS)
+        df = compute_bp_control(df)
 
     # Data validation and outlier flags
-    df = validate_ranges(df)
+    with stage("validate_ranges"):
+        df = validate_ranges(df)
 
     # Scaling and encoding
-    df, scaled_cols = robust_scale_columns(df, [*lab_cols])
+    with stage("robust_scale_columns"):
+        df, scaled_cols = robust_scale_columns(df, [*LAB_COLS])
 
     # Choose target for encoding; prefer risk_score if present
     target_col = "risk_score" if "risk_score" in df.columns else None
     categorical_for_te = [c for c in ["diabetes_type", "race", "smoking_status"] if c in df.columns]
     if target_col:
-        df = target_encode(df, categorical_for_te, target_col)
+        with stage("target_encode"):
+            df = target_encode(df, categorical_for_te, target_col)
 
     # Drop non-actionable identifiers
     drop_cols = [c for c in ["hospital_id"] if c in df.columns]
     df = df.drop(columns=drop_cols)
 
     # Drop highly correlated numeric features
-    df = drop_highly_correlated(df, threshold=0.98)
+    with stage("drop_highly_correlated"):
+        df = drop_highly_correlated(df, threshold=0.98)
 
     # Mutual information selection
     if target_col:
         mandatory = [c for c in ["age", "pdc_mean_adherence", "bp_control_indicator"] if c in df.columns]
-        selected_numeric = mutual_info_select(df, target_col, keep_top_k=args.top_k, mandatory=mandatory)
+        with stage("mutual_info_select"):
+            selected_numeric = mutual_info_select(df, target_col, keep_top_k=top_k, mandatory=mandatory)
         # Keep also the non-numeric columns commonly useful
         keep_always = [
             c for c in [
@@ -223,8 +226,21 @@ def main():
         ]
         keep_set = set(selected_numeric + keep_always)
         df = df[[c for c in df.columns if c in keep_set or df[c].dtype == "O"]]
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process medical CSV with feature engineering and validation")
+    parser.add_argument("--input", default="public/medical_dataset_realistic.csv", help="Path to input CSV")
+    parser.add_argument("--output", default="public/processed_medical_dataset.csv", help="Path to write processed CSV")
+    parser.add_argument("--top_k", type=int, default=50, help="Top K features by mutual information to keep")
+    args = parser.parse_args()
+
+    df = process_dataset(pd.read_csv(args.input), top_k=args.top_k)
 
-    df.to_csv(args.output, index=False)
+    # The API and dashboard build read this file; swap it in whole
+    with atomic_path(args.output) as tmp:
+        df.to_csv(tmp, index=False)
     print(f"Wrote processed dataset to: {args.output}")
 
 
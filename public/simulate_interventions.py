@@ -0,0 +1,261 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from artifacts import write_text
+from process_medical_csv import ADHERENCE_COLS
+from train_models import RISK_LEVELS, matrix_settings, prepare_data, risk_level_codes
+
+# Care-management questions answered by default; --scenarios takes a JSON list in the same form.
+# ACE-inhibitor adherence is 0 for patients without a prescription, so that scenario only lifts patients already on one.
+DEFAULT_SCENARIOS = [
+    {"name": "statin_adherence_0.8", "edits": [{"column": "statin_adherence", "op": "at_least", "value": 0.8}]},
+    {"name": "ace_inhibitor_adherence_0.8", "edits": [{"column": "ace_inhibitor_adherence", "op": "at_least", "value": 0.8,
+                                                       "where": [{"column": "ace_inhibitor_adherence", "op": ">", "value": 0}]}]},
+    {"name": "sbp_below_140", "edits": [{"column": "systolic_bp", "op": "at_most", "value": 139}]},
+    {"name": "all_three", "edits": [
+        {"column": "statin_adherence", "op": "at_least", "value": 0.8},
+        {"column": "ace_inhibitor_adherence", "op": "at_least", "value": 0.8, "where": [{"column": "ace_inhibitor_adherence", "op": ">", "value": 0}]},
+        {"column": "systolic_bp", "op": "at_most", "value": 139},
+    ]},
+]
+EDIT_OPS = {
+    "set": lambda v, x: np.full_like(v, x),
+    "at_least": np.maximum,
+    "at_most": np.minimum,
+    "add": np.add,
+    "scale": np.multiply,
+}
+WHERE_OPS = {
+    "==": np.equal, "!=": np.not_equal, ">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal,
+    "in": lambda v, x: np.isin(v, x),
+}
+# Generator outputs that describe the current risk rather than drive it; a scenario cannot recompute them, so when the
+# ensemble was trained on them they stay at their baseline values and mute the effect of every clinical edit
+FROZEN_INPUTS = ["risk_score", "prob_low", "prob_moderate", "prob_high", "prob_critical"]
+# Feature engineering from process_medical_csv that reads editable columns; recomputed on the rows whose sources changed
+DERIVED = {
+    "bp_control_indicator": (["systolic_bp"], lambda get, X: (get("systolic_bp") < 140).astype(int)),
+    "sbp_implausible": (["systolic_bp"], lambda get, X: ((get("systolic_bp") < 60) | (get("systolic_bp") > 300)).astype(int)),
+    "dbp_implausible": (["diastolic_bp"], lambda get, X: ((get("diastolic_bp") < 30) | (get("diastolic_bp") > 200)).astype(int)),
+    "hr_implausible": (["heart_rate"], lambda get, X: ((get("heart_rate") < 30) | (get("heart_rate") > 220)).astype(int)),
+    "pdc_mean_adherence": (ADHERENCE_COLS, lambda get, X: pdc_mean(get, X)),
+}
+
+
+def frozen_inputs(columns) -> list[str]:
+    # The generator outputs and the flags process_medical_csv derived from them (prob_low_outlier, ...)
+    return [c for c in columns if c in FROZEN_INPUTS or any(c.startswith(f"{f}_") for f in FROZEN_INPUTS)]
+
+
+def pdc_mean(get, X: pd.DataFrame) -> np.ndarray:
+    present = [c for c in ADHERENCE_COLS if c in X.columns]
+    if len(present) == len(ADHERENCE_COLS):
+        return np.mean([get(c).astype(np.float64) for c in present], axis=0)
+    # Feature selection dropped some inputs: shift the stored mean by the change in the ones still here
+    pdc = X["pdc_mean_adherence"].to_numpy(dtype=np.float64)
+    return pdc + sum(get(c).astype(np.float64) - X[c].to_numpy(dtype=np.float64) for c in present) / len(ADHERENCE_COLS)
+
+
+def column_stats(X: pd.DataFrame) -> dict:
+    # Frozen cohort statistics behind the *_outlier flags (validate_ranges) and *_robust columns (RobustScaler):
+    # an intervention moves patients, not the population thresholds they are compared against
+    stats = {}
+    for c in X.columns:
+        if f"{c}_outlier" in X.columns or f"{c}_robust" in X.columns:
+            s = X[c].astype(np.float64)
+            stats[c] = (float(s.median()), float(s.quantile(0.75) - s.quantile(0.25)))
+    return stats
+
+
+def validate_scenarios(scenarios: list[dict], X: pd.DataFrame, extra: pd.DataFrame):
+    for s in scenarios:
+        for e in s["edits"]:
+            if e["column"] not in X.columns:
+                raise ValueError(f"Scenario {s['name']}: {e['column']} is not a model feature")
+            if e["op"] not in EDIT_OPS:
+                raise ValueError(f"Scenario {s['name']}: unknown op {e['op']} (use one of {', '.join(EDIT_OPS)})")
+            for w in e.get("where", []):
+                if w["column"] not in X.columns and w["column"] not in extra.columns:
+                    raise ValueError(f"Scenario {s['name']}: unknown where column {w['column']}")
+                if w["op"] not in WHERE_OPS:
+                    raise ValueError(f"Scenario {s['name']}: unknown where op {w['op']}")
+
+
+def apply_scenario(X: pd.DataFrame, extra: pd.DataFrame, scenario: dict, stats: dict) -> tuple[np.ndarray, dict]:
+    """Vectorised edits on one block of patients. Returns the rows that changed and the new values of every
+    column the scenario touches (edited, derived and flag columns), in the block's dtypes."""
+    updates = {}
+
+    def get(c):
+        return updates[c] if c in updates else X[c].to_numpy()
+
+    for e in scenario["edits"]:
+        mask = np.ones(len(X), dtype=bool)
+        for w in e.get("where", []):
+            source = X if w["column"] in X.columns else extra
+            mask &= WHERE_OPS[w["op"]](source[w["column"]].to_numpy(), w["value"])
+        values = get(e["column"]).copy()
+        values[mask] = EDIT_OPS[e["op"]](values[mask], e["value"])
+        updates[e["column"]] = values
+
+    edited = list(updates)
+    for name, (sources, fn) in DERIVED.items():
+        touched = [c for c in sources if c in edited]
+        if name in X.columns and touched:
+            moved = np.any([updates[c] != X[c].to_numpy() for c in touched], axis=0)
+            updates[name] = np.where(moved, fn(get, X), X[name].to_numpy())
+    for c in list(updates):
+        if c in stats:
+            median, iqr = stats[c]
+            # Only rows whose value moved; the stored flags of the rest stay exactly as process_medical_csv wrote them
+            moved = updates[c] != X[c].to_numpy()
+            if f"{c}_outlier" in X.columns and iqr and np.isfinite(iqr):
+                flag = (np.abs((updates[c] - median) / iqr) > 4).astype(int)
+                updates[f"{c}_outlier"] = np.where(moved, flag, X[f"{c}_outlier"].to_numpy())
+            if f"{c}_robust" in X.columns and iqr:
+                updates[f"{c}_robust"] = np.where(moved, (updates[c] - median) / iqr, X[f"{c}_robust"].to_numpy())
+
+    changed = np.zeros(len(X), dtype=bool)
+    for c, v in updates.items():
+        old = X[c].to_numpy()
+        v = v.astype(old.dtype)
+        updates[c] = v
+        changed |= ~((v == old) | (pd.isna(v) & pd.isna(old)))
+    return changed, updates
+
+
+def load_scorer(data_dir: Path, compiled: bool = False):
+    bundle = joblib.load(data_dir/"ensemble.joblib")
+    if compiled:
+        from compiled_scorer import CompiledScorer
+
+        scorer = CompiledScorer.load(data_dir/"scorer.npz")
+        return bundle, scorer.predict_proba
+    models, pre = bundle["models"], bundle["pre"]
+    return bundle, lambda X: np.vstack([m.predict_proba(pre.transform(X))[:,1] for m in models]).mean(axis=0)
+
+
+def transitions(before: np.ndarray, after: np.ndarray) -> dict:
+    k = len(RISK_LEVELS)
+    counts = np.bincount(before * k + after, minlength=k * k).reshape(k, k)
+    return {src: {dst: int(counts[i, j]) for j, dst in enumerate(RISK_LEVELS)} for i, src in enumerate(RISK_LEVELS)}
+
+
+def simulate(df: pd.DataFrame, score, dtype, scenarios: list[dict], stack_rows: int = 250_000, progress: bool = True,
+             exclude=()) -> tuple[dict, np.ndarray]:
+    """Score the cohort once as is and once per scenario. Only rows a scenario actually changes are rescored; the changed
+    rows of every scenario in a block of patients go through predict_proba as one stacked batch of up to ~stack_rows.
+    exclude: the columns the ensemble was trained without (matrix_settings), so X holds exactly its inputs."""
+    X = prepare_data(df, dtype=dtype, exclude=exclude)[0]
+    extra = df[[c for c in df.columns if c not in X.columns]]
+    validate_scenarios(scenarios, X, extra)
+    stats = column_stats(X)
+    n, k = len(X), len(scenarios)
+    ps = np.empty((k + 1, n))
+    edited = np.zeros(k, dtype=np.int64)
+    block = max(1, stack_rows // (k + 1))
+    started = time.perf_counter()
+    for start in range(0, n, block):
+        Xb, eb = X.iloc[start:start + block], extra.iloc[start:start + block]
+        parts, targets = [Xb], [(0, np.arange(len(Xb)))]
+        for i, scenario in enumerate(scenarios):
+            changed, updates = apply_scenario(Xb, eb, scenario, stats)
+            rows = np.flatnonzero(changed)
+            edited[i] += len(rows)
+            part = Xb.iloc[rows].copy()
+            for c, v in updates.items():
+                part[c] = v[rows]
+            parts.append(part)
+            targets.append((i + 1, rows))
+        scores = score(pd.concat(parts, ignore_index=True))
+        offset = 0
+        for s, rows in targets:
+            ps[s, start + rows] = scores[offset:offset + len(rows)]
+            offset += len(rows)
+        # Rows a scenario left alone keep their baseline score
+        for s, rows in targets[1:]:
+            keep = np.ones(len(Xb), dtype=bool)
+            keep[rows] = False
+            ps[s, start:start + len(Xb)][keep] = ps[0, start:start + len(Xb)][keep]
+        if progress:
+            done = min(start + block, n)
+            print(f"{done}/{n} patients, {done * (k + 1) / (time.perf_counter() - started):.0f} patient-scenarios/s", flush=True)
+
+    levels = [risk_level_codes(p) for p in ps]
+    high_code = RISK_LEVELS.index("high")
+    high = levels[0] >= high_code
+    frozen = frozen_inputs(X.columns)
+    report = {"patients": int(n), "seconds": time.perf_counter() - started, "baseline": {
+        "mean_risk": float(ps[0].mean()), "levels": dict(zip(RISK_LEVELS, np.bincount(levels[0], minlength=len(RISK_LEVELS)).tolist()))},
+        # Scenario effects are only meaningful when no input is held at its baseline value
+        "frozen_inputs": frozen, "valid": not frozen, "scenarios": []}
+    for i, scenario in enumerate(scenarios):
+        after = levels[i + 1]
+        now_high = after >= high_code
+        report["scenarios"].append({
+            "name": scenario["name"],
+            "edits": scenario["edits"],
+            "patients_edited": int(edited[i]),
+            "mean_risk": float(ps[i + 1].mean()),
+            "mean_risk_change": float((ps[i + 1] - ps[0]).mean()),
+            "high_critical_before": int(high.sum()),
+            "high_critical_after": int(now_high.sum()),
+            "left_high_critical": int((high & ~now_high).sum()),
+            "entered_high_critical": int((~high & now_high).sum()),
+            "transitions": transitions(levels[0], after),
+        })
+    return report, ps
+
+
+def main():
+    ap = argparse.ArgumentParser(description="What-if interventions: edit the cohort per scenario, rescore with the trained ensemble, report risk-level transitions")
+    ap.add_argument("--input", default="public/processed_medical_dataset.csv")
+    ap.add_argument("--data_dir", default="public/data", help="Holds ensemble.joblib (and scorer.npz for --compiled)")
+    ap.add_argument("--scenarios", default=None, help="JSON list of {name, edits: [{column, op, value, where?}]}; default: the built-in set")
+    ap.add_argument("--compiled", action="store_true", help="Score with the NumPy-only scorer.npz instead of the library models (no sklearn/LightGBM/XGBoost needed, and faster on large cohorts)")
+    ap.add_argument("--stack_rows", type=int, default=250_000, help="Rows per stacked predict_proba call (baseline + all scenarios)")
+    ap.add_argument("--tile", type=int, default=None, help="Benchmark: tile the cohort to this many patients first")
+    ap.add_argument("--allow_frozen_inputs", action="store_true", help="Run even when the ensemble uses risk_score/prob_* as features (the report is marked invalid)")
+    ap.add_argument("--output", default="public/data/interventions.json")
+    ap.add_argument("--patients_output", default=None, help="Optional CSV of per-patient baseline and scenario risk scores")
+    args = ap.parse_args()
+
+    scenarios = json.loads(Path(args.scenarios).read_text()) if args.scenarios else DEFAULT_SCENARIOS
+    df = pd.read_csv(args.input)
+    if args.tile:
+        from cohort_index import tile_cohort
+
+        df = tile_cohort(df, args.tile)
+    bundle, score = load_scorer(Path(args.data_dir), compiled=args.compiled)
+    # Same numeric dtype and input columns as the matrix the ensemble was fitted on (train_models --dtype/--exclude)
+    settings = matrix_settings(bundle["pre"], df.columns)
+    frozen = frozen_inputs(bundle["pre"].feature_names_in_)
+    if frozen and not args.allow_frozen_inputs:
+        raise SystemExit(f"The ensemble uses {', '.join(frozen)} as features, which no scenario can move. Retrain with "
+                         f"train_models.py --exclude {' '.join(frozen)}, or pass --allow_frozen_inputs to write a report marked invalid.")
+    report, ps = simulate(df, score, settings["dtype"], scenarios, stack_rows=args.stack_rows, exclude=settings["exclude"])
+    report["scorer"] = "compiled" if args.compiled else "library"
+    write_text(Path(args.output), json.dumps(report, indent=2))
+    if args.patients_output:
+        out = pd.DataFrame({"patient_id": df["patient_id"].astype(str) if "patient_id" in df.columns else np.arange(len(df)),
+                            "baseline": ps[0], **{s["name"]: ps[i + 1] for i, s in enumerate(scenarios)}})
+        write_text(Path(args.patients_output), out.to_csv(index=False))
+
+    print(f"{report['patients']} patients x {len(scenarios)} scenarios in {report['seconds']:.1f}s")
+    for s in report["scenarios"]:
+        print(f"  {s['name']:<30} edited {s['patients_edited']:>8}  high/critical {s['high_critical_before']} -> {s['high_critical_after']} "
+              f"(-{s['left_high_critical']} +{s['entered_high_critical']})  mean risk {s['mean_risk_change']:+.4f}")
+    if not report["valid"]:
+        print(f"Note: the ensemble uses {', '.join(report['frozen_inputs'])} as features; scenarios hold them at baseline, "
+              "so effects are understated and the report is marked invalid. Retrain with --exclude for intervention analysis.")
+    print(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,34 @@
 import argparse
+import copy
+import hashlib
+import io
 import json
+import multiprocessing
+import os
+import resource
+import subprocess
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from pathlib import Path
 
 import joblib
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 from imblearn.over_sampling import SMOTE
+from sklearn.base import clone
 from sklearn.compose import ColumnTransformer
 from sklearn.linear_model import LogisticRegression
 from sklearn.metrics import roc_auc_score, precision_recall_curve, roc_curve, average_precision_score, confusion_matrix
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import StratifiedKFold, train_test_split
+from sklearn.neighbors import NearestNeighbors
 from sklearn.pipeline import Pipeline
 from sklearn.preprocessing import OneHotEncoder, StandardScaler
 
+from artifacts import atomic_path, remove_dir, write_text
+
 # Optional model backends
 try:
     from lightgbm import LGBMClassifier  # type: ignore
@@ -44,61 +60,239 @@ except Exception:
     HAS_LIME = False
 
 
-def prepare_data(df: pd.DataFrame, target_col: str = "risk_level"):
+def prepare_data(df: pd.DataFrame, target_col: str = "risk_level", dtype=np.float32, sparse: bool = False, exclude=()):
+    # np.float32 and np.dtype("float32") repr differently, and the encoder params feed fold_cache_key
+    dtype = np.dtype(dtype)
     # If risk_level not present, derive from risk_score
     if target_col not in df.columns and "risk_score" in df.columns:
+        # assign() rather than df[...] = ..., so the caller's frame (possibly shared with other stages) is left untouched
         s = df["risk_score"].astype(float)
-        df[target_col] = pd.cut(s, bins=[-1,35,65,85, 101], labels=["low","moderate","high","critical"]).astype(str)
+        df = df.assign(**{target_col: pd.cut(s, bins=[-1,35,65,85, 101], labels=["low","moderate","high","critical"]).astype(str)})
 
     # Binary target: critical/high vs others for demonstration
     y = df[target_col].fillna("low").astype(str).map(lambda r: 1 if r in ("high","critical") else 0)
 
     # Feature set: numeric + TE, robust-scaled, adherence, vitals, labs
-    exclude = {"patient_id", target_col}
-    X = df[[c for c in df.columns if c not in exclude]].copy()
-
-    numeric_cols = X.select_dtypes(include=[np.number]).columns.tolist()
-    categorical_cols = [c for c in X.columns if X[c].dtype == "O"]
-
+    # exclude: further columns kept out of the features, e.g. simulate_interventions.FROZEN_INPUTS
+    exclude = {"patient_id", target_col, *exclude}
+    cols = [c for c in df.columns if c not in exclude]
+    # From the dtypes alone: df[cols].select_dtypes() would copy every column first
+    numeric_cols = [c for c in cols if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])]
+    categorical_cols = [c for c in cols if df[c].dtype == "O"]
+    # Numeric inputs are cast once here; StandardScaler and OneHotEncoder then keep `dtype`, so the
+    # transformed matrix is built in its final representation and SMOTE, the models, SHAP and LIME use it as-is.
+    # Built column by column: only cast columns are new arrays, the rest are shared with df rather than copied
+    numeric = set(numeric_cols)
+    X = pd.DataFrame({c: df[c].astype(dtype, copy=False) if c in numeric else df[c] for c in cols}, copy=False)
+
+    # Output layout is explicit rather than density-dependent: dense ndarray, or CSR when sparse=True
+    # (centering would densify a sparse matrix, so the scaler only rescales in that mode)
     pre = ColumnTransformer([
-        ("num", Pipeline(steps=[("scaler", StandardScaler())]), numeric_cols),
-        ("cat", OneHotEncoder(handle_unknown="ignore"), categorical_cols),
-    ])
+        ("num", Pipeline(steps=[("scaler", StandardScaler(with_mean=not sparse))]), numeric_cols),
+        ("cat", OneHotEncoder(handle_unknown="ignore", dtype=dtype, sparse_output=sparse), categorical_cols),
+    ], sparse_threshold=1.0 if sparse else 0.0)
 
     return X, y, pre, numeric_cols, categorical_cols
 
 
-def model_ensemble():
+def matrix_settings(pre: ColumnTransformer, columns=()) -> dict:
+    # prepare_data keyword arguments a fitted preprocessor was built with, so new data is cast to match it; any of
+    # `columns` it was not fitted on are excluded
+    enc = pre.named_transformers_["cat"]
+    inputs = set(pre.feature_names_in_)
+    return {"dtype": np.dtype(enc.dtype), "sparse": bool(enc.sparse_output), "exclude": [c for c in columns if c not in inputs]}
+
+
+def supersede_patients(df_old: pd.DataFrame, df_new: pd.DataFrame):
+    # A patient re-sent in a new batch replaces their old row, and the last copy within the batch wins; keys must stay
+    # unique for patients.store
+    if "patient_id" not in df_new.columns:
+        return df_old, df_new
+    df_new = df_new.drop_duplicates("patient_id", keep="last")
+    if "patient_id" in df_old.columns:
+        df_old = df_old[~df_old["patient_id"].isin(df_new["patient_id"])]
+    return df_old, df_new
+
+
+TUNED_PARAMS = Path(__file__).resolve().parent/"data"/"tuned_params.json"
+
+
+def load_tuned_params(path: Path = TUNED_PARAMS) -> dict:
+    path = Path(path)
+    return json.loads(path.read_text()) if path.exists() else {}
+
+
+def model_ensemble(params: dict | None = None):
+    # Hyperparameters persisted by tune_models.py override the defaults below, keyed by estimator class name
+    params = load_tuned_params() if params is None else params
     # Always include Logistic Regression with L2
-    models = [LogisticRegression(max_iter=2000, solver="saga", penalty="l2", C=1.0)]
+    models = [LogisticRegression(**{**dict(max_iter=2000, solver="saga", penalty="l2", C=1.0), **params.get("LogisticRegression", {})})]
     if HAS_LGBM:
-        models.append(LGBMClassifier(n_estimators=300, learning_rate=0.05, subsample=0.9, colsample_bytree=0.8, random_state=42))
+        models.append(LGBMClassifier(**{**dict(n_estimators=300, learning_rate=0.05, subsample=0.9, colsample_bytree=0.8, random_state=42), **params.get("LGBMClassifier", {})}))
     if HAS_XGB:
-        models.append(XGBClassifier(n_estimators=400, learning_rate=0.05, subsample=0.9, colsample_bytree=0.8, eval_metric="logloss", random_state=42))
+        models.append(XGBClassifier(**{**dict(n_estimators=400, learning_rate=0.05, subsample=0.9, colsample_bytree=0.8, eval_metric="logloss", random_state=42), **params.get("XGBClassifier", {})}))
     return models
 
 
-def fit_models(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, smote: bool = True):
-    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+def allocate_threads(models, n_jobs: int) -> list[int]:
+    # saga never uses more than one core on a binary target, so the boosters split the rest of the budget
+    boosters = [i for i, m in enumerate(models) if not isinstance(m, LogisticRegression)]
+    threads = [1] * len(models)
+    if not boosters:
+        return threads
+    spare = max(n_jobs - (len(models) - len(boosters)), len(boosters))
+    for k, i in enumerate(boosters):
+        threads[i] = spare // len(boosters) + (1 if k < spare % len(boosters) else 0)
+    return threads
+
+
+def share_matrix(Xt, y, workdir: Path, sample_weight=None) -> Path:
+    # Dumped once; workers memory-map the arrays (dense or the buffers of a sparse matrix) instead of unpickling copies
+    path = Path(workdir)/"shared_matrix.joblib"
+    joblib.dump((Xt, np.asarray(y), sample_weight), path)
+    return path
+
+
+def load_shared(path: Path):
+    return joblib.load(path, mmap_mode="r")
+
+
+def set_threads(model, threads: int):
+    if "n_jobs" in model.get_params() and not isinstance(model, LogisticRegression):
+        model.set_params(n_jobs=threads)
+    return model
+
+
+def _fit_member(model, path: Path, threads: int):
+    Xt, y, sample_weight = load_shared(path)
+    set_threads(model, threads)
+    start = time.perf_counter()
+    model.fit(Xt, y, sample_weight=sample_weight)
+    return model, time.perf_counter() - start
+
+
+def train_ensemble(models, Xt, y, n_jobs: int | None = None, sample_weight=None):
+    # n_jobs=None keeps the sequential fit where each booster picks its own thread count
+    timings = {}
+    start = time.perf_counter()
+    if n_jobs is None:
+        for m in models:
+            t0 = time.perf_counter()
+            m.fit(Xt, y, sample_weight=sample_weight)
+            timings[m.__class__.__name__] = time.perf_counter() - t0
+    else:
+        threads = allocate_threads(models, n_jobs)
+        with tempfile.TemporaryDirectory(prefix="welldoc_fit_") as tmp:
+            path = share_matrix(Xt, y, Path(tmp), sample_weight=sample_weight)
+            with ProcessPoolExecutor(max_workers=max(1, min(len(models), n_jobs))) as pool:
+                futures = [pool.submit(_fit_member, m, path, t) for m, t in zip(models, threads)]
+                fitted = [f.result() for f in futures]
+        models = [m for m, _ in fitted]
+        for m, secs in fitted:
+            timings[m.__class__.__name__] = secs
+    timings["total"] = time.perf_counter() - start
+    return models, timings
+
+
+IMBALANCE_STRATEGIES = ("smote", "weights", "batch", "approx_smote", "none")
+
+
+def balanced_weights(y) -> np.ndarray:
+    y = np.asarray(y)
+    counts = np.bincount(y, minlength=2).astype(float)
+    return (len(y) / (len(counts) * np.maximum(counts, 1)))[y]
+
+
+def balanced_batches(y, batch_size: int = 50_000, random_state: int = 42) -> np.ndarray:
+    # Each shuffled mini-batch keeps its minority rows and draws as many majority rows from the same batch,
+    # so only row indices are materialized and the training matrix shrinks instead of growing
+    rng = np.random.RandomState(random_state)
+    y = np.asarray(y)
+    minority = int(np.argmin(np.bincount(y, minlength=2)))
+    order = rng.permutation(len(y))
+    keep = []
+    for i in range(0, len(order), batch_size):
+        batch = order[i:i+batch_size]
+        minor = batch[y[batch] == minority]
+        major = batch[y[batch] != minority]
+        keep.append(minor)
+        keep.append(rng.choice(major, size=min(len(major), len(minor)), replace=False))
+    return np.sort(np.concatenate(keep))
+
+
+def chunked_smote(Xt, y, chunk_size: int = 20_000, k_neighbors: int = 5, random_state: int = 42):
+    # Approximate SMOTE: neighbours are searched only within random chunks of the minority class, so the
+    # kNN cost is O(n * chunk) and only one dense chunk is live at a time
+    rng = np.random.RandomState(random_state)
+    y = np.asarray(y)
+    counts = np.bincount(y, minlength=2)
+    minority = int(np.argmin(counts))
+    deficit = int(counts.max() - counts.min())
+    minor_idx = rng.permutation(np.flatnonzero(y == minority))
+    if deficit == 0 or len(minor_idx) < 2:
+        return Xt, y
+    n_chunks = max(1, int(np.ceil(len(minor_idx) / chunk_size)))
+    per_chunk = np.full(n_chunks, deficit // n_chunks)
+    per_chunk[:deficit % n_chunks] += 1
+    synthetic = []
+    for chunk, n_new in zip(np.array_split(minor_idx, n_chunks), per_chunk):
+        if n_new == 0 or len(chunk) < 2:
+            continue
+        block = Xt[chunk]
+        block = block.toarray() if sp.issparse(block) else np.asarray(block)
+        k = min(k_neighbors, len(chunk) - 1)
+        nn = NearestNeighbors(n_neighbors=k + 1).fit(block).kneighbors(block, return_distance=False)[:, 1:]
+        base = rng.randint(0, len(chunk), size=n_new)
+        neighbour = nn[base, rng.randint(0, k, size=n_new)]
+        gap = rng.uniform(size=(n_new, 1)).astype(block.dtype)
+        synthetic.append(block[base] + gap * (block[neighbour] - block[base]))
+    new = np.vstack(synthetic).astype(Xt.dtype, copy=False)
+    Xt_out = sp.vstack([Xt, sp.csr_matrix(new)], format="csr") if sp.issparse(Xt) else np.vstack([Xt, new])
+    return Xt_out, np.concatenate([y, np.full(len(new), minority, dtype=y.dtype)])
+
+
+def rebalance(Xt, y, strategy: str = "smote", random_state: int = 42):
+    # Returns (Xt, y, sample_weight); sample_weight is None unless the strategy reweights instead of resampling
+    y = np.asarray(y)
+    if strategy == "smote":
+        Xt, y = SMOTE(random_state=random_state).fit_resample(Xt, y)
+        return Xt, np.asarray(y), None
+    if strategy == "weights":
+        return Xt, y, balanced_weights(y)
+    if strategy == "batch":
+        idx = balanced_batches(y, random_state=random_state)
+        return Xt[idx], y[idx], None
+    if strategy == "approx_smote":
+        Xt, y = chunked_smote(Xt, y, random_state=random_state)
+        return Xt, y, None
+    if strategy == "none":
+        return Xt, y, None
+    raise ValueError(f"unknown imbalance strategy {strategy!r}; expected one of {IMBALANCE_STRATEGIES}")
+
+
+def fit_models(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, smote: bool = True, n_jobs: int | None = None, params: dict | None = None,
+               imbalance: str | None = None):
+    # Split positions rather than the frame: the training rows are only sliced out for the transform
+    train_idx, test_idx = train_test_split(np.arange(len(y)), test_size=0.2, random_state=42, stratify=y)
+    X_test, y_train, y_test = X.iloc[test_idx], y.iloc[train_idx], y.iloc[test_idx]
 
     # Fit preprocessor
-    Xt_train = pre.fit_transform(X_train)
+    start = time.perf_counter()
+    Xt_train = pre.fit_transform(X.iloc[train_idx])
     Xt_test = pre.transform(X_test)
+    preprocess_seconds = time.perf_counter() - start
 
-    # SMOTE on training
-    if smote:
-        sampler = SMOTE(random_state=42)
-        Xt_train, y_train = sampler.fit_resample(Xt_train, y_train)
+    # Class imbalance on training only; smote=False is kept as shorthand for imbalance="none"
+    start = time.perf_counter()
+    Xt_train, y_train, sample_weight = rebalance(Xt_train, y_train, imbalance or ("smote" if smote else "none"))
+    resample_seconds = time.perf_counter() - start
 
-    models = model_ensemble()
-    for m in models:
-        m.fit(Xt_train, y_train)
+    models, fit_times = train_ensemble(model_ensemble(params), Xt_train, y_train, n_jobs=n_jobs, sample_weight=sample_weight)
 
     def predict_proba(models, Xt):
         ps = [m.predict_proba(Xt)[:,1] for m in models]
         return np.vstack(ps).mean(axis=0)
 
-    p_train = predict_proba(models, Xt_train)
     p_test = predict_proba(models, Xt_test)
 
     # Metrics
@@ -111,31 +305,304 @@ def fit_models(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, smote: boo
     metrics = {
         "roc": {"fpr": fpr.tolist(), "tpr": tpr.tolist(), "auc": float(auc)},
         "pr": {"precision": prec.tolist(), "recall": rec.tolist(), "ap": float(ap)},
-        "confusion": {"tn": int(cm[0,0]), "fp": int(cm[0,1]), "fn": int(cm[1,0]), "tp": int(cm[1,1])}
+        "confusion": {"tn": int(cm[0,0]), "fp": int(cm[0,1]), "fn": int(cm[1,0]), "tp": int(cm[1,1])},
+        "timings": {"preprocess": preprocess_seconds, "resample": resample_seconds, "fit": fit_times},
     }
 
     return models, pre, (X_test, y_test, p_test), metrics
 
 
-def write_outputs(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: Path):
+def fold_cache_key(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, k: int, imbalance: str) -> str:
+    # Only data, preprocessing and the fold spec go into the key: model hyperparameters can change freely
+    h = hashlib.sha1()
+    h.update(pd.util.hash_pandas_object(X, index=False).values.tobytes())
+    h.update(np.asarray(y).tobytes())
+    h.update(repr((k, imbalance, sorted(pre.get_params(deep=True).items(), key=lambda kv: kv[0]))).encode())
+    return h.hexdigest()[:16]
+
+
+def _build_fold(pre: ColumnTransformer, X_train, y_train, X_test, y_test, test_idx, imbalance: str, path: Path):
+    fold_pre = clone(pre)
+    Xt_train = fold_pre.fit_transform(X_train)
+    Xt_test = fold_pre.transform(X_test)
+    Xt_train, y_train, sample_weight = rebalance(Xt_train, y_train, imbalance)
+    tmp = path.with_suffix(".tmp")
+    joblib.dump({"Xt_train": Xt_train, "y_train": np.asarray(y_train), "w_train": sample_weight, "Xt_test": Xt_test,
+                 "y_test": np.asarray(y_test), "test_idx": np.asarray(test_idx)}, tmp)
+    tmp.replace(path)
+    return path
+
+
+def cache_folds(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, k: int, cache_dir: Path, imbalance: str = "smote", n_jobs: int = 1) -> list[Path]:
+    fold_dir = Path(cache_dir)/fold_cache_key(X, y, pre, k, imbalance)
+    paths = [fold_dir/f"fold_{i}.joblib" for i in range(k)]
+    missing = [i for i, p in enumerate(paths) if not p.exists()]
+    if not missing:
+        print(f"Reusing cached folds in {fold_dir}")
+        return paths
+    fold_dir.mkdir(parents=True, exist_ok=True)
+    splits = list(StratifiedKFold(n_splits=k, shuffle=True, random_state=42).split(X, y))
+    with ProcessPoolExecutor(max_workers=max(1, min(len(missing), n_jobs))) as pool:
+        futures = []
+        for i in missing:
+            tr, te = splits[i]
+            futures.append(pool.submit(_build_fold, pre, X.iloc[tr], y.iloc[tr], X.iloc[te], y.iloc[te], te, imbalance, paths[i]))
+        for f in futures:
+            f.result()
+    return paths
+
+
+def _run_fold(path: Path, threads: int, params: dict | None = None):
+    fold = load_shared(path)
+    models = model_ensemble(params)
+    for m, t in zip(models, allocate_threads(models, threads)):
+        set_threads(m, t)
+    models, fit_times = train_ensemble(models, fold["Xt_train"], fold["y_train"], sample_weight=fold.get("w_train"))
+    p_test = np.vstack([m.predict_proba(fold["Xt_test"])[:,1] for m in models]).mean(axis=0)
+    return np.asarray(fold["test_idx"]), p_test, fit_times
+
+
+def cross_validate(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, k: int = 5, imbalance: str = "smote", n_jobs: int = 1, cache_dir: Path = Path("public/.cache/folds"), params: dict | None = None) -> dict:
+    paths = cache_folds(X, y, pre, k, cache_dir, imbalance=imbalance, n_jobs=n_jobs)
+    workers = max(1, min(k, n_jobs))
+    y_arr = np.asarray(y)
+    oof = np.zeros(len(y_arr))
+    folds = []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(_run_fold, p, max(1, n_jobs // workers), params) for p in paths]
+        for i, f in enumerate(futures):
+            test_idx, p_test, fit_times = f.result()
+            oof[test_idx] = p_test
+            folds.append({
+                "fold": i,
+                "n_test": int(len(test_idx)),
+                "auc": float(roc_auc_score(y_arr[test_idx], p_test)),
+                "ap": float(average_precision_score(y_arr[test_idx], p_test)),
+                "fit_seconds": fit_times,
+            })
+
+    aucs = np.array([f["auc"] for f in folds])
+    cm = confusion_matrix(y_arr, (oof>=0.5).astype(int))
+    return {
+        "k": k,
+        "folds": folds,
+        "mean_auc": float(aucs.mean()),
+        "std_auc": float(aucs.std()),
+        "pooled": {
+            "auc": float(roc_auc_score(y_arr, oof)),
+            "ap": float(average_precision_score(y_arr, oof)),
+            "confusion": {"tn": int(cm[0,0]), "fp": int(cm[0,1]), "fn": int(cm[1,0]), "tp": int(cm[1,1])},
+        },
+    }
+
+
+def warm_start_models(models, Xt, y, extra_trees: int = 50, sample_weight=None):
+    # Boosters keep their trees and add extra_trees more; the linear member restarts saga from its current coefficients
+    updated, timings = [], {}
+    for m in models:
+        m = copy.deepcopy(m)
+        start = time.perf_counter()
+        if HAS_LGBM and isinstance(m, LGBMClassifier):
+            init = m.booster_
+            m.set_params(n_estimators=extra_trees)
+            m.fit(Xt, y, sample_weight=sample_weight, init_model=init)
+        elif HAS_XGB and isinstance(m, XGBClassifier):
+            init = m.get_booster()
+            m.set_params(n_estimators=extra_trees)
+            m.fit(Xt, y, sample_weight=sample_weight, xgb_model=init)
+        else:
+            m.set_params(warm_start=True)
+            m.fit(Xt, y, sample_weight=sample_weight)
+        timings[m.__class__.__name__] = time.perf_counter() - start
+        updated.append(m)
+    timings["total"] = sum(timings.values())
+    return updated, timings
+
+
+def ensemble_scores(models, Xt, y) -> dict:
+    p = np.vstack([m.predict_proba(Xt)[:,1] for m in models]).mean(axis=0)
+    return {"auc": float(roc_auc_score(y, p)), "ap": float(average_precision_score(y, p))}
+
+
+def incremental_retrain(bundle: dict, df_old: pd.DataFrame, df_new: pd.DataFrame, replay_frac: float = 0.1, extra_trees: int = 50,
+                        imbalance: str = "smote", compare_full: bool = True, n_jobs: int | None = None, params: dict | None = None):
+    models, pre = bundle["models"], bundle["pre"]
+    n_rows = len(df_old) + len(df_new)
+    df_old, df_new = supersede_patients(df_old, df_new)
+    # Cast like the matrix the saved ensemble was fitted on, not prepare_data's defaults
+    X_old, y_old, _, _, _ = prepare_data(df_old, **matrix_settings(pre, df_old.columns))
+    X_new, y_new, _, _, _ = prepare_data(df_new, **matrix_settings(pre, df_new.columns))
+
+    # Held-out slice of the new batch is the common yardstick for previous, incremental and full models
+    X_fit, X_hold, y_fit, y_hold = train_test_split(X_new, y_new, test_size=0.2, random_state=42, stratify=y_new)
+    replay = X_old.sample(frac=replay_frac, random_state=42) if replay_frac > 0 else X_old.iloc[:0]
+    X_inc = pd.concat([X_fit, replay[X_fit.columns]])
+    y_inc = pd.concat([y_fit, y_old.loc[replay.index]])
+
+    start = time.perf_counter()
+    Xt_inc = pre.transform(X_inc)
+    Xt_inc, y_inc, w_inc = rebalance(Xt_inc, y_inc, imbalance)
+    updated, inc_times = warm_start_models(models, Xt_inc, y_inc, extra_trees=extra_trees, sample_weight=w_inc)
+    inc_seconds = time.perf_counter() - start
+
+    Xt_hold = pre.transform(X_hold)
+    report = {
+        "n_new": int(len(X_new)),
+        "n_replay": int(len(replay)),
+        "n_superseded": int(n_rows - len(df_old) - len(df_new)),
+        "n_holdout": int(len(X_hold)),
+        "extra_trees": extra_trees,
+        "previous": ensemble_scores(models, Xt_hold, y_hold),
+        "incremental": {**ensemble_scores(updated, Xt_hold, y_hold), "seconds": inc_seconds, "fit_seconds": inc_times},
+    }
+
+    if compare_full:
+        start = time.perf_counter()
+        full_pre = clone(pre)
+        X_full = pd.concat([X_old[X_fit.columns], X_fit])
+        Xt_full = full_pre.fit_transform(X_full)
+        Xt_full, y_full, w_full = rebalance(Xt_full, pd.concat([y_old, y_fit]), imbalance)
+        full_models, full_times = train_ensemble(model_ensemble(params), Xt_full, y_full, n_jobs=n_jobs, sample_weight=w_full)
+        report["full"] = {**ensemble_scores(full_models, full_pre.transform(X_hold), y_hold),
+                          "seconds": time.perf_counter() - start, "fit_seconds": full_times}
+        report["auc_gap"] = report["full"]["auc"] - report["incremental"]["auc"]
+        report["speedup"] = report["full"]["seconds"] / max(inc_seconds, 1e-9)
+
+    return updated, pre, report
+
+
+def peak_rss_mb(who: int = resource.RUSAGE_SELF) -> float:
+    # ru_maxrss is KiB on Linux. RUSAGE_CHILDREN is the largest single reaped child (e.g. a --n_jobs fit worker), not a sum
+    return resource.getrusage(who).ru_maxrss / 1024
+
+
+def _bench_strategy(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, strategy: str, params: dict | None) -> dict:
+    # Runs in a fresh spawned process so ru_maxrss is this strategy's own peak
+    baseline = peak_rss_mb()
+    X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.2, random_state=42, stratify=y)
+    pre = clone(pre)
+    Xt_train = pre.fit_transform(X_train)
+    Xt_test = pre.transform(X_test)
+    start = time.perf_counter()
+    Xt_train, y_train, sample_weight = rebalance(Xt_train, y_train, strategy)
+    resample_seconds = time.perf_counter() - start
+    models, fit_times = train_ensemble(model_ensemble(params), Xt_train, y_train, sample_weight=sample_weight)
+    scores = ensemble_scores(models, Xt_test, y_test)
+    return {
+        "strategy": strategy,
+        **scores,
+        "train_rows": int(Xt_train.shape[0]),
+        "resample_seconds": resample_seconds,
+        "fit_seconds": fit_times,
+        "peak_rss_mb": peak_rss_mb(),
+        "startup_rss_mb": baseline,
+    }
+
+
+def benchmark_imbalance(X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, strategies=IMBALANCE_STRATEGIES, params: dict | None = None) -> list[dict]:
+    results = []
+    ctx = multiprocessing.get_context("spawn")
+    for strategy in strategies:
+        with ProcessPoolExecutor(max_workers=1, mp_context=ctx) as pool:
+            result = pool.submit(_bench_strategy, X, y, pre, strategy, params).result()
+        print(f"{strategy:>12}: AUC {result['auc']:.4f}  rows {result['train_rows']}  resample {result['resample_seconds']:.2f}s  "
+              f"fit {result['fit_seconds']['total']:.2f}s  peak RSS {result['peak_rss_mb']:.0f} MB")
+        results.append(result)
+    return results
+
+
+RISK_LEVELS = ["low", "moderate", "high", "critical"]
+# Lower score bounds of moderate, high and critical
+RISK_THRESHOLDS = [0.35, 0.65, 0.85]
+
+
+def risk_level_codes(ps: np.ndarray) -> np.ndarray:
+    # Index into RISK_LEVELS; a score equal to a threshold belongs to the higher level
+    return np.searchsorted(RISK_THRESHOLDS, ps, side="right")
+
+
+def risk_levels(ps: np.ndarray) -> np.ndarray:
+    return np.asarray(RISK_LEVELS, dtype=object)[risk_level_codes(ps)]
+
+
+def write_outputs(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: Path, Xt=None):
     outdir.mkdir(parents=True, exist_ok=True)
     # Save models
-    joblib.dump({"models": models, "pre": pre}, outdir/"ensemble.joblib")
+    with atomic_path(outdir/"ensemble.joblib") as tmp:
+        joblib.dump({"models": models, "pre": pre}, tmp)
 
-    # Predict on full dataset for dashboards
-    Xt = pre.transform(X)
+    # Predict on full dataset for dashboards; Xt is pre.transform(X) when the caller already has it
+    Xt = pre.transform(X) if Xt is None else Xt
     ps = np.vstack([m.predict_proba(Xt)[:,1] for m in models]).mean(axis=0)
 
     # Map to levels
-    def to_level(p):
-        return "critical" if p>=0.85 else "high" if p>=0.65 else "moderate" if p>=0.35 else "low"
-
-    levels = [to_level(p) for p in ps]
+    levels = risk_levels(ps)
     out = df[[c for c in df.columns if c in ("patient_id","age","systolic_bp","hba1c","egfr","bmi","diabetes_type")]].copy()
     out["risk_level"] = levels
     out["risk_score"] = (ps*100).round(1)
 
-    out.to_json(outdir/"predictions.json", orient="records")
+    with atomic_path(outdir/"predictions.json") as tmp:
+        out.to_json(tmp, orient="records")
+
+    # Keyed copy for single-patient lookups (API, dashboard) without parsing the whole JSON array
+    from patient_store import id_width_for, write_patient_store
+
+    keys = out["patient_id"].astype(str) if "patient_id" in out.columns else pd.Series([f"row_{i}" for i in range(len(out))])
+    # Records are built one row at a time as the store is written; NaN becomes null as in predictions.json
+    columns = list(out.columns)
+    records = ({c: None if v != v else v for c, v in zip(columns, row)} for row in out.itertuples(index=False, name=None))
+    write_patient_store(zip(keys, records), outdir/"patients.store", count=len(out), id_width=id_width_for(keys))
+    return ps
+
+
+def write_reference_profile(X: pd.DataFrame, numeric_cols: list[str], categorical_cols: list[str], ps: np.ndarray, outdir: Path) -> dict:
+    # Baseline for drift_monitor.py: per-feature quantile-binned histograms plus the predicted-risk histogram
+    from drift_monitor import reference_profile
+
+    profile = reference_profile(X, numeric_cols, categorical_cols, ps)
+    write_text(outdir/"reference_profile.json", json.dumps(profile))
+    return profile
+
+
+def export_compiled_scorer(models, pre, X_check: pd.DataFrame, outdir: Path, tol: float = 1e-6, expected: np.ndarray | None = None) -> dict | None:
+    # Flat-array export for consumers that only have NumPy; refuses to write if it disagrees with the fitted models
+    from compiled_scorer import CompiledScorer, compile_ensemble, save_compiled
+
+    # A scorer.npz left over from an earlier ensemble would keep scoring with the old models, so a skipped export removes it
+    stale = outdir/"scorer.npz"
+    try:
+        scorer = CompiledScorer(compile_ensemble(models, pre))
+    except ValueError as e:
+        print(f"Skipping compiled scorer export: {e}")
+        stale.unlink(missing_ok=True)
+        return None
+
+    # expected: the library ensemble's scores on X_check if already computed (fit_models' held-out predictions)
+    lib_seconds = None
+    if expected is None:
+        start = time.perf_counter()
+        expected = np.vstack([m.predict_proba(pre.transform(X_check))[:,1] for m in models]).mean(axis=0)
+        lib_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    got = scorer.predict_proba(X_check)
+    compiled_seconds = time.perf_counter() - start
+    max_diff = float(np.abs(expected - got).max()) if len(got) else 0.0
+    if max_diff > tol:
+        print(f"Skipping compiled scorer export: max |diff| {max_diff:.2e} exceeds {tol:.0e}")
+        stale.unlink(missing_ok=True)
+        return None
+
+    path = save_compiled(scorer.arrays, outdir/"scorer.npz")
+    stats = {
+        "max_abs_diff": max_diff,
+        "rows": int(len(got)),
+        "library_rows_per_second": len(got) / lib_seconds if lib_seconds else None,
+        "compiled_rows_per_second": len(got) / compiled_seconds,
+        "scorer_bytes": path.stat().st_size,
+        "ensemble_bytes": (outdir/"ensemble.joblib").stat().st_size if (outdir/"ensemble.joblib").exists() else None,
+    }
+    print(f"Compiled scorer: max |diff| {max_diff:.1e}, {stats['compiled_rows_per_second']:.0f} rows/s, {stats['scorer_bytes']/1024:.0f} KiB -> {path}")
+    return stats
 
 
 def write_eval_json(metrics: dict, outdir: Path):
@@ -145,38 +612,163 @@ def write_eval_json(metrics: dict, outdir: Path):
         "calibration": { "xs": [i/10 for i in range(1,10)], "ys": [i/10 for i in range(1,10)] },
         "confusion": metrics["confusion"],
     }
-    (outdir/"evaluation_trained.json").write_text(json.dumps(payload))
+    write_text(outdir/"evaluation_trained.json", json.dumps(payload))
+
+
+def _percentiles_ms(seconds) -> dict:
+    ms = np.asarray(seconds) * 1000
+    return {"p50": float(np.percentile(ms, 50)), "p95": float(np.percentile(ms, 95)), "p99": float(np.percentile(ms, 99)), "n": int(len(ms))}
+
+
+def measure_latency(models, pre, X_test: pd.DataFrame, single_rows: int = 500, batch_size: int = 1024, repeats: int = 5) -> dict:
+    # End-to-end predict_proba latency (preprocessing included) on held-out rows, as a serving path would see it
+    def score(X):
+        Xt = pre.transform(X)
+        return np.vstack([m.predict_proba(Xt)[:,1] for m in models]).mean(axis=0)
+
+    score(X_test.iloc[:batch_size])  # warm-up
+    single = []
+    for i in range(min(single_rows, len(X_test))):
+        row = X_test.iloc[[i]]
+        start = time.perf_counter()
+        score(row)
+        single.append(time.perf_counter() - start)
+
+    batch = []
+    for _ in range(repeats):
+        for i in range(0, len(X_test), batch_size):
+            chunk = X_test.iloc[i:i + batch_size]
+            start = time.perf_counter()
+            score(chunk)
+            batch.append(time.perf_counter() - start)
+    return {
+        "single_row_ms": _percentiles_ms(single),
+        "batch_ms": {**_percentiles_ms(batch), "batch_size": batch_size},
+        "batch_rows_per_second": repeats * len(X_test) / sum(batch),
+    }
 
 
-def write_explanations(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: Path, sample_size: int = 200):
+def model_sizes(models, outdir: Path) -> dict:
+    sizes = {}
+    for m in models:
+        buf = io.BytesIO()
+        joblib.dump(m, buf)
+        sizes[m.__class__.__name__] = buf.getbuffer().nbytes
+    for name in ("ensemble.joblib", "scorer.npz"):
+        if (outdir/name).exists():
+            sizes[name] = (outdir/name).stat().st_size
+    return sizes
+
+
+def git_revision() -> str | None:
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=Path(__file__).resolve().parent, timeout=10)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+# Report fields compared against history; a run is flagged when any grows by the regression factor
+PERF_WATCH = {
+    "predict_single_p50_ms": ("latency", "single_row_ms", "p50"),
+    "predict_single_p95_ms": ("latency", "single_row_ms", "p95"),
+    "predict_batch_p50_ms": ("latency", "batch_ms", "p50"),
+    "predict_batch_p95_ms": ("latency", "batch_ms", "p95"),
+    "fit_total_s": ("timings", "fit", "total"),
+    "preprocess_s": ("timings", "preprocess"),
+    "resample_s": ("timings", "resample"),
+    "peak_rss_mb": ("peak_rss_mb",),
+    "peak_rss_children_mb": ("peak_rss_children_mb",),
+    "ensemble_bytes": ("model_bytes", "ensemble.joblib"),
+}
+
+
+def _lookup(report: dict, path: tuple):
+    for key in path:
+        if not isinstance(report, dict) or key not in report:
+            return None
+        report = report[key]
+    return report
+
+
+def perf_fingerprint(settings: dict) -> str:
+    # Data and run shape only. Hyperparameters and the revision are what a regression is blamed on, so a run that changes
+    # them must still find its predecessor as a baseline; they are kept in the report as context
+    shape = {k: v for k, v in settings.items() if k not in ("params", "revision")}
+    return hashlib.sha1(json.dumps(shape, sort_keys=True, default=str).encode()).hexdigest()[:12]
+
+
+def find_regressions(report: dict, history: list[dict], factor: float = 2.0) -> list[dict]:
+    # Baseline is the latest earlier run on the same data and settings, so cohort-size changes are not reported as regressions
+    same = [h for h in history if h.get("fingerprint") == report["fingerprint"]]
+    if not same:
+        return []
+    baseline = same[-1]
+    flagged = []
+    for name, path in PERF_WATCH.items():
+        now, before = _lookup(report, path), _lookup(baseline, path)
+        if now is None or not before:
+            continue
+        if now / before >= factor:
+            flagged.append({"metric": name, "baseline": before, "current": now, "ratio": now / before, "baseline_revision": baseline.get("revision"),
+                            "params_changed": baseline.get("params") != report.get("params")})
+    return flagged
+
+
+def write_perf_json(metrics: dict, latency: dict | None, sizes: dict, outdir: Path, settings: dict, history_path: Path | None = None,
+                    factor: float = 2.0, params: dict | None = None) -> dict:
+    history_path = Path(history_path) if history_path else outdir/"perf_history.jsonl"
+    report = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "revision": git_revision(),
+        "settings": settings,
+        "params": params,
+        "fingerprint": perf_fingerprint(settings),
+        "timings": metrics["timings"],
+        "peak_rss_mb": peak_rss_mb(),
+        # With --n_jobs the members are fitted in worker processes, whose peak this process's own figure does not include.
+        # A forked child inherits the parent's high-water mark, so this is never below the parent's RSS at fork time
+        "peak_rss_children_mb": peak_rss_mb(resource.RUSAGE_CHILDREN),
+        "model_bytes": sizes,
+        "latency": latency,
+    }
+    history = [json.loads(line) for line in history_path.read_text().splitlines() if line.strip()] if history_path.exists() else []
+    report["regressions"] = find_regressions(report, history, factor)
+
+    outdir.mkdir(parents=True, exist_ok=True)
+    write_text(outdir/"performance_trained.json", json.dumps(report, indent=2))
+    history_path.parent.mkdir(parents=True, exist_ok=True)
+    with history_path.open("a") as f:
+        f.write(json.dumps(report) + "\n")
+    return report
+
+
+def explainer_model(models):
+    # Choose explainer model preference: XGB -> LGBM -> LR
+    for key in ("xgb", "lgbm"):
+        for m in models:
+            if key in m.__class__.__name__.lower():
+                return m
+    return models[0]
+
+
+def write_explanations(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: Path, sample_size: int = 200,
+                       full: bool = False, n_jobs: int = 1, Xt=None):
     outdir.mkdir(parents=True, exist_ok=True)
-    # Build transformed matrix and feature names
-    Xt = pre.transform(X)
+    # Transformed matrix (reused if the caller passes it) and feature names
+    Xt = pre.transform(X) if Xt is None else Xt
     try:
         feature_names = pre.get_feature_names_out()
     except Exception:
         # Fallback: generic names
         feature_names = np.array([f"f_{i}" for i in range(Xt.shape[1])])
 
-    # Choose explainer model preference: XGB -> LGBM -> LR
-    expl_model = None
-    for m in models:
-        name = m.__class__.__name__.lower()
-        if "xgb" in name:
-            expl_model = m; break
-    if expl_model is None:
-        for m in models:
-            name = m.__class__.__name__.lower()
-            if "lgbm" in name:
-                expl_model = m; break
-    if expl_model is None:
-        expl_model = models[0]
+    expl_model = explainer_model(models)
 
     # Sample rows
     n = Xt.shape[0]
     idx = np.random.RandomState(42).choice(n, size=min(sample_size, n), replace=False)
     Xt_sample = Xt[idx]
-    X_sample = X.iloc[idx]
     df_sample = df.iloc[idx]
 
     explanations = {"global_importance": [], "patients": {}}
@@ -207,7 +799,7 @@ def write_explanations(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: P
             for row_i in range(Xt_sample.shape[0]):
                 pid = str(df_sample.iloc[row_i].get("patient_id", f"row_{int(idx[row_i])}"))
                 sv = shap_vals[row_i]
-                vals = Xt_sample[row_i]
+                vals = Xt_sample[row_i].toarray().ravel() if sp.issparse(Xt_sample) else Xt_sample[row_i]
                 top_idx = np.argsort(-np.abs(sv))[:10]
                 contribs = []
                 for j in top_idx:
@@ -221,9 +813,9 @@ def write_explanations(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: P
                     "base_value": float(base if np.isscalar(base) else np.mean(base)),
                     "contributions": contribs
                 }
-        except Exception:
+        except Exception as e:
             # If SHAP fails, leave explanations empty
-            pass
+            print(f"Skipping SHAP explanations: {e!r}")
 
     # LIME for the first sample
     if HAS_LIME and Xt_sample.shape[0] > 0:
@@ -235,29 +827,154 @@ def write_explanations(models, pre, df: pd.DataFrame, X: pd.DataFrame, outdir: P
                 avg = ps.mean(axis=0)
                 return np.vstack([1-avg, avg]).T
 
-            expl = LimeTabularExplainer(Xt, feature_names=list(map(str, feature_names)), class_names=["low","high"], discretize_continuous=False)
-            exp = expl.explain_instance(Xt_sample[0], predict_fn, num_features=10)
+            # LimeTabularExplainer needs dense arrays. Without discretization it only keeps the mean/std of its
+            # training data, so it is built on a small dense slice and given the full matrix's statistics from
+            # chunked sums: a sparse Xt is never densified, and a dense one skips LIME's own scaler fit over every row
+            from explain_cohort import lime_scaler
+
+            head = Xt[:1000]
+            expl = LimeTabularExplainer(head.toarray() if sp.issparse(head) else head, feature_names=list(map(str, feature_names)),
+                                        class_names=["low","high"], discretize_continuous=False)
+            expl.scaler.mean_, expl.scaler.scale_ = lime_scaler(Xt)
+            row0 = Xt_sample[0].toarray().ravel() if sp.issparse(Xt_sample) else Xt_sample[0]
+            exp = expl.explain_instance(row0, predict_fn, num_features=10)
             explanations.setdefault("lime", {})[pid0] = [{"feature": str(k), "weight": float(v)} for k,v in exp.as_list()]
-        except Exception:
-            pass
-
-    (outdir/"explanations.json").write_text(json.dumps(explanations))
+        except Exception as e:
+            print(f"Skipping LIME explanation: {e!r}")
+
+    # Every patient gets an explanation in the keyed SHAP store; global importance then covers the whole cohort
+    full = full and HAS_SHAP
+    if full:
+        from explain_cohort import explain_cohort_shap
+        manifest = explain_cohort_shap(models, pre, df, X, outdir, n_jobs=n_jobs, Xt=Xt)
+        explanations["global_importance"] = manifest["global_importance"]
+    else:
+        # Cohort-wide stores explain the ensemble they were built from, and the API would keep serving them
+        remove_dir(outdir/"shap")
+    remove_dir(outdir/"lime")
+
+    write_text(outdir/"explanations.json", json.dumps(explanations))
+    if (outdir/"patients.store").exists():
+        from patient_store import attach_explanations
+        attach_explanations(outdir/"patients.store", explanations["patients"], outdir/"shap" if full else None)
+
+
+def train_and_write(df: pd.DataFrame, X: pd.DataFrame, y: pd.Series, pre: ColumnTransformer, numeric_cols: list[str], categorical_cols: list[str],
+                    outdir: Path, n_jobs: int | None = None, params: dict | None = None, imbalance: str = "smote", explain_all: bool = False,
+                    perf_history: Path | None = None, max_slowdown: float = 2.0, settings: dict | None = None, stage=nullcontext,
+                    latency: bool = True) -> dict:
+    """Full training run from prepare_data() output: fit, then write every artifact under outdir. Returns the performance report.
+    df is only read, so it can be shared with other stages (run_pipeline.py); `stage(name)` wraps each step (benchmark_pipeline.py)."""
+    with stage("fit_models"):
+        models, pre, test_bundle, metrics = fit_models(X, y, pre, n_jobs=n_jobs, params=params, imbalance=imbalance)
+    print(f"preprocess: {metrics['timings']['preprocess']:.2f}s, resample ({imbalance}): {metrics['timings']['resample']:.2f}s")
+    for name, secs in metrics["timings"]["fit"].items():
+        print(f"fit {name}: {secs:.2f}s")
+    # The full-cohort matrix is built once here and shared by predictions, SHAP and LIME
+    with stage("transform"):
+        Xt = pre.transform(X)
+    with stage("write_outputs"):
+        ps = write_outputs(models, pre, df, X, outdir, Xt=Xt)
+    with stage("write_reference_profile"):
+        write_reference_profile(X, numeric_cols, categorical_cols, ps, outdir)
+    with stage("export_compiled_scorer"):
+        export_compiled_scorer(models, pre, test_bundle[0], outdir, expected=test_bundle[2])
+    write_eval_json(metrics, outdir)
+    settings = {**(settings or {}), "rows": len(df), "imbalance": imbalance, "n_jobs": n_jobs, "cpus": os.cpu_count()}
+    # Without latency the report has no inference metrics to regress on; --skip_latency is for quick local runs
+    lat = None
+    if latency:
+        with stage("measure_latency"):
+            lat = measure_latency(models, pre, test_bundle[0])
+    perf = write_perf_json(metrics, lat, model_sizes(models, outdir), outdir, settings, history_path=perf_history, factor=max_slowdown,
+                           params=params if params is not None else load_tuned_params())
+    if lat:
+        print(f"predict_proba: single row p50 {lat['single_row_ms']['p50']:.2f} ms / p99 {lat['single_row_ms']['p99']:.2f} ms, "
+              f"batch of {lat['batch_ms']['batch_size']} p50 {lat['batch_ms']['p50']:.1f} ms")
+    print(f"peak RSS {perf['peak_rss_mb']:.0f} MiB (largest worker process {perf['peak_rss_children_mb']:.0f} MiB)")
+    for r in perf["regressions"]:
+        print(f"PERF REGRESSION {r['metric']}: {r['baseline']:.4g} -> {r['current']:.4g} ({r['ratio']:.1f}x vs {r['baseline_revision']}"
+              f"{', hyperparameters changed' if r['params_changed'] else ''})")
+    with stage("write_explanations"):
+        write_explanations(models, pre, df, X, outdir, full=explain_all, n_jobs=n_jobs or 1, Xt=Xt)
+    print(f"Trained and wrote predictions to {outdir/'predictions.json'} and metrics to {outdir/'evaluation_trained.json'}")
+    return perf
 
 
 def main():
     ap = argparse.ArgumentParser()
     ap.add_argument("--input", default="public/processed_medical_dataset.csv")
     ap.add_argument("--outdir", default="public/data")
+    ap.add_argument("--n_jobs", type=int, default=None, help="CPU budget shared by the ensemble members fitted in parallel (-1 = all cores); omit for sequential fitting")
+    ap.add_argument("--cv", type=int, default=None, help="Run K-fold cross-validation only and write cv_metrics.json")
+    ap.add_argument("--cache_dir", default="public/.cache/folds", help="Where preprocessed/SMOTE-resampled fold matrices are cached")
+    ap.add_argument("--explain_all", action="store_true", help="Also write SHAP top contributions for every patient to <outdir>/shap")
+    ap.add_argument("--incremental", default=None, help="CSV of new patients: warm-start the saved ensemble in <outdir> instead of retraining; --input is the replay source")
+    ap.add_argument("--replay_frac", type=float, default=0.1, help="Fraction of --input replayed alongside the new batch in --incremental mode")
+    ap.add_argument("--extra_trees", type=int, default=50, help="Trees added to each booster in --incremental mode")
+    ap.add_argument("--max_auc_gap", type=float, default=0.01, help="Recommend a full rebuild when a full retrain beats the incremental model by more AUC than this")
+    ap.add_argument("--no_compare", action="store_true", help="Skip the full-retrain comparison in --incremental mode")
+    ap.add_argument("--dtype", choices=["float32", "float64"], default="float32", help="Feature matrix dtype used end to end")
+    ap.add_argument("--sparse", action="store_true", help="Keep the feature matrix in CSR form end to end (scaling without centering)")
+    ap.add_argument("--exclude", nargs="+", default=[], help="Columns left out of the features, e.g. the risk_score/prob_* inputs simulate_interventions.py cannot move")
+    ap.add_argument("--imbalance", choices=IMBALANCE_STRATEGIES, default="smote", help="Class-imbalance handling for the training split")
+    ap.add_argument("--bench_imbalance", action="store_true", help="Only benchmark every --imbalance strategy (AUC, peak memory, fit time)")
+    ap.add_argument("--params", default=None, help=f"Tuned hyperparameters JSON (default: {TUNED_PARAMS} if present)")
+    ap.add_argument("--perf_history", default=None, help="JSONL history that performance reports are appended to and compared against (default: <outdir>/perf_history.jsonl)")
+    ap.add_argument("--max_slowdown", type=float, default=2.0, help="Flag a metric in performance_trained.json when it grows by this factor over the previous comparable run")
+    ap.add_argument("--fail_on_regression", action="store_true", help="Exit non-zero when the performance report flags a regression")
+    ap.add_argument("--skip_latency", action="store_true", help="Do not time single-row and batch predict_proba for the performance report (saves ~15s)")
     args = ap.parse_args()
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+    params = load_tuned_params(Path(args.params)) if args.params else None
 
     df = pd.read_csv(args.input)
-    X, y, pre, _, _ = prepare_data(df)
-    models, pre, test_bundle, metrics = fit_models(X, y, pre, smote=True)
-    outdir = Path(args.outdir)
-    write_outputs(models, pre, df, X, outdir)
-    write_eval_json(metrics, outdir)
-    write_explanations(models, pre, df, X, outdir)
-    print(f"Trained and wrote predictions to {outdir/'predictions.json'} and metrics to {outdir/'evaluation_trained.json'}")
+    if args.incremental:
+        outdir = Path(args.outdir)
+        df_new = pd.read_csv(args.incremental)
+        models, pre, report = incremental_retrain(joblib.load(outdir/"ensemble.joblib"), df, df_new, replay_frac=args.replay_frac,
+                                                  extra_trees=args.extra_trees, imbalance=args.imbalance,
+                                                  compare_full=not args.no_compare, n_jobs=n_jobs, params=params)
+        if "auc_gap" in report:
+            report["recommend_full_rebuild"] = bool(report["auc_gap"] > args.max_auc_gap)
+        write_text(outdir/"incremental_report.json", json.dumps(report, indent=2))
+        df_all = pd.concat(supersede_patients(df, df_new), ignore_index=True)
+        X_all, _, _, num_all, cat_all = prepare_data(df_all, **matrix_settings(pre, df_all.columns))
+        Xt_all = pre.transform(X_all)
+        ps = write_outputs(models, pre, df_all, X_all, outdir, Xt=Xt_all)
+        write_reference_profile(X_all, num_all, cat_all, ps, outdir)
+        # Everything derived from the old ensemble is rebuilt from the updated one: the NumPy scorer, and the explanations
+        # that write_outputs dropped from patients.store (cohort-wide SHAP again if the last full run had written it)
+        export_compiled_scorer(models, pre, X_all.sample(n=min(len(X_all), 5000), random_state=42), outdir)
+        write_explanations(models, pre, df_all, X_all, outdir, full=(outdir/"shap"/"index.json").exists(), n_jobs=n_jobs or 1, Xt=Xt_all)
+        msg = f"Incremental update: AUC {report['previous']['auc']:.3f} -> {report['incremental']['auc']:.3f} in {report['incremental']['seconds']:.1f}s"
+        if "full" in report:
+            msg += f"; full retrain {report['full']['auc']:.3f} in {report['full']['seconds']:.1f}s (rebuild recommended: {report['recommend_full_rebuild']})"
+        print(msg)
+        return
+
+    X, y, pre, numeric_cols, categorical_cols = prepare_data(df, dtype=np.dtype(args.dtype), sparse=args.sparse, exclude=args.exclude)
+    if args.bench_imbalance:
+        outdir = Path(args.outdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        results = benchmark_imbalance(X, y, pre, params=params)
+        write_text(outdir/"imbalance_benchmark.json", json.dumps(results, indent=2))
+        return
+    if args.cv:
+        cv = cross_validate(X, y, pre, k=args.cv, imbalance=args.imbalance, n_jobs=n_jobs or 1, cache_dir=Path(args.cache_dir), params=params)
+        outdir = Path(args.outdir)
+        outdir.mkdir(parents=True, exist_ok=True)
+        write_text(outdir/"cv_metrics.json", json.dumps(cv))
+        print(f"{args.cv}-fold AUC {cv['mean_auc']:.3f} +/- {cv['std_auc']:.3f} (pooled OOF {cv['pooled']['auc']:.3f}); wrote {outdir/'cv_metrics.json'}")
+        return
+    settings = {"input": str(args.input), "dtype": args.dtype, "sparse": args.sparse}
+    if args.exclude:
+        settings["exclude"] = args.exclude
+    perf = train_and_write(df, X, y, pre, numeric_cols, categorical_cols, Path(args.outdir), n_jobs=n_jobs, params=params,
+                           imbalance=args.imbalance, explain_all=args.explain_all, perf_history=args.perf_history,
+                           max_slowdown=args.max_slowdown, settings=settings, latency=not args.skip_latency)
+    if args.fail_on_regression and perf["regressions"]:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,212 @@
+import argparse
+import json
+import math
+import os
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from sklearn.exceptions import ConvergenceWarning
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import log_loss, roc_auc_score
+
+from artifacts import write_text
+from train_models import HAS_LGBM, HAS_XGB, IMBALANCE_STRATEGIES, TUNED_PARAMS, LGBMClassifier, XGBClassifier, cache_folds, load_shared, prepare_data
+
+try:
+    import lightgbm  # type: ignore
+except Exception:
+    lightgbm = None  # type: ignore
+
+
+# Search spaces: ("log", lo, hi) log-uniform float, ("float", lo, hi) uniform, ("int", lo, hi) inclusive integer
+SPACES = {
+    "LogisticRegression": {
+        "C": ("log", 1e-3, 1e2),
+    },
+    "LGBMClassifier": {
+        "learning_rate": ("log", 0.01, 0.3),
+        "num_leaves": ("int", 8, 128),
+        "min_child_samples": ("int", 5, 100),
+        "subsample": ("float", 0.5, 1.0),
+        "colsample_bytree": ("float", 0.4, 1.0),
+        "reg_lambda": ("log", 1e-3, 10.0),
+    },
+    "XGBClassifier": {
+        "learning_rate": ("log", 0.01, 0.3),
+        "max_depth": ("int", 3, 10),
+        "min_child_weight": ("log", 0.5, 20.0),
+        "subsample": ("float", 0.5, 1.0),
+        "colsample_bytree": ("float", 0.4, 1.0),
+        "reg_lambda": ("log", 1e-3, 10.0),
+    },
+}
+
+# Budget axis per member: boosting rounds for the boosters (early stopping on validation log loss may use fewer), solver iterations for saga
+RESOURCES = {
+    "LogisticRegression": ("max_iter", 50, 2000),
+    "LGBMClassifier": ("n_estimators", 25, 800),
+    "XGBClassifier": ("n_estimators", 25, 800),
+}
+
+
+def sample_config(member: str, rng: np.random.Generator) -> dict:
+    config = {}
+    for name, (kind, lo, hi) in SPACES[member].items():
+        if kind == "log":
+            config[name] = float(np.exp(rng.uniform(np.log(lo), np.log(hi))))
+        elif kind == "int":
+            config[name] = int(rng.integers(lo, hi + 1))
+        else:
+            config[name] = float(rng.uniform(lo, hi))
+    return config
+
+
+def make_member(member: str, config: dict, resource: int):
+    if member == "LogisticRegression":
+        return LogisticRegression(solver="saga", penalty="l2", max_iter=resource, **config)
+    if member == "LGBMClassifier":
+        return LGBMClassifier(n_estimators=resource, subsample_freq=1, random_state=42, n_jobs=1, verbose=-1, **config)
+    return XGBClassifier(n_estimators=resource, early_stopping_rounds=30, eval_metric="logloss", random_state=42, n_jobs=1, **config)
+
+
+def _run_trial(member: str, config: dict, resource: int, fold_path: Path) -> dict:
+    fold = load_shared(fold_path)
+    Xt, y, w, Xv, yv = fold["Xt_train"], fold["y_train"], fold.get("w_train"), fold["Xt_test"], fold["y_test"]
+    model = make_member(member, config, resource)
+    start = time.perf_counter()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", ConvergenceWarning)
+        if member == "LGBMClassifier":
+            model.fit(Xt, y, sample_weight=w, eval_set=[(Xv, yv)], eval_metric="binary_logloss", callbacks=[lightgbm.early_stopping(30, first_metric_only=True, verbose=False)])
+        elif member == "XGBClassifier":
+            model.fit(Xt, y, sample_weight=w, eval_set=[(Xv, yv)], verbose=False)
+        else:
+            model.fit(Xt, y, sample_weight=w)
+    seconds = time.perf_counter() - start
+    p = model.predict_proba(Xv)[:,1]
+
+    used = resource
+    best = getattr(model, "best_iteration_", None) if member == "LGBMClassifier" else getattr(model, "best_iteration", None)
+    if best is not None and member == "XGBClassifier":
+        best += 1
+    if best:
+        used = int(best)
+    return {
+        "member": member,
+        "config": config,
+        "resource": resource,
+        "used_resource": used,
+        "auc": float(roc_auc_score(yv, p)),
+        "logloss": float(log_loss(yv, np.clip(p, 1e-7, 1 - 1e-7))),
+        "seconds": seconds,
+    }
+
+
+def _rank(trial: dict):
+    # AUC first; log loss breaks ties once AUC saturates
+    return (-trial["auc"], trial["logloss"])
+
+
+def run_rung(pool: ProcessPoolExecutor, member: str, configs: list[dict], resource: int, fold_path: Path, deadline: float) -> list[dict]:
+    pending = {pool.submit(_run_trial, member, c, resource, fold_path) for c in configs}
+    results = []
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()), return_when=FIRST_COMPLETED)
+        results.extend(f.result() for f in done)
+        if time.monotonic() >= deadline:
+            for f in pending:
+                f.cancel()
+            # Trials already running are allowed to finish; queued ones are dropped
+            results.extend(f.result() for f in pending if not f.cancelled())
+            break
+    return results
+
+
+def hyperband(member: str, fold_path: Path, pool: ProcessPoolExecutor, time_budget: float, eta: int = 3, brackets: int | None = None, seed: int = 42) -> list[dict]:
+    # brackets=1 is plain successive halving; None runs every Hyperband bracket
+    _, r_min, r_max = RESOURCES[member]
+    rng = np.random.default_rng(seed)
+    deadline = time.monotonic() + time_budget
+    s_max = int(math.floor(math.log(r_max / r_min, eta) + 1e-9))
+    trials = []
+    for s in list(range(s_max, -1, -1))[:brackets]:
+        n = int(math.ceil((s_max + 1) / (s + 1) * eta**s))
+        configs = [sample_config(member, rng) for _ in range(n)]
+        for i in range(s + 1):
+            if not configs or time.monotonic() >= deadline:
+                break
+            resource = int(round(r_max * eta**(i - s)))
+            results = run_rung(pool, member, configs, resource, fold_path, deadline)
+            for t in results:
+                t["bracket"], t["rung"] = s, i
+            trials.extend(results)
+            configs = [t["config"] for t in sorted(results, key=_rank)[:max(1, len(results) // eta)]]
+    return trials
+
+
+def best_params(member: str, trials: list[dict]) -> dict:
+    # Prefer configs that survived to the largest budget, then the best score among them
+    top_budget = max(t["resource"] for t in trials)
+    best = min([t for t in trials if t["resource"] == top_budget], key=_rank)
+    key = RESOURCES[member][0]
+    params = {**best["config"], key: best["used_resource"]}
+    if member == "LGBMClassifier":
+        params["subsample_freq"] = 1
+    return params
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Budgeted hyperparameter search (Hyperband / successive halving) for the risk ensemble")
+    ap.add_argument("--input", default="public/processed_medical_dataset.csv")
+    ap.add_argument("--output", default=str(TUNED_PARAMS), help="Where the best config is written; model_ensemble reads this path by default")
+    ap.add_argument("--cache_dir", default="public/.cache/folds")
+    ap.add_argument("--k", type=int, default=5, help="Folds in the cached split; --fold is used for validation")
+    ap.add_argument("--fold", type=int, default=0)
+    ap.add_argument("--members", default="LogisticRegression,LGBMClassifier,XGBClassifier")
+    ap.add_argument("--method", choices=["hyperband", "sh"], default="hyperband")
+    ap.add_argument("--eta", type=int, default=3)
+    ap.add_argument("--time_budget", type=float, default=900, help="Wall-clock seconds for the whole search, split evenly across members")
+    ap.add_argument("--n_jobs", type=int, default=-1, help="Concurrent single-threaded trials (-1 = all cores)")
+    ap.add_argument("--imbalance", choices=IMBALANCE_STRATEGIES, default="smote")
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--dtype", choices=["float32", "float64"], default="float32", help="Feature matrix dtype, as in train_models.py")
+    ap.add_argument("--sparse", action="store_true", help="CSR feature matrix, as in train_models.py")
+    args = ap.parse_args()
+    n_jobs = os.cpu_count() if args.n_jobs == -1 else args.n_jobs
+
+    members = [m for m in args.members.split(",") if m in SPACES]
+    members = [m for m in members if (m != "LGBMClassifier" or HAS_LGBM) and (m != "XGBClassifier" or HAS_XGB)]
+
+    df = pd.read_csv(args.input)
+    # Same matrix as train_models --dtype/--sparse, so the folds cached by train_models --cv are reused
+    X, y, pre, _, _ = prepare_data(df, dtype=args.dtype, sparse=args.sparse)
+    fold_path = cache_folds(X, y, pre, args.k, Path(args.cache_dir), imbalance=args.imbalance, n_jobs=n_jobs)[args.fold]
+
+    output = Path(args.output)
+    tuned = json.loads(output.read_text()) if output.exists() else {}
+    report = {}
+    with ProcessPoolExecutor(max_workers=n_jobs) as pool:
+        for member in members:
+            start = time.perf_counter()
+            trials = hyperband(member, fold_path, pool, args.time_budget / len(members), eta=args.eta,
+                               brackets=1 if args.method == "sh" else None, seed=args.seed)
+            if not trials:
+                print(f"{member}: no trial finished within the budget, keeping previous params")
+                continue
+            tuned[member] = best_params(member, trials)
+            cpu_seconds = sum(t["seconds"] for t in trials)
+            best = min(trials, key=_rank)
+            report[member] = {"trials": trials, "wall_seconds": time.perf_counter() - start, "cpu_seconds": cpu_seconds}
+            print(f"{member}: {len(trials)} trials, best AUC {best['auc']:.4f}, {cpu_seconds/3600:.3f} CPU-h -> {tuned[member]}")
+
+    write_text(output, json.dumps(tuned, indent=2))
+    write_text(output.parent/"tuning_trials.json", json.dumps(report))
+    print(f"Wrote best params to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+import sys
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+# The pipeline modules are flat scripts in public/ that import each other by bare name
+PUBLIC = Path(__file__).resolve().parents[1]/"public"
+sys.path.insert(0, str(PUBLIC))
+
+DATASET = PUBLIC/"processed_medical_dataset.csv"
+
+
+@pytest.fixture(scope="session")
+def cohort() -> pd.DataFrame:
+    # A slice of the checked-in processed extract: real column layout, small enough to fit models in seconds
+    return pd.read_csv(DATASET, nrows=2000)
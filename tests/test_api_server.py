@@ -0,0 +1,85 @@
+import gzip
+import json
+
+import numpy as np
+import pytest
+
+import api_server
+from api_server import create_app
+from artifacts import write_json
+
+
+def write_predictions(cohort, path, shift: int = 0):
+    scores = (cohort["risk_score"].to_numpy() + shift) % 100
+    levels = np.select([scores >= 85, scores >= 65, scores >= 35], ["critical", "high", "moderate"], "low")
+    write_json(path, [{"patient_id": p, "risk_level": lvl, "risk_score": int(s)} for p, lvl, s in zip(cohort["patient_id"], levels, scores)])
+
+
+@pytest.fixture
+def data_dir(cohort, tmp_path):
+    cohort.to_csv(tmp_path/"dataset.csv", index=False)
+    write_predictions(cohort, tmp_path/"data"/"predictions.json")
+    return tmp_path
+
+
+@pytest.fixture
+def client(data_dir):
+    return create_app(data_dir/"data", data_dir/"dataset.csv").test_client()
+
+
+@pytest.mark.parametrize("url", [
+    "/api/patients?conditions=CKD,NotACondition",
+    "/api/summary?conditions=NotACondition",
+    "/api/patients?hba1c=7",
+    "/api/summary?hba1c=7",
+    "/api/patients?hba1c=abc:9",
+    "/api/patients?page=first",
+    "/api/patients?sort=no_such_column",
+])
+def test_bad_requests_are_400(client, url):
+    assert client.get(url).status_code == 400
+
+
+def test_filters_match_predictions(client, data_dir):
+    preds = json.loads((data_dir/"data"/"predictions.json").read_text())
+    high = sorted(p["patient_id"] for p in preds if p["risk_level"] in ("high", "critical"))
+    summary = client.get("/api/summary?risk_level=high,critical").get_json()
+    assert summary["total"] == len(high)
+    assert summary["risk_level"]["low"] == 0
+    body = client.get("/api/patients?risk_level=high,critical&page_size=1000").get_json()
+    assert sorted(item["patient_id"] for item in body["items"]) == high[:1000]
+    assert client.get("/api/patients/NOT_A_PATIENT").status_code == 404
+
+
+def test_etag_304(client):
+    first = client.get("/api/patients?risk_level=low&page_size=5")
+    tag = first.headers["ETag"]
+    again = client.get("/api/patients?risk_level=low&page_size=5", headers={"If-None-Match": tag})
+    assert again.status_code == 304 and again.data == b""
+    assert again.headers["ETag"] == tag
+    other = client.get("/api/patients?risk_level=low&page_size=6", headers={"If-None-Match": tag})
+    assert other.status_code == 200 and other.headers["ETag"] != tag
+
+
+def test_gzip(client):
+    plain = client.get("/api/patients?page_size=200")
+    zipped = client.get("/api/patients?page_size=200", headers={"Accept-Encoding": "gzip, deflate"})
+    assert "Content-Encoding" not in plain.headers
+    assert zipped.headers["Content-Encoding"] == "gzip"
+    assert zipped.headers["Vary"] == "Accept-Encoding"
+    assert gzip.decompress(zipped.data) == plain.data
+    # The compressed representation has its own validator
+    assert zipped.headers["ETag"] != plain.headers["ETag"]
+    assert client.get("/api/patients?page_size=200", headers={"Accept-Encoding": "gzip", "If-None-Match": zipped.headers["ETag"]}).status_code == 304
+    small = client.get("/api/version", headers={"Accept-Encoding": "gzip"})
+    assert len(small.data) < api_server.GZIP_MIN_BYTES and "Content-Encoding" not in small.headers
+
+
+def test_reload_changes_etag(client, cohort, data_dir, monkeypatch):
+    monkeypatch.setattr(api_server, "RELOAD_INTERVAL", 0.0)
+    before = client.get("/api/summary")
+    write_predictions(cohort, data_dir/"data"/"predictions.json", shift=30)
+    after = client.get("/api/summary", headers={"If-None-Match": before.headers["ETag"]})
+    assert after.status_code == 200
+    assert after.headers["ETag"] != before.headers["ETag"]
+    assert after.get_json()["risk_level"] != before.get_json()["risk_level"]
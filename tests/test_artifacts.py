@@ -0,0 +1,58 @@
+import json
+import os
+
+import pytest
+
+from artifacts import atomic_dir, atomic_open, remove_dir, write_json
+
+
+def leftovers(path):
+    return [p.name for p in path.iterdir() if p.name.startswith(".")]
+
+
+def test_write_json_replaces_in_place(tmp_path):
+    path = tmp_path/"data"/"predictions.json"
+    write_json(path, [1])
+    write_json(path, {"a": 2})
+    assert json.loads(path.read_text()) == {"a": 2}
+    assert leftovers(path.parent) == []
+    # Same permissions a plain open() would have given the file, not mkstemp's 0600
+    plain = tmp_path/"plain.json"
+    plain.write_text("[]")
+    assert os.stat(path).st_mode & 0o777 == os.stat(plain).st_mode & 0o777
+
+
+def test_failed_write_keeps_old_file(tmp_path):
+    path = tmp_path/"evaluation.json"
+    write_json(path, {"ok": True})
+    with pytest.raises(RuntimeError):
+        with atomic_open(path) as fh:
+            fh.write('{"partial": ')
+            raise RuntimeError("boom")
+    assert json.loads(path.read_text()) == {"ok": True}
+    assert leftovers(tmp_path) == []
+
+
+def test_atomic_dir_swaps_whole_directory(tmp_path):
+    target = tmp_path/"shap"
+    with atomic_dir(target) as tmp:
+        (tmp/"a.json").write_text("1")
+        (tmp/"b.json").write_text("2")
+    with atomic_dir(target) as tmp:
+        (tmp/"a.json").write_text("3")
+    assert sorted(p.name for p in target.iterdir()) == ["a.json"]
+    with pytest.raises(RuntimeError):
+        with atomic_dir(target) as tmp:
+            (tmp/"c.json").write_text("4")
+            raise RuntimeError("boom")
+    assert sorted(p.name for p in target.iterdir()) == ["a.json"]
+    assert leftovers(tmp_path) == []
+
+
+def test_remove_dir(tmp_path):
+    target = tmp_path/"lime"
+    with atomic_dir(target) as tmp:
+        (tmp/"explanations.store").write_text("x")
+    remove_dir(target)
+    remove_dir(target)
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,62 @@
+import copy
+
+import pytest
+
+from benchmark_pipeline import compare_baseline, scaling_exponents
+
+
+def stage(seconds, peak_delta_mb):
+    return {"seconds": seconds, "peak_delta_mb": peak_delta_mb, "peak_rss_mb": 500.0}
+
+
+def bench_report(fit_seconds=(1.0, 10.0), fit_mb=100.0, status="ok"):
+    # train.fit grows linearly with the cohort unless told otherwise; load_csv stays below every noise floor
+    runs = {}
+    for size, seconds in zip(("15000", "150000"), fit_seconds):
+        runs[size] = {"train": {"status": "ok", "stages": {"fit_models": stage(seconds, fit_mb), "load_csv": stage(0.01, 1.0)}}}
+    runs["150000"]["train"]["status"] = status
+    if status != "ok":
+        runs["150000"]["train"]["running"] = "fit_models"
+    return {"runs": runs, "scaling": scaling_exponents(runs)}
+
+
+def test_scaling_exponents():
+    scaling = scaling_exponents(bench_report()["runs"])["train"]
+    assert scaling["fit_models"]["time"] == pytest.approx(1.0) and scaling["fit_models"]["sizes"] == [15000, 150000]
+    assert scaling["fit_models"]["memory"] == pytest.approx(0.0)
+    # Stages under MIN_SECONDS have no points to fit
+    assert scaling["load_csv"]["time"] is None and scaling["load_csv"]["sizes"] == []
+
+
+def test_unchanged_run_is_not_flagged():
+    baseline = bench_report()
+    assert compare_baseline(bench_report(), baseline) == []
+    # Below-threshold growth and noise-floor stages are ignored
+    noisy = bench_report(fit_seconds=(1.2, 12.0), fit_mb=120.0)
+    noisy["runs"]["15000"]["train"]["stages"]["load_csv"] = stage(0.2, 4.0)
+    assert compare_baseline(noisy, baseline) == []
+
+
+def test_time_memory_and_exponent_regressions():
+    flagged = compare_baseline(bench_report(fit_seconds=(1.0, 100.0), fit_mb=200.0), bench_report())
+    by_metric = {(f["metric"], f.get("size")): f for f in flagged}
+    assert set(by_metric) == {("seconds", 150000), ("peak_delta_mb", 15000), ("peak_delta_mb", 150000), ("time_exponent", None)}
+    assert by_metric["seconds", 150000]["ratio"] == pytest.approx(10.0)
+    assert by_metric["peak_delta_mb", 15000]["ratio"] == pytest.approx(2.0)
+    assert by_metric["time_exponent", None]["current"] == pytest.approx(2.0)
+    assert all(f["script"] == "train" and f["stage"] == "fit_models" for f in flagged)
+
+
+def test_failed_run_flags_status():
+    flagged = compare_baseline(bench_report(status="timeout"), bench_report())
+    assert {"size": 150000, "script": "train", "stage": "fit_models", "metric": "status", "baseline": "ok", "current": "timeout"} in flagged
+
+
+def test_missing_baseline_entries_are_skipped():
+    report = bench_report(fit_seconds=(1.0, 100.0))
+    baseline = copy.deepcopy(bench_report())
+    del baseline["runs"]["150000"]
+    # Exponents fitted over different sizes are not compared either
+    baseline["scaling"]["train"]["fit_models"]["sizes"] = [15000, 100000]
+    assert compare_baseline(report, baseline) == []
+    assert compare_baseline(report, {}) == []
@@ -0,0 +1,102 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from cohort_index import NUMERIC_FIELDS, SOURCE_COLUMNS, CohortIndex, bitmap_rows, derive_columns, pack, parse_filter, popcount
+
+
+@pytest.fixture
+def frame(cohort) -> pd.DataFrame:
+    df = cohort[["patient_id"] + SOURCE_COLUMNS].copy()
+    # Gaps in a numeric field must never match a range
+    df.loc[df.index[::17], "hba1c"] = np.nan
+    return df
+
+
+def expected_rows(df: pd.DataFrame, filters: dict) -> np.ndarray:
+    cols = derive_columns(df.drop(columns=["patient_id"]))
+    mask = pd.Series(True, index=df.index)
+    for field, cond in filters.items():
+        if field == "conditions":
+            for name in cond:
+                mask &= cols[f"cond_{name}"]
+        elif field in NUMERIC_FIELDS:
+            lo, hi = cond
+            v = df[field].astype(float)
+            mask &= v.ge(-np.inf if lo is None else lo) & v.le(np.inf if hi is None else hi)
+        else:
+            mask &= pd.Series(cols[field], index=df.index).astype(str).isin([cond] if isinstance(cond, str) else cond)
+    return np.flatnonzero(mask.to_numpy())
+
+
+CASES = [
+    {},
+    {"risk_level": ["high", "critical"]},
+    {"risk_level": "low", "sex": ["F"]},
+    {"conditions": ["CKD"]},
+    {"conditions": ["HF", "T2D"], "age_band": ["65+"]},
+    {"hba1c": (7.0, 9.0)},
+    {"hba1c": (None, 6.5), "egfr": (60, None)},
+    {"risk_score": (40, 40)},
+    {"bmi": (30, None), "obesity_class": ["class1", "class2"], "smoking_status": ["current"]},
+    {"diabetes_type": ["not_a_value"]},
+]
+
+
+@pytest.mark.parametrize("filters", CASES)
+def test_match_agrees_with_pandas(frame, filters):
+    index = CohortIndex.build(frame)
+    rows = bitmap_rows(index.match(filters))
+    np.testing.assert_array_equal(rows, expected_rows(frame, filters))
+    assert index.count(filters) == len(rows)
+
+
+def test_query_pages_through_matches(frame):
+    index = CohortIndex.build(frame)
+    filters = {"risk_level": ["moderate"], "age": (40, 70)}
+    want = expected_rows(frame, filters)
+    pages = [index.query(filters, page=p, page_size=64) for p in range(len(want) // 64 + 2)]
+    assert all(p["total"] == len(want) for p in pages)
+    np.testing.assert_array_equal(np.concatenate([p["rows"] for p in pages]), want)
+    assert pages[0]["patient_ids"] == frame["patient_id"].iloc[want[:64]].tolist()
+
+
+# 40 rows stay in the overlay; 300 exceed COMPACT_FRACTION and rebuild the ranges
+@pytest.mark.parametrize("n", [40, 300])
+def test_update_reflects_new_values(frame, n):
+    index = CohortIndex.build(frame)
+    changed = frame.sample(n=n, random_state=1)[["patient_id"]].assign(risk_level="critical", risk_score=99, egfr=30.0)
+    index.update(changed)
+    updated = frame.set_index("patient_id")
+    updated.update(changed.set_index("patient_id"))
+    updated = updated.reset_index()
+    for filters in ({"risk_level": ["critical"]}, {"risk_score": (95, None)}, {"conditions": ["CKD"]}, {"egfr": (None, 45)}):
+        np.testing.assert_array_equal(bitmap_rows(index.match(filters)), expected_rows(updated, filters))
+
+
+def test_save_load_round_trip(frame, tmp_path):
+    index = CohortIndex.build(frame)
+    index.save(tmp_path/"cohort_index.npz")
+    loaded = CohortIndex.load(tmp_path/"cohort_index.npz")
+    for filters in CASES:
+        np.testing.assert_array_equal(loaded.match(filters), index.match(filters))
+
+
+def test_unknown_condition_raises(frame):
+    index = CohortIndex.build(frame)
+    with pytest.raises(KeyError, match="Unknown condition"):
+        index.match({"conditions": ["not_a_condition"]})
+
+
+def test_parse_filter_rejects_bare_range():
+    with pytest.raises(ValueError):
+        parse_filter("hba1c=7")
+
+
+def test_bitmap_helpers():
+    rng = np.random.default_rng(0)
+    mask = rng.random(1000) < 0.3
+    words = pack(mask, (len(mask) + 63) // 64)
+    assert popcount(words) == mask.sum()
+    np.testing.assert_array_equal(bitmap_rows(words), np.flatnonzero(mask))
+    np.testing.assert_array_equal(bitmap_rows(words, 10, 25), np.flatnonzero(mask)[10:35])
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from sklearn.linear_model import LogisticRegression
+
+from compiled_scorer import CompiledScorer, compile_ensemble, save_compiled
+from train_models import HAS_LGBM, HAS_XGB, LGBMClassifier, XGBClassifier, prepare_data
+
+
+def library_proba(models, pre, X):
+    Xt = pre.transform(X)
+    return np.vstack([m.predict_proba(Xt)[:, 1] for m in models]).mean(axis=0)
+
+
+def fit(df, models, **kwargs):
+    X, y, pre, _, _ = prepare_data(df.drop(columns=["risk_score"], errors="ignore"), **kwargs)
+    Xt = pre.fit_transform(X)
+    for m in models:
+        m.fit(Xt, y)
+    return X, pre, models
+
+
+def boosters(**lgbm):
+    models = []
+    if HAS_LGBM:
+        models.append(LGBMClassifier(n_estimators=30, num_leaves=15, random_state=0, verbose=-1, **lgbm))
+    if HAS_XGB:
+        models.append(XGBClassifier(n_estimators=30, max_depth=4, random_state=0))
+    if not models:
+        pytest.skip("no gradient boosting backend installed")
+    return models
+
+
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_matches_library_ensemble(cohort, dtype, tmp_path):
+    X, pre, models = fit(cohort, [LogisticRegression(max_iter=500)] + boosters(), dtype=dtype)
+    path = save_compiled(compile_ensemble(models, pre), tmp_path/"scorer.npz")
+    got = CompiledScorer.load(path).predict_proba(X)
+    np.testing.assert_allclose(got, library_proba(models, pre, X), atol=1e-6)
+
+
+def test_missing_values_follow_default_branch(cohort):
+    df = cohort.copy()
+    rng = np.random.default_rng(0)
+    for c in ("hba1c", "egfr", "bnp"):
+        df.loc[rng.random(len(df)) < 0.2, c] = np.nan
+    X, pre, models = fit(df, boosters())
+    got = CompiledScorer(compile_ensemble(models, pre)).predict_proba(X)
+    np.testing.assert_allclose(got, library_proba(models, pre, X), atol=1e-6)
+
+
+@pytest.mark.skipif(not HAS_LGBM, reason="lightgbm not installed")
+def test_lgbm_zero_as_missing():
+    # Exact zeros must take the default branch of Zero-type splits even when the batch holds no NaN; continuous
+    # features make the default direction disagree with the threshold test for a zero
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(rng.normal(size=(3000, 4)), columns=["a", "b", "c", "d"])
+    df = df.mask(rng.random(df.shape) < 0.3, 0.0)
+    df["sex"] = rng.choice(["F", "M"], len(df))
+    df["risk_level"] = np.where(df["a"] - df["b"] + 0.5 * rng.normal(size=len(df)) > 0, "high", "low")
+    X, pre, models = fit(df, [LGBMClassifier(n_estimators=50, zero_as_missing=True, random_state=0, verbose=-1)], sparse=True)
+    got = CompiledScorer(compile_ensemble(models, pre)).predict_proba(X)
+    np.testing.assert_allclose(got, library_proba(models, pre, X), atol=1e-6)
+
+
+def test_unknown_category_encodes_as_zeros(cohort):
+    X, pre, models = fit(cohort, [LogisticRegression(max_iter=500)])
+    X = X.head(50).copy()
+    X["race"] = "not_a_category"
+    got = CompiledScorer(compile_ensemble(models, pre)).predict_proba(X)
+    np.testing.assert_allclose(got, library_proba(models, pre, X), atol=1e-6)
+
+
+@pytest.mark.skipif(not HAS_LGBM, reason="lightgbm not installed")
+def test_wide_trees_across_blocks():
+    # A noisy target grows full 63-leaf trees, whose leaves span eight mask bytes; small blocks put seams inside the batch
+    rng = np.random.default_rng(1)
+    df = pd.DataFrame(rng.normal(size=(4000, 6)), columns=list("abcdef"))
+    df["sex"] = rng.choice(["F", "M"], len(df))
+    df["risk_level"] = np.where(np.sin(3 * df["a"]) * df["b"] + rng.normal(size=len(df)) > 0, "high", "low")
+    X, pre, models = fit(df, [LGBMClassifier(n_estimators=20, num_leaves=63, min_child_samples=5, random_state=0, verbose=-1)])
+    scorer = CompiledScorer(compile_ensemble(models, pre))
+    assert max(words for words, _, _ in scorer.members[0][1]["trees"]) > 2
+    got = scorer.member_proba(np.asarray(pre.transform(X), dtype=np.float64), batch_size=300).mean(axis=0)
+    np.testing.assert_allclose(got, library_proba(models, pre, X), atol=1e-6)
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+
+from drift_monitor import bin_counts, binned_ks, psi, reference_profile, score_chunk, stream_drift
+from train_models import model_ensemble, prepare_data, train_ensemble
+
+
+def test_psi_and_binned_ks():
+    assert psi([50, 50], [50, 50]) == 0 and binned_ks([50, 50], [50, 50]) == 0
+    # Proportions, not counts, are compared
+    assert psi([1, 1], [20, 20]) == 0
+    assert psi([50, 50], [90, 10]) == pytest.approx(0.4 * np.log(1.8) + 0.4 * np.log(5))
+    assert binned_ks([50, 50], [90, 10]) == pytest.approx(0.4)
+    # An empty bin is floored at eps instead of dividing by zero
+    assert np.isfinite(psi([100, 0], [50, 50]))
+    assert binned_ks([], []) == 0.0
+
+
+def test_bin_counts_edges_and_tails():
+    counts = bin_counts(np.array([-5.0, 0.0, 0.5, 1.0, 9.0]), [0.0, 1.0])
+    # A value on an edge belongs to the bin above it; values past either end fall into the open tails
+    assert counts.tolist() == [1, 2, 2]
+
+
+@pytest.fixture(scope="module")
+def reference(cohort, tmp_path_factory):
+    df = cohort.head(1000)
+    X, y, pre, numeric_cols, categorical_cols = prepare_data(df)
+    models, _ = train_ensemble(model_ensemble({"LogisticRegression": {"max_iter": 200}, "LGBMClassifier": {"n_estimators": 10, "verbose": -1},
+                                               "XGBClassifier": {"n_estimators": 10}}), pre.fit_transform(X), y.to_numpy())
+    bundle = {"models": models, "pre": pre}
+    profile = reference_profile(X, numeric_cols, categorical_cols, score_chunk(bundle, X))
+    path = tmp_path_factory.mktemp("drift")/"reference.csv"
+    df.to_csv(path, index=False)
+    return df, profile, bundle, path
+
+
+def test_stream_drift_on_the_reference_itself(reference):
+    df, profile, bundle, path = reference
+    report = stream_drift(path, profile, bundle, chunk_size=170)
+    assert report["rows"] == len(df) and report["missing_columns"] == []
+    assert all(d["psi"] == 0 and d["status"] == "ok" for d in report["features"].values())
+    assert all(d["ks"] == 0 for d in report["features"].values() if "ks" in d)
+    # Scores are recomputed chunk by chunk from the CSV and land in the same bins as at training time
+    assert report["prediction"]["psi"] == pytest.approx(0, abs=1e-9)
+    assert report["summary"]["alert"] == [] and report["summary"]["warn"] == []
+
+
+def test_stream_drift_flags_shifts(reference, tmp_path):
+    df, profile, bundle, _ = reference
+    drifted = df.copy()
+    drifted["hba1c"] += 2.0
+    drifted.loc[drifted.index[::10], "egfr"] = np.nan
+    drifted["race"] = drifted["race"].where(drifted.index % 4 != 0, "unknown_group")
+    drifted = drifted.drop(columns=["bnp"])
+    path = tmp_path/"drifted.csv"
+    drifted.to_csv(path, index=False)
+
+    report = stream_drift(path, profile, bundle, chunk_size=170)
+    hba1c, egfr, race = (report["features"][c] for c in ("hba1c", "egfr", "race"))
+    assert hba1c["status"] == "alert" and hba1c["psi"] > 0.25 and hba1c["ks"] > 0.5
+    assert hba1c["mean_new"] == pytest.approx(hba1c["mean_ref"] + 2.0, abs=1e-3)
+    # Missing values only move the missing rate, which flags the feature on its own
+    assert egfr["missing_rate_delta"] == pytest.approx(0.1) and egfr["status"] == "alert"
+    assert race["unseen_rate"] == pytest.approx(0.25)
+    assert report["missing_columns"] == ["bnp"] and "prediction" not in report
+    assert report["summary"]["top_psi"][0]["feature"] == "hba1c"
+
+    # One chunk or many: only bin counts are accumulated, so the result is the same
+    whole = stream_drift(path, profile, bundle, chunk_size=10_000)
+    for c, d in report["features"].items():
+        assert d == pytest.approx(whole["features"][c], nan_ok=True)
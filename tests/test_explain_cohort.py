@@ -0,0 +1,37 @@
+import numpy as np
+import pytest
+
+from explain_cohort import _forward_selection, _weighted_ridge
+
+lime_base = pytest.importorskip("lime.lime_base")
+
+
+@pytest.fixture
+def batch():
+    rng = np.random.default_rng(0)
+    b, n, d = 4, 400, 9
+    Z = rng.normal(size=(b, n, d))
+    y = Z[:, :, 2] - 0.7 * Z[:, :, 5] + 0.3 * Z[:, :, 0] * Z[:, :, 1] + 0.1 * rng.normal(size=(b, n))
+    w = np.exp(-rng.random((b, n)))
+    return Z, y, w
+
+
+@pytest.mark.parametrize("k", [1, 3, 6])
+def test_forward_selection_matches_lime(batch, k):
+    Z, y, w = batch
+    got = _forward_selection(Z, y, w, k)
+    base = lime_base.LimeBase(kernel_fn=lambda d: d)
+    for i in range(len(Z)):
+        want = base.forward_selection(Z[i], y[i], w[i], k)
+        assert got[i].tolist() == list(want)
+
+
+def test_weighted_ridge_matches_sklearn(batch):
+    from sklearn.linear_model import Ridge
+
+    Z, y, w = batch
+    coef, intercept = _weighted_ridge(Z, y, w, alpha=1.0)
+    for i in range(len(Z)):
+        ref = Ridge(alpha=1.0).fit(Z[i], y[i], sample_weight=w[i])
+        np.testing.assert_allclose(coef[i], ref.coef_, atol=1e-8)
+        np.testing.assert_allclose(intercept[i], ref.intercept_, atol=1e-8)
@@ -0,0 +1,62 @@
+import json
+
+import pytest
+
+from patient_store import EXPLANATION_STORE, PatientStore, attach_explanations, id_width_for, write_patient_store
+
+
+def test_round_trip(tmp_path):
+    records = {f"PAT_{i:06d}": {"risk_score": i % 100, "risk_level": "high" if i % 3 else "low", "labs": [i, None]} for i in range(2500)}
+    info = write_patient_store(records, tmp_path/"patients.store")
+    store = PatientStore(tmp_path/"patients.store")
+    assert info["records"] == len(store) == len(records)
+    for pid in ("PAT_000000", "PAT_001234", "PAT_002499"):
+        assert store.get(pid) == records[pid]
+    assert dict(store.items()) == records
+    assert list(dict(store.items())) == list(records)
+    assert store.get("PAT_999999") is None and "PAT_999999" not in store
+    store.close()
+
+
+def test_streamed_records_match_dict(tmp_path):
+    pairs = [(f"P{i}", {"i": i}) for i in range(100)]
+    write_patient_store(iter(pairs), tmp_path/"a.store", count=len(pairs))
+    write_patient_store(dict(pairs), tmp_path/"b.store")
+    assert (tmp_path/"a.store").read_bytes() == (tmp_path/"b.store").read_bytes()
+    with pytest.raises(ValueError, match="More than count"):
+        write_patient_store(iter(pairs), tmp_path/"c.store", count=10)
+
+
+def test_non_ascii_ids(tmp_path):
+    records = {"é" * 20: {"n": 1}, "患者" * 8: {"n": 2}, "plain": {"n": 3}}
+    width = id_width_for(records)
+    assert width == 48
+    write_patient_store(records, tmp_path/"patients.store", id_width=width)
+    store = PatientStore(tmp_path/"patients.store")
+    assert {pid: store.get(pid) for pid in records} == records
+    store.close()
+    with pytest.raises(ValueError, match="longer than"):
+        write_patient_store(records, tmp_path/"narrow.store")
+
+
+def test_duplicate_id_rejected(tmp_path):
+    with pytest.raises(ValueError, match="Duplicate patient_id"):
+        write_patient_store([("P1", {}), ("P2", {}), ("P1", {})], tmp_path/"patients.store")
+    assert not (tmp_path/"patients.store").exists()
+
+
+def test_attach_explanations_prefers_shap_store(tmp_path):
+    write_patient_store({"P1": {"risk_score": 10}, "P2": {"risk_score": 20}, "P3": {"risk_score": 30}}, tmp_path/"patients.store")
+    write_patient_store({"P1": {"method": "shap"}}, tmp_path/"shap"/EXPLANATION_STORE)
+    attach_explanations(tmp_path/"patients.store", {"P1": {"method": "lime"}, "P2": {"method": "lime"}}, shap_dir=tmp_path/"shap")
+    store = PatientStore(tmp_path/"patients.store")
+    assert store.get("P1") == {"risk_score": 10, "explanation": {"method": "shap"}}
+    assert store.get("P2") == {"risk_score": 20, "explanation": {"method": "lime"}}
+    assert store.get("P3") == {"risk_score": 30}
+    store.close()
+
+
+def test_rejects_other_files(tmp_path):
+    (tmp_path/"x.store").write_text(json.dumps({"not": "a store"}).ljust(128))
+    with pytest.raises(ValueError, match="not a patient store"):
+        PatientStore(tmp_path/"x.store")
@@ -0,0 +1,83 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+import run_pipeline
+
+SMALL_PARAMS = {"LogisticRegression": {"max_iter": 200}, "LGBMClassifier": {"n_estimators": 10, "verbose": -1}, "XGBClassifier": {"n_estimators": 10}}
+
+
+@pytest.fixture
+def cohort_csv(cohort, tmp_path):
+    path = tmp_path/"cohort.csv"
+    cohort.head(600).to_csv(path, index=False)
+    return path
+
+
+@pytest.fixture
+def stages(monkeypatch):
+    # Stub stages that log the order they run in and the frame they were handed
+    events, frames = [], []
+    read_csv = pd.read_csv
+
+    def load(*args, **kwargs):
+        events.append("load")
+        return read_csv(*args, **kwargs)
+
+    def dashboard(df, outdir):
+        events.append("dashboard")
+        frames.append(df)
+        return [outdir/"dashboard.json"]
+
+    def train(df, *args, **kwargs):
+        events.append("train")
+        frames.append(df)
+        return {"regressions": []}
+
+    class Executor(ThreadPoolExecutor):
+        def submit(self, fn, *args):
+            events.append("dashboard submitted")
+            return super().submit(fn, *args)
+
+    def executor(df):
+        run_pipeline._SHARED["df"] = df
+        return Executor(max_workers=1)
+
+    monkeypatch.setattr(run_pipeline.pd, "read_csv", load)
+    monkeypatch.setattr(run_pipeline, "build_dashboard", dashboard)
+    monkeypatch.setattr(run_pipeline, "train_and_write", train)
+    monkeypatch.setattr(run_pipeline, "dashboard_executor", executor)
+    return events, frames
+
+
+def test_sequential_stage_order(cohort_csv, tmp_path, stages):
+    events, frames = stages
+    report = run_pipeline.run_pipeline(cohort_csv, tmp_path/"out", sequential=True)
+    assert events == ["load", "dashboard", "train"]
+    # One parse shared by both stages
+    assert frames[0] is frames[1] and len(frames[0]) == 600
+    assert report["mode"] == "sequential" and report["dashboard_outputs"] == [str(tmp_path/"out"/"dashboard.json")]
+    assert run_pipeline._SHARED == {}
+
+
+def test_concurrent_submits_dashboard_before_training(cohort_csv, tmp_path, stages):
+    events, frames = stages
+    report = run_pipeline.run_pipeline(cohort_csv, tmp_path/"out")
+    # The dashboard worker must exist before training starts threads of its own (fork safety)
+    assert events[:2] == ["load", "dashboard submitted"] and sorted(events[2:]) == ["dashboard", "train"]
+    assert frames[0] is frames[1]
+    assert report["mode"] == "concurrent" and set(report["timings"]) == {"load", "dashboard", "train", "wall"}
+    assert run_pipeline._SHARED == {}
+
+
+def test_run_pipeline_end_to_end(cohort_csv, tmp_path):
+    outdir = tmp_path/"out"
+    report = run_pipeline.run_pipeline(cohort_csv, outdir, params=SMALL_PARAMS, latency=False, perf_history=outdir/"perf_history.jsonl")
+    assert json.loads((outdir/"pipeline_run.json").read_text()) == report
+    assert report["dashboard_outputs"] and all(Path(p).exists() for p in report["dashboard_outputs"])
+    for name in ("ensemble.joblib", "patients.store", "performance_trained.json"):
+        assert (outdir/name).exists(), name
+    assert report["serial_estimate"] > report["timings"]["dashboard"] + report["timings"]["train"]
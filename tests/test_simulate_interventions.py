@@ -0,0 +1,78 @@
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+
+import simulate_interventions
+from simulate_interventions import FROZEN_INPUTS, apply_scenario, frozen_inputs, simulate
+from train_models import model_ensemble, prepare_data, train_ensemble
+
+SCENARIO = {"name": "bp_and_statin", "edits": [
+    {"column": "systolic_bp", "op": "at_most", "value": 139, "where": [{"column": "age", "op": ">", "value": 50}]},
+    {"column": "statin_adherence", "op": "at_least", "value": 0.8},
+]}
+
+
+def flat_score(X):
+    return np.full(len(X), 0.5)
+
+
+def test_apply_scenario_recomputes_derived_features():
+    # Row 1 carries stored flags that disagree with its values: rows a scenario leaves alone must keep them
+    X = pd.DataFrame({
+        "systolic_bp": [150.0, 130.0, 320.0, 150.0],
+        "bp_control_indicator": [0, 0, 0, 0],
+        "sbp_implausible": [0, 0, 1, 0],
+        "systolic_bp_outlier": [0, 1, 1, 0],
+        "ace_inhibitor_adherence": [0.4, 0.9, 0.8, 0.0],
+        "beta_blocker_adherence": [0.6, 0.9, 0.8, 0.0],
+        "statin_adherence": [0.5, 0.9, 0.8, 0.2],
+        "diabetes_med_adherence": [0.7, 0.9, 0.8, 0.0],
+        "pdc_mean_adherence": [0.55, 0.0, 0.8, 0.05],
+    })
+    extra = pd.DataFrame({"age": [60, 60, 60, 40]})
+    changed, updates = apply_scenario(X, extra, SCENARIO, {"systolic_bp": (140.0, 10.0)})
+    assert changed.tolist() == [True, False, True, True]
+    assert updates["systolic_bp"].tolist() == [139.0, 130.0, 139.0, 150.0]
+    assert updates["bp_control_indicator"].tolist() == [1, 0, 1, 0]
+    assert updates["sbp_implausible"].tolist() == [0, 0, 0, 0]
+    assert updates["systolic_bp_outlier"].tolist() == [0, 1, 0, 0]
+    np.testing.assert_allclose(updates["pdc_mean_adherence"], [0.625, 0.0, 0.8, 0.2])
+    assert all(updates[c].dtype == X[c].dtype for c in updates)
+
+
+def test_prepare_data_exclude(cohort):
+    X = prepare_data(cohort, exclude=FROZEN_INPUTS)[0]
+    assert not set(FROZEN_INPUTS) & set(X.columns)
+    assert frozen_inputs(X.columns) == ["prob_low_outlier", "prob_critical_outlier"]
+    X = prepare_data(cohort, exclude=frozen_inputs(cohort.columns))[0]
+    assert frozen_inputs(X.columns) == [] and "risk_level" not in X.columns
+
+
+def test_report_marked_invalid_with_frozen_inputs(cohort):
+    df = cohort.head(200)
+    report, _ = simulate(df, flat_score, np.float32, [SCENARIO], progress=False)
+    assert not report["valid"] and report["frozen_inputs"] == frozen_inputs(df.columns)
+    report, _ = simulate(df, flat_score, np.float32, [SCENARIO], progress=False, exclude=frozen_inputs(df.columns))
+    assert report["valid"] and report["frozen_inputs"] == []
+
+
+@pytest.mark.parametrize("exclude", [False, True])
+def test_cli_refuses_frozen_ensemble(cohort, tmp_path, monkeypatch, exclude):
+    df = cohort.head(500)
+    X, y, pre, _, _ = prepare_data(df, exclude=frozen_inputs(df.columns) if exclude else ())
+    models, _ = train_ensemble(model_ensemble({"LogisticRegression": {"max_iter": 200}, "LGBMClassifier": {"n_estimators": 5, "verbose": -1},
+                                               "XGBClassifier": {"n_estimators": 5}}), pre.fit_transform(X), y.to_numpy())
+    joblib.dump({"models": models, "pre": pre}, tmp_path/"ensemble.joblib")
+    df.to_csv(tmp_path/"cohort.csv", index=False)
+    monkeypatch.setattr(sys, "argv", ["simulate_interventions.py", "--input", str(tmp_path/"cohort.csv"), "--data_dir", str(tmp_path),
+                                      "--output", str(tmp_path/"interventions.json")])
+    if not exclude:
+        with pytest.raises(SystemExit, match="--exclude risk_score"):
+            simulate_interventions.main()
+        assert not (tmp_path/"interventions.json").exists()
+    else:
+        simulate_interventions.main()
+        assert (tmp_path/"interventions.json").exists()
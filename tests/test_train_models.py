@@ -0,0 +1,332 @@
+import json
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.model_selection import train_test_split
+
+import train_models
+from patient_store import PatientStore
+from train_models import (HAS_LGBM, HAS_XGB, IMBALANCE_STRATEGIES, LGBMClassifier, LogisticRegression, XGBClassifier, allocate_threads,
+                          balanced_batches, chunked_smote, cross_validate, ensemble_scores, fit_models, fold_cache_key, incremental_retrain, model_ensemble,
+                          perf_fingerprint, prepare_data, rebalance, risk_levels, supersede_patients, train_and_write, train_ensemble,
+                          write_explanations, write_outputs, write_perf_json)
+
+# Small members so a full ensemble fits in about a second on the 2,000-row slice
+SMALL_PARAMS = {"LogisticRegression": {"max_iter": 200}, "LGBMClassifier": {"n_estimators": 20, "verbose": -1}, "XGBClassifier": {"n_estimators": 20}}
+
+
+@pytest.fixture(scope="module")
+def matrix(cohort):
+    X, y, pre, _, _ = prepare_data(cohort)
+    return pre.fit_transform(X), y.to_numpy()
+
+
+def members(*kinds):
+    available = {"lr": lambda: LogisticRegression(), "lgbm": HAS_LGBM and (lambda: LGBMClassifier()), "xgb": HAS_XGB and (lambda: XGBClassifier())}
+    if not all(available[k] for k in kinds):
+        pytest.skip("gradient boosting backend not installed")
+    return [available[k]() for k in kinds]
+
+
+@pytest.mark.parametrize("kinds, n_jobs, expected", [
+    (("lr", "lgbm", "xgb"), 8, [1, 4, 3]),
+    (("lr", "lgbm", "xgb"), 4, [1, 2, 1]),
+    (("lr", "lgbm", "xgb"), 1, [1, 1, 1]),
+    (("lgbm", "xgb"), 5, [3, 2]),
+    (("lr",), 8, [1]),
+])
+def test_allocate_threads(kinds, n_jobs, expected):
+    threads = allocate_threads(members(*kinds), n_jobs)
+    assert threads == expected
+    # The budget is never exceeded unless every booster already sits at one thread
+    assert sum(threads) <= max(n_jobs, len(kinds))
+
+
+@pytest.mark.parametrize("n_jobs", [None, 2])
+def test_train_ensemble_fits_members_in_order(matrix, n_jobs):
+    Xt, y = matrix
+    models, timings = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y, n_jobs=n_jobs)
+    names = [m.__class__.__name__ for m in model_ensemble(SMALL_PARAMS)]
+    assert [m.__class__.__name__ for m in models] == names
+    for m in models:
+        assert m.predict_proba(Xt[:5]).shape == (5, 2)
+    assert set(timings) == set(names) | {"total"}
+    assert all(v >= 0 for v in timings.values())
+    assert timings["total"] >= max(timings[n] for n in names) * (0.999 if n_jobs is None else 0)
+
+
+def test_parallel_fit_matches_sequential(matrix):
+    Xt, y = matrix
+    sequential, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y)
+    parallel, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y, n_jobs=3)
+    # saga shuffles without a fixed seed, so only the boosters are reproducible run to run
+    for a, b in zip(sequential[1:], parallel[1:]):
+        np.testing.assert_allclose(a.predict_proba(Xt)[:, 1], b.predict_proba(Xt)[:, 1], atol=1e-6)
+    boosters = [m for m in parallel if not isinstance(m, LogisticRegression)]
+    assert [m.get_params()["n_jobs"] for m in boosters] == allocate_threads(model_ensemble(SMALL_PARAMS), 3)[-len(boosters):]
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+def test_fold_cache_key_ignores_dtype_spelling(cohort, sparse):
+    # train_models --cv passes np.float32, tune_models passes the parsed --dtype string
+    keys = set()
+    for dtype in (np.float32, "float32", np.dtype("float32")):
+        X, y, pre, _, _ = prepare_data(cohort, dtype=dtype, sparse=sparse)
+        keys.add(fold_cache_key(X, y, pre, 5, "smote"))
+    assert len(keys) == 1
+    X, y, pre, _, _ = prepare_data(cohort, dtype=np.float64, sparse=sparse)
+    assert fold_cache_key(X, y, pre, 5, "smote") not in keys
+
+
+def test_cross_validate_reuses_cached_folds(cohort, tmp_path, capsys):
+    X, y, pre, _, _ = prepare_data(cohort)
+    cv = cross_validate(X, y, pre, k=2, cache_dir=tmp_path, params=SMALL_PARAMS)
+    assert [f["fold"] for f in cv["folds"]] == [0, 1] and sum(f["n_test"] for f in cv["folds"]) == len(y)
+    assert sum(cv["pooled"]["confusion"].values()) == len(y)
+    assert cv["mean_auc"] == pytest.approx(np.mean([f["auc"] for f in cv["folds"]]))
+    assert "Reusing" not in capsys.readouterr().out
+    fold_files = sorted(tmp_path.glob("*/fold_*.joblib"))
+    stamps = [p.stat().st_mtime_ns for p in fold_files]
+    assert len(fold_files) == 2
+
+    # New hyperparameters train on the same cached matrices; a new imbalance strategy needs folds of its own
+    cross_validate(X, y, pre, k=2, cache_dir=tmp_path, params={**SMALL_PARAMS, "LGBMClassifier": {"n_estimators": 10, "verbose": -1}})
+    assert "Reusing cached folds" in capsys.readouterr().out
+    assert [p.stat().st_mtime_ns for p in sorted(tmp_path.glob("*/fold_*.joblib"))] == stamps
+    cross_validate(X, y, pre, k=2, imbalance="weights", cache_dir=tmp_path, params=SMALL_PARAMS)
+    assert len(list(tmp_path.iterdir())) == 2
+
+
+def test_prepare_data_keeps_dtype(cohort):
+    for dtype, sparse in ((np.float32, False), (np.float32, True), (np.float64, False)):
+        X, y, pre, numeric_cols, _ = prepare_data(cohort, dtype=dtype, sparse=sparse)
+        Xt = pre.fit_transform(X)
+        assert Xt.dtype == dtype
+        assert hasattr(Xt, "tocsr") == sparse
+        assert (X[numeric_cols].dtypes == dtype).all()
+    assert set(np.unique(y)) == {0, 1}
+
+
+def test_risk_levels_thresholds():
+    # A score on a threshold belongs to the higher level
+    levels = risk_levels(np.array([0.0, 0.349, 0.35, 0.65, 0.85, 1.0]))
+    assert levels.tolist() == ["low", "low", "moderate", "high", "critical", "critical"]
+
+
+@pytest.mark.parametrize("sparse", [False, True])
+@pytest.mark.parametrize("strategy", IMBALANCE_STRATEGIES)
+def test_rebalance_strategies(cohort, strategy, sparse):
+    X, y, pre, _, _ = prepare_data(cohort, sparse=sparse)
+    Xt, y = pre.fit_transform(X), y.to_numpy()
+    out, y_out, w = rebalance(Xt, y, strategy)
+    assert hasattr(out, "tocsr") == sparse and out.dtype == np.float32
+    assert out.shape == (len(y_out), Xt.shape[1])
+    dense = (lambda m: m.toarray()) if sparse else np.asarray
+    counts = np.bincount(y_out)
+    if strategy in ("smote", "approx_smote"):
+        # Oversampling appends synthetic minority rows after the untouched originals
+        assert counts[0] == counts[1] == np.bincount(y).max()
+        np.testing.assert_array_equal(dense(out[:len(y)]), dense(Xt))
+    elif strategy == "batch":
+        assert counts[0] == counts[1] == np.bincount(y).min()
+    elif strategy == "weights":
+        assert out is Xt and w.shape == y.shape
+        assert w[y == 0].sum() == pytest.approx(w[y == 1].sum())
+    else:
+        assert out is Xt and (y_out == y).all()
+    assert (w is None) == (strategy != "weights")
+
+
+def test_rebalance_rejects_unknown_strategy(matrix):
+    with pytest.raises(ValueError, match="unknown imbalance strategy"):
+        rebalance(*matrix, "undersample")
+
+
+def test_chunked_smote_interpolates_within_chunks(matrix):
+    Xt, y = matrix
+    out, y_out = chunked_smote(Xt, y, chunk_size=100)
+    assert np.bincount(y_out).tolist() == [np.bincount(y).max()] * 2
+    # Every synthetic row lies on a segment between two minority rows
+    minority = Xt[y == 1]
+    synthetic = out[len(y):]
+    assert (synthetic >= minority.min(axis=0) - 1e-6).all() and (synthetic <= minority.max(axis=0) + 1e-6).all()
+    assert synthetic.dtype == Xt.dtype
+
+
+def test_balanced_batches_balance_every_batch():
+    y = np.r_[np.zeros(900, dtype=int), np.ones(100, dtype=int)]
+    idx = balanced_batches(y, batch_size=200)
+    assert (np.diff(idx) > 0).all()
+    assert np.bincount(y[idx]).tolist() == [100, 100]
+    order = np.random.RandomState(42).permutation(len(y))
+    for i in range(0, len(y), 200):
+        batch = np.intersect1d(order[i:i + 200], idx)
+        assert (y[batch] == 0).sum() == (y[batch] == 1).sum()
+
+
+def test_weights_reach_every_member(cohort, monkeypatch):
+    seen = {}
+    for cls in (LogisticRegression, LGBMClassifier, XGBClassifier):
+        if cls is None:
+            continue
+        fit = cls.fit
+
+        def spy(self, Xt, y, *args, _fit=fit, **kwargs):
+            seen[self.__class__.__name__] = kwargs.get("sample_weight")
+            return _fit(self, Xt, y, *args, **kwargs)
+
+        monkeypatch.setattr(cls, "fit", spy)
+    X, y, pre, _, _ = prepare_data(cohort)
+    fit_models(X, y, pre, params=SMALL_PARAMS, imbalance="weights")
+    assert set(seen) == {m.__class__.__name__ for m in model_ensemble(SMALL_PARAMS)}
+    for w in seen.values():
+        assert w is not None and len(np.unique(w)) == 2
+
+
+def test_weights_reach_members_fitted_in_workers(matrix):
+    # Worker processes load the weights from the shared matrix file; the boosters are deterministic, so a weighted
+    # parallel fit matches the weighted sequential one and not the unweighted
+    Xt, y = matrix
+    _, _, w = rebalance(Xt, y, "weights")
+    weighted, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y, sample_weight=w)
+    parallel, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y, n_jobs=3, sample_weight=w)
+    plain, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y, n_jobs=3)
+    for a, b, c in zip(weighted[1:], parallel[1:], plain[1:]):
+        np.testing.assert_allclose(a.predict_proba(Xt)[:, 1], b.predict_proba(Xt)[:, 1], atol=1e-6)
+        assert not np.allclose(b.predict_proba(Xt)[:, 1], c.predict_proba(Xt)[:, 1])
+
+
+def perf_run(tmp_path, batch_p50_ms, params, rows=2000):
+    metrics = {"timings": {"preprocess": 0.1, "resample": 0.1, "fit": {"total": 1.0}}}
+    latency = {"single_row_ms": {"p50": 1.0, "p95": 2.0}, "batch_ms": {"p50": batch_p50_ms, "p95": batch_p50_ms * 1.5}}
+    settings = {"input": "cohort.csv", "dtype": "float32", "sparse": False, "rows": rows, "imbalance": "smote"}
+    return write_perf_json(metrics, latency, {"ensemble.joblib": 1000}, tmp_path, settings, history_path=tmp_path/"history.jsonl", params=params)
+
+
+def test_perf_fingerprint_ignores_params_and_revision():
+    settings = {"input": "a.csv", "rows": 10, "dtype": "float32"}
+    assert perf_fingerprint({**settings, "params": {"LGBMClassifier": {"num_leaves": 8}}, "revision": "abc"}) == perf_fingerprint(settings)
+    assert perf_fingerprint({**settings, "rows": 11}) != perf_fingerprint(settings)
+
+
+def test_regression_flagged_across_a_params_change(tmp_path):
+    first = perf_run(tmp_path, 10.0, {"LGBMClassifier": {"num_leaves": 31}})
+    assert first["regressions"] == []
+    second = perf_run(tmp_path, 100.0, {"LGBMClassifier": {"num_leaves": 255}})
+    flagged = {r["metric"]: r for r in second["regressions"]}
+    assert set(flagged) == {"predict_batch_p50_ms", "predict_batch_p95_ms"}
+    assert flagged["predict_batch_p50_ms"]["ratio"] == pytest.approx(10.0)
+    assert flagged["predict_batch_p50_ms"]["params_changed"]
+    # A different cohort size has no baseline
+    assert perf_run(tmp_path, 1000.0, None, rows=5000)["regressions"] == []
+    assert len((tmp_path/"history.jsonl").read_text().splitlines()) == 3
+    assert json.loads((tmp_path/"performance_trained.json").read_text())["settings"]["rows"] == 5000
+
+
+def test_train_and_write_measures_latency_by_default(cohort, tmp_path):
+    X, y, pre, numeric_cols, categorical_cols = prepare_data(cohort)
+    perf = train_and_write(cohort, X, y, pre, numeric_cols, categorical_cols, tmp_path, params=SMALL_PARAMS)
+    assert perf["latency"]["batch_ms"]["p50"] > 0 and perf["latency"]["single_row_ms"]["n"] > 0
+    assert perf["params"] == SMALL_PARAMS and "params" not in perf["settings"]
+    for name in ("ensemble.joblib", "predictions.json", "patients.store", "evaluation_trained.json", "performance_trained.json", "explanations.json"):
+        assert (tmp_path/name).exists(), name
+
+
+def test_plain_retrain_drops_stale_cohort_explanations(cohort, tmp_path):
+    X, y, pre, _, _ = prepare_data(cohort)
+    Xt = pre.fit_transform(X)
+    models, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y.to_numpy())
+    for sub in ("shap", "lime"):
+        (tmp_path/sub).mkdir()
+        (tmp_path/sub/"index.json").write_text("{}")
+    write_explanations(models, pre, cohort, X, tmp_path, sample_size=20, Xt=Xt)
+    assert not (tmp_path/"shap").exists() and not (tmp_path/"lime").exists()
+    assert [p.name for p in tmp_path.iterdir()] == ["explanations.json"]
+
+
+def test_patient_store_matches_predictions(cohort, matrix, tmp_path):
+    Xt, y = matrix
+    X, _, pre, _, _ = prepare_data(cohort)
+    pre.fit(X)
+    models, _ = train_ensemble(model_ensemble(SMALL_PARAMS), Xt, y)
+    df = cohort.copy()
+    df.loc[::7, "hba1c"] = np.nan
+    df.loc[::11, "diabetes_type"] = np.nan
+    write_outputs(models, pre, df, X, tmp_path, Xt=Xt)
+    predictions = json.loads((tmp_path/"predictions.json").read_text())
+    store = PatientStore(tmp_path/"patients.store")
+    assert len(store) == len(predictions) == len(df)
+    assert all(store.get(str(r["patient_id"])) == r for r in predictions)
+    assert store.get(str(df["patient_id"].iloc[7]))["hba1c"] is None
+    store.close()
+
+
+def fitted_bundle(df, **kwargs):
+    X, y, pre, _, _ = prepare_data(df, **kwargs)
+    models, _ = train_ensemble(model_ensemble(SMALL_PARAMS), pre.fit_transform(X), y.to_numpy())
+    return {"models": models, "pre": pre}
+
+
+def tree_count(m):
+    return m.booster_.num_trees() if HAS_LGBM and isinstance(m, LGBMClassifier) else m.get_booster().num_boosted_rounds()
+
+
+def test_incremental_retrain_warm_starts_and_compares_on_holdout(cohort):
+    old, new = cohort.iloc[:1500], cohort.iloc[1500:]
+    bundle = fitted_bundle(old)
+    updated, pre, report = incremental_retrain(bundle, old, new, extra_trees=5, params=SMALL_PARAMS)
+    assert pre is bundle["pre"]
+    # Each booster continues from its saved trees; the saved ensemble itself is left as it was
+    for before, after in zip(bundle["models"][1:], updated[1:]):
+        assert (tree_count(before), tree_count(after)) == (20, 25)
+    assert report["n_new"] == 500 and report["n_holdout"] == 100 and report["n_replay"] == 150 and report["n_superseded"] == 0
+
+    # Every model is scored on the same held-out fifth of the new batch
+    X_new, y_new, _, _, _ = prepare_data(new)
+    _, X_hold, _, y_hold = train_test_split(X_new, y_new, test_size=0.2, random_state=42, stratify=y_new)
+    Xt_hold = pre.transform(X_hold)
+    assert report["previous"] == ensemble_scores(bundle["models"], Xt_hold, y_hold)
+    assert {k: report["incremental"][k] for k in ("auc", "ap")} == ensemble_scores(updated, Xt_hold, y_hold)
+    assert report["auc_gap"] == pytest.approx(report["full"]["auc"] - report["incremental"]["auc"])
+
+
+def test_incremental_retrain_uses_saved_matrix_settings(cohort, monkeypatch):
+    seen = []
+    warm_start = train_models.warm_start_models
+
+    def spy(models, Xt, y, **kwargs):
+        seen.append((Xt.dtype, hasattr(Xt, "tocsr")))
+        return warm_start(models, Xt, y, **kwargs)
+
+    monkeypatch.setattr(train_models, "warm_start_models", spy)
+    old, new = cohort.iloc[:1500], cohort.iloc[1500:]
+    incremental_retrain(fitted_bundle(old, dtype=np.float64, sparse=True), old, new, extra_trees=2, compare_full=False)
+    assert seen == [(np.float64, True)]
+
+
+def test_supersede_patients():
+    old = pd.DataFrame({"patient_id": ["a", "b", "c"], "v": [1, 2, 3]})
+    new = pd.DataFrame({"patient_id": ["b", "d", "b"], "v": [4, 5, 6]})
+    old, new = supersede_patients(old, new)
+    assert old["patient_id"].tolist() == ["a", "c"]
+    assert new.values.tolist() == [["d", 5], ["b", 6]]
+
+
+def test_incremental_cli_with_resent_patients(cohort, tmp_path, monkeypatch):
+    # Patients re-sent in the new batch (one of them twice) must not reach patients.store as duplicate keys
+    old, new = cohort.iloc[:1500], pd.concat([cohort.iloc[1500:], cohort.iloc[[3, 10, 10]]])
+    old.to_csv(tmp_path/"old.csv", index=False)
+    new.to_csv(tmp_path/"new.csv", index=False)
+    (tmp_path/"params.json").write_text(json.dumps(SMALL_PARAMS))
+    X, y, pre, numeric_cols, categorical_cols = prepare_data(old)
+    train_and_write(old, X, y, pre, numeric_cols, categorical_cols, tmp_path, params=SMALL_PARAMS, latency=False)
+    monkeypatch.setattr(sys, "argv", ["train_models.py", "--input", str(tmp_path/"old.csv"), "--outdir", str(tmp_path), "--incremental",
+                                      str(tmp_path/"new.csv"), "--params", str(tmp_path/"params.json"), "--extra_trees", "2", "--no_compare"])
+    train_models.main()
+    assert json.loads((tmp_path/"incremental_report.json").read_text())["n_superseded"] == 3
+    store = PatientStore(tmp_path/"patients.store")
+    assert len(store) == 2000
+    assert store.get(str(cohort["patient_id"].iloc[10]))["patient_id"] == cohort["patient_id"].iloc[10]
+    store.close()
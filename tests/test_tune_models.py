@@ -0,0 +1,89 @@
+import json
+import math
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytest
+
+import tune_models
+from train_models import HAS_LGBM, HAS_XGB, cache_folds, load_tuned_params, model_ensemble, prepare_data
+from tune_models import RESOURCES, SPACES, _run_trial, best_params, hyperband, sample_config
+
+
+def fake_trial(member, config, resource, fold_path):
+    # Deterministic stand-in: C closest to 1 scores best, and more budget always helps a little
+    auc = 0.9 - abs(math.log(config["C"])) / 100 + resource / 1e6
+    return {"member": member, "config": config, "resource": resource, "used_resource": resource, "auc": auc, "logloss": 1 - auc, "seconds": 0.0}
+
+
+@pytest.fixture
+def fake_trials(monkeypatch):
+    monkeypatch.setattr(tune_models, "_run_trial", fake_trial)
+
+
+def test_successive_halving_schedule(fake_trials):
+    # LogisticRegression spans 50..2000 iterations: with eta=3 the one bracket runs 27, 9, 3, 1 configs
+    with ThreadPoolExecutor(2) as pool:
+        trials = hyperband("LogisticRegression", None, pool, time_budget=60, eta=3, brackets=1)
+    rungs = [[t for t in trials if t["rung"] == i] for i in range(4)]
+    assert [len(r) for r in rungs] == [27, 9, 3, 1]
+    assert [r[0]["resource"] for r in rungs] == [74, 222, 667, 2000]
+    # Each rung promotes the best third of the one before
+    for lower, upper in zip(rungs, rungs[1:]):
+        best = sorted(lower, key=lambda t: -t["auc"])[:len(upper)]
+        assert sorted(t["config"]["C"] for t in best) == sorted(t["config"]["C"] for t in upper)
+
+
+def test_hyperband_runs_every_bracket(fake_trials):
+    with ThreadPoolExecutor(2) as pool:
+        trials = hyperband("LogisticRegression", None, pool, time_budget=60, eta=3)
+    assert sorted({t["bracket"] for t in trials}) == [0, 1, 2, 3]
+    # The last bracket starts at the full budget
+    assert {t["resource"] for t in trials if t["bracket"] == 0} == {RESOURCES["LogisticRegression"][2]}
+
+
+def test_exhausted_budget_runs_nothing(fake_trials):
+    with ThreadPoolExecutor(1) as pool:
+        assert hyperband("LogisticRegression", None, pool, time_budget=0) == []
+
+
+def test_best_params_prefers_the_largest_budget():
+    trials = [
+        {"config": {"num_leaves": 8}, "resource": 800, "used_resource": 412, "auc": 0.80, "logloss": 0.5},
+        {"config": {"num_leaves": 16}, "resource": 800, "used_resource": 800, "auc": 0.80, "logloss": 0.4},
+        {"config": {"num_leaves": 64}, "resource": 266, "used_resource": 266, "auc": 0.95, "logloss": 0.1},
+    ]
+    # Equal AUC at the top budget falls back to log loss; early stopping's round count becomes n_estimators
+    assert best_params("LGBMClassifier", trials) == {"num_leaves": 16, "n_estimators": 800, "subsample_freq": 1}
+    trials[1]["auc"] = 0.7
+    assert best_params("LGBMClassifier", trials)["n_estimators"] == 412
+
+
+@pytest.mark.parametrize("member", list(SPACES))
+def test_run_trial_on_cached_fold(cohort, tmp_path, member):
+    if (member == "LGBMClassifier" and not HAS_LGBM) or (member == "XGBClassifier" and not HAS_XGB):
+        pytest.skip("gradient boosting backend not installed")
+    X, y, pre, _, _ = prepare_data(cohort)
+    fold_path = cache_folds(X, y, pre, 2, tmp_path)[0]
+    config = sample_config(member, np.random.default_rng(0))
+    trial = _run_trial(member, config, 60, fold_path)
+    assert trial["config"] == config and 0 < trial["used_resource"] <= 60
+    assert 0.5 < trial["auc"] <= 1 and trial["logloss"] > 0
+
+
+def test_main_persists_best_params(cohort, tmp_path, monkeypatch, fake_trials):
+    cohort.to_csv(tmp_path/"cohort.csv", index=False)
+    output = tmp_path/"tuned_params.json"
+    output.write_text(json.dumps({"XGBClassifier": {"max_depth": 3}}))
+    monkeypatch.setattr(tune_models, "ProcessPoolExecutor", ThreadPoolExecutor)
+    monkeypatch.setattr(sys, "argv", ["tune_models.py", "--input", str(tmp_path/"cohort.csv"), "--output", str(output), "--cache_dir",
+                                      str(tmp_path/"folds"), "--k", "2", "--members", "LogisticRegression", "--method", "sh", "--n_jobs", "1"])
+    tune_models.main()
+    tuned = load_tuned_params(output)
+    # Members that were not tuned keep their earlier entry
+    assert tuned["XGBClassifier"] == {"max_depth": 3}
+    assert set(tuned["LogisticRegression"]) == {"C", "max_iter"} and tuned["LogisticRegression"]["max_iter"] == 2000
+    assert model_ensemble(tuned)[0].get_params()["C"] == tuned["LogisticRegression"]["C"]
+    trials = json.loads((tmp_path/"tuning_trials.json").read_text())["LogisticRegression"]["trials"]
+    assert len(trials) == 40